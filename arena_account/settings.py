@@ -38,6 +38,28 @@ CSRF_TRUSTED_ORIGINS = [ALLOWED_SCHEME + host for host in ALLOWED_HOSTS]
 
 X_FRAME_OPTIONS = "SAMEORIGIN"
 MQTT_TOKEN_PRIVKEY = os.getenv("MQTT_TOKEN_PRIVKEY")
+# compact token profile: prefix-grouped publ_c/subs_c claims, see docs/mqtt-v2.md
+MQTT_TOKEN_COMPACT = os.getenv("MQTT_TOKEN_COMPACT", "False").lower() in ("1", "true", "yes")
+# serve the I/O-bound API endpoints as coroutines, for ASGI deployments only, see users/api_async.py
+ASYNC_API = os.getenv("ASYNC_API", "False").lower() in ("1", "true", "yes")
+# threads signing tokens for the async API
+TOKEN_SIGNING_THREADS = int(os.getenv("TOKEN_SIGNING_THREADS", str(min(4, os.cpu_count() or 1))))
+# /health: seconds each dependency check may take, and seconds a result is served from cache (0: check per request)
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "5"))
+# circuit breakers for the File Store and MongoDB: consecutive failures to open, seconds open before a trial call
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+# materialized per-scene persist stats, see users/persistence.py: seconds between incremental and full rebuilds
+# (PERSIST_STATS_INTERVAL=0 aggregates arenaobjects on every read instead)
+PERSIST_STATS_INTERVAL = int(os.getenv("PERSIST_STATS_INTERVAL", "60"))
+# also the longest a scene's summary stays stale after arena-persist deletes objects (incl. expireAt TTL deletes)
+PERSIST_STATS_FULL_INTERVAL = int(os.getenv("PERSIST_STATS_FULL_INTERVAL", "3600"))
+# serve persist scene summaries from a change stream on arenaobjects, needs a replica set, see users/persist_watch.py
+PERSIST_WATCH = os.getenv("PERSIST_WATCH", "False").lower() in ("1", "true", "yes")
+# async persist client of users/persistence_async.py: connections per worker, seconds to find a mongodb server
+PERSIST_ASYNC_POOL_SIZE = int(os.getenv("PERSIST_ASYNC_POOL_SIZE", "20"))
+PERSIST_ASYNC_SELECTION_TIMEOUT = float(os.getenv("PERSIST_ASYNC_SELECTION_TIMEOUT", "5"))
 
 # namespaces that are reserved for the webserver, see arena-web-core and nginx
 USERNAME_RESERVED = [
@@ -222,11 +244,36 @@ WSGI_APPLICATION = "arena_account.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv("SQLITE_DB_PATH", BASE_DIR / "db.sqlite3"),
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# LocMemCache is per process, gunicorn.conf.py switches multiple workers to a shared backend
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", "arena-account"),
+    }
+}
+
+# seconds an entry invalidated on change stays in a per-process cache (LocMemCache), where other processes
+# never see the invalidation, see users/caching.py
+LOCAL_CACHE_TIMEOUT = int(os.getenv("LOCAL_CACHE_TIMEOUT", "10"))
+# per-user namespace/scene grants used to build tokens and resource lists
+PERMISSIONS_CACHE_ALIAS = os.getenv("PERMISSIONS_CACHE_ALIAS", "default")
+PERMISSIONS_CACHE_TIMEOUT = int(os.getenv("PERMISSIONS_CACHE_TIMEOUT", "3600"))  # seconds
+# scene permission flags read by every token request for that scene
+SCENE_PERMS_CACHE_TIMEOUT = int(os.getenv("SCENE_PERMS_CACHE_TIMEOUT", "3600"))  # seconds
+# verified Google id_tokens, kept until each token's own exp
+ID_TOKEN_CACHE_ALIAS = os.getenv("ID_TOKEN_CACHE_ALIAS", "default")
+# per-user filestore jwts returned by /storelogin, kept until shortly before each token's own exp
+FILESTORE_TOKEN_CACHE_ALIAS = os.getenv("FILESTORE_TOKEN_CACHE_ALIAS", "default")
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -14,6 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import include, path
 from users.api import apis
 
@@ -32,3 +33,6 @@ for version, api in apis.items():
         urlpatterns.append(path("user/", api.urls))  # v1 default
     else:
         urlpatterns.append(path(f"user/{version}/", api.urls))
+
+# serve static files from the app dirs while DEBUG is on, also under gunicorn (no-op otherwise)
+urlpatterns += staticfiles_urlpatterns()
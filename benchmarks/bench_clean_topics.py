@@ -0,0 +1,110 @@
+"""Benchmark users/mqtt.py clean_topics against the previous quadratic collapse.
+
+Builds the v2 topic lists a non-staff user with N namespace/scene grants would
+receive and times the original pairwise topic_matches_sub() reduction against
+the single-trie reducer now in clean_topics(), checking both give the same list.
+
+Usage:
+    python benchmarks/bench_clean_topics.py [N ...]
+"""
+
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "arena_account.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from users.mqtt import (  # noqa: E402
+    clean_topics,
+    topicv2_add_scene_reader,
+    topicv2_add_scene_writer,
+)
+from users.mqtt_match import MQTTMatcher  # noqa: E402
+
+REALM = "realm"
+DEFAULT_SIZES = [10, 100, 1000]
+
+
+def topic_matches_sub_trie(sub, topic):
+    """The pre-reducer topic_matches_sub(): one throwaway trie per call."""
+    matcher = MQTTMatcher()
+    matcher[sub] = True
+    try:
+        next(matcher.iter_match(topic))
+        return True
+    except StopIteration:
+        return False
+
+
+def clean_topics_quadratic(topics):
+    """The pre-reducer clean_topics(): every topic against every kept topic."""
+    topics = list(dict.fromkeys(topics))
+    topics.sort()
+    _topics = []
+    for topic in topics:
+        add = True
+        for have in _topics:
+            if topic_matches_sub_trie(have, topic):
+                add = False
+        if add:
+            _topics.append(topic)
+    return _topics
+
+
+def granted_topics(grants):
+    """pubs + subs for a user holding `grants` scene/namespace grants."""
+    ids = {"userid": "bob_0000000001", "userclient": "bob_0000000001_web"}
+    pubs = []
+    subs = []
+    topicv2_add_scene_reader(pubs, subs, REALM, "bob", "+", ids)
+    topicv2_add_scene_writer(pubs, subs, REALM, "bob", "+", ids)
+    for i in range(grants):
+        if i % 4 == 0:  # namespace editor
+            topicv2_add_scene_reader(pubs, subs, REALM, f"ns{i}", "+", ids)
+            topicv2_add_scene_writer(pubs, subs, REALM, f"ns{i}", "+", ids)
+        elif i % 4 == 1:  # namespace viewer
+            topicv2_add_scene_reader(pubs, subs, REALM, f"ns{i}", "+", ids)
+        elif i % 4 == 2:  # scene editor, some inside an already granted namespace
+            topicv2_add_scene_reader(pubs, subs, REALM, f"ns{i - 2}", f"scene{i}", ids)
+            topicv2_add_scene_writer(pubs, subs, REALM, f"ns{i - 2}", f"scene{i}", ids)
+        else:  # scene viewer
+            topicv2_add_scene_reader(pubs, subs, REALM, f"owner{i}", f"scene{i}", ids)
+    pubs.append("$NETWORK/latency")
+    return pubs + subs
+
+
+def bench(size):
+    topics = granted_topics(size)
+    start = time.perf_counter()
+    old = clean_topics_quadratic(topics)
+    old_s = time.perf_counter() - start
+    new = clean_topics(topics)
+    if old != new:
+        raise AssertionError(f"clean_topics output differs at {size} grants")
+    number = max(1, 2000 // size)
+    # the quadratic reducer takes tens of seconds at 1k grants, so the single
+    # timed run above stands there
+    if size <= 100:
+        old_s = min(timeit.repeat(lambda: clean_topics_quadratic(topics), number=number, repeat=3)) / number
+    new_s = min(timeit.repeat(lambda: clean_topics(topics), number=number, repeat=3)) / number
+    return len(topics), len(new), old_s, new_s
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or DEFAULT_SIZES
+    print(f"{'grants':>8} {'topics':>8} {'kept':>6} {'quadratic ms':>14} {'trie ms':>10} {'speedup':>9}")
+    for size in sizes:
+        n_topics, n_kept, old_s, new_s = bench(size)
+        print(
+            f"{size:>8} {n_topics:>8} {n_kept:>6} {old_s * 1000:>14.3f} {new_s * 1000:>10.3f} {old_s / new_s:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
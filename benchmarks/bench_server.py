@@ -0,0 +1,170 @@
+"""Load-test mqtt_auth served by runserver against the gunicorn production modes.
+
+Migrates a throwaway SQLite database, then for each server mode starts the
+server on a local port with the test signing key from users/tests/mqtt_keys.py,
+fires --requests anonymous POST /user/v2/mqtt_auth requests from --concurrency
+client threads and stops it again. Modes:
+
+    runserver       python manage.py runserver (single process, development)
+    gunicorn-wsgi   gunicorn.conf.py with gthread workers
+    gunicorn-asgi   gunicorn.conf.py with uvicorn workers and ASYNC_API
+
+Reports requests/sec, p50/p99 latency and errors per mode, and writes JSON
+results like benchmarks/bench_tokens.py.
+
+Usage:
+    python benchmarks/bench_server.py [--modes MODE ...] [--requests N] [--concurrency N]
+        [--workers N] [--output results.json]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from users.tests.mqtt_keys import PRIVATE_KEY_PATH  # noqa: E402
+
+MODES = ["runserver", "gunicorn-wsgi", "gunicorn-asgi"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_command(mode, port, workers):
+    if mode == "runserver":
+        return [sys.executable, "manage.py", "runserver", "--noreload", f"127.0.0.1:{port}"], {}
+    env = {"GUNICORN_BIND": f"127.0.0.1:{port}", "GUNICORN_WORKERS": str(workers)}
+    env["ASYNC_API"] = "true" if mode == "gunicorn-asgi" else "false"
+    return [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py"], env
+
+
+def wait_until_up(url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not answer {url} within {timeout}s")
+
+
+def load(url, total, concurrency):
+    local = threading.local()
+    data = {"username": "anonymous-bench", "client": "bench", "scene": "bench/lobby", "camid": "true"}
+
+    def one(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        begin = time.perf_counter()
+        try:
+            ok = local.session.post(url, data=data, timeout=30).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - begin, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, ok in results if not ok),
+        "requests_per_sec": total / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, round(0.99 * (len(latencies) - 1)))] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+def run_mode(mode, env, args):
+    port = free_port()
+    command, extra_env = server_command(mode, port, args.workers)
+    process = subprocess.Popen(
+        command, cwd=BASE_DIR, env={**env, **extra_env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f"http://127.0.0.1:{port}/user/v2"
+        wait_until_up(f"{base}/user_state", process)
+        load(f"{base}/mqtt_auth", min(50, args.requests), args.concurrency)  # warm up
+        return load(f"{base}/mqtt_auth", args.requests, args.concurrency)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="*", default=MODES, choices=MODES)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="bench_server_results.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    db_dir = tempfile.mkdtemp(prefix="arena-account-bench-")
+    try:
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "arena_account.settings",
+            "HOSTNAME": os.environ.get("HOSTNAME", "localhost"),
+            "SQLITE_DB_PATH": os.path.join(db_dir, "db.sqlite3"),
+            "MQTT_TOKEN_PRIVKEY": PRIVATE_KEY_PATH,
+            "DEBUG": "False",
+            "DJANGO_LOG_LEVEL": "ERROR",
+        }
+        subprocess.run([sys.executable, "manage.py", "migrate", "--noinput"], cwd=BASE_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        results = {}
+        for mode in args.modes:
+            results[mode] = run_mode(mode, env, args)
+            row = results[mode]
+            print(
+                f"{mode:<14} {row['requests_per_sec']:>9.0f} req/s  p50 {row['p50_ms']:>8.1f} ms"
+                f"  p99 {row['p99_ms']:>8.1f} ms  errors {row['errors']}"
+            )
+    finally:
+        shutil.rmtree(db_dir, True)
+
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(
+            {
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "workers": args.workers,
+                "results": results,
+            },
+            fh,
+            indent=2,
+            sort_keys=True,
+        )
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,256 @@
+"""Benchmark MQTT token issuance, offline, against an in-memory seeded database.
+
+Creates the test database (in-memory SQLite), seeds synthetic users, namespaces
+and scenes, signs with the throwaway key from users/tests/mqtt_keys.py, then
+times each scenario: generate_arena_token for an anonymous viewer, a scene
+owner, staff and a user holding --grants grants, plus the topic builders,
+clean_topics and topic_matches_sub on their own.
+
+Per scenario it reports p50/p99 latency, operations/sec, peak allocation per
+call (tracemalloc) and database queries per call, both with a cold and a warm
+permissions cache. Results are written as JSON so two commits can be compared:
+
+Usage:
+    python benchmarks/bench_tokens.py [--output results.json] [--compare base.json]
+        [--iterations N] [--users N] [--scenes N] [--grants N] [--only NAME ...]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "arena_account.settings")
+os.environ.setdefault("HOSTNAME", "localhost")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import AnonymousUser, User  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment  # noqa: E402
+
+from users.models import Namespace, Scene  # noqa: E402
+from users.mqtt import (  # noqa: E402
+    clean_topics,
+    generate_arena_token,
+    set_scene_perms_api_v1,
+    set_scene_perms_api_v2,
+)
+from users.mqtt_match import topic_matches_sub  # noqa: E402
+from users.permissions import get_scene_perms, get_user_grants  # noqa: E402
+from users.tests.mqtt_keys import PRIVATE_KEY_PATH, make_ids  # noqa: E402
+from users.versioning import API_V1, API_V2  # noqa: E402
+
+REALM = "realm"
+
+
+def seed(n_users, n_scenes, n_grants):
+    """Owners with scenes under their namespaces, staff, and one heavily granted user."""
+    owners = User.objects.bulk_create([User(username=f"owner{i}") for i in range(n_users)])
+    User.objects.create(username="root", is_staff=True)
+    granted = User.objects.create(username="granted")
+    Namespace.objects.bulk_create([Namespace(name=owner.username) for owner in owners])
+    Scene.objects.bulk_create(
+        [Scene(name=f"{owners[i % n_users].username}/scene{i}", public_write=bool(i % 2)) for i in range(n_scenes)]
+    )
+    extra_namespaces = Namespace.objects.bulk_create(
+        [Namespace(name=f"team{i}") for i in range(n_grants // 2)]
+    )
+    extra_scenes = Scene.objects.bulk_create(
+        [Scene(name=f"team{i}/shared{i}") for i in range(n_grants - n_grants // 2)]
+    )
+    # alternate edit/view grants, a quarter of each kind
+    rows = []
+    for i, namespace in enumerate(extra_namespaces):
+        through = Namespace.editors.through if i % 2 == 0 else Namespace.viewers.through
+        rows.append((through, through(namespace_id=namespace.pk, user_id=granted.pk)))
+    for i, scene in enumerate(extra_scenes):
+        through = Scene.editors.through if i % 2 == 0 else Scene.viewers.through
+        rows.append((through, through(scene_id=scene.pk, user_id=granted.pk)))
+    for through in {through for through, _ in rows}:
+        through.objects.bulk_create([row for t, row in rows if t is through])
+
+
+def scenarios(n_grants):
+    anon = AnonymousUser()
+    owner = User.objects.get(username="owner0")
+    staff = User.objects.get(username="root")
+    granted = User.objects.get(username="granted")
+    owner_scene = Scene.objects.filter(name__startswith="owner0/").values_list("name", flat=True).first()
+    granted_scene = Scene.objects.filter(name__startswith="team").values_list("name", flat=True).first()
+
+    def token(user, username, ns_scene=None, camid=False, version=API_V2):
+        ids = make_ids(username, camid=camid)
+        return lambda: generate_arena_token(
+            user=user, username=username, realm=REALM, ns_scene=ns_scene, ids=ids, version=version
+        )
+
+    granted_grants = get_user_grants(granted)
+    granted_ids = make_ids("granted")
+    perm = get_scene_perms(None)
+    granted_topics = []
+    for builder in (set_scene_perms_api_v1, set_scene_perms_api_v2):
+        pubs, subs = builder(granted, "granted", REALM, None, None, granted_ids, perm, granted_grants)
+        granted_topics.extend(pubs + subs)
+    filters = [f"{REALM}/s/+/+/+/+/+", f"{REALM}/s/team1/#", "+/s/#", f"{REALM}/s/team1/shared1/o/+/+"]
+    topic = f"{REALM}/s/team1/shared1/o/granted_0000000001_web/obj"
+
+    return {
+        "token_anon_scene": token(anon, "anonymous-bench", owner_scene, camid=True),
+        "token_owner_scene": token(owner, owner.username, owner_scene, camid=True),
+        "token_owner_general": token(owner, owner.username),
+        "token_staff_scene": token(staff, staff.username, owner_scene, camid=True),
+        f"token_granted{n_grants}_scene": token(granted, granted.username, granted_scene, camid=True),
+        f"token_granted{n_grants}_general": token(granted, granted.username),
+        f"token_granted{n_grants}_general_v1": token(granted, granted.username, version=API_V1),
+        f"perms_v1_granted{n_grants}": lambda: set_scene_perms_api_v1(
+            granted, "granted", REALM, None, None, granted_ids, perm, granted_grants
+        ),
+        f"perms_v2_granted{n_grants}": lambda: set_scene_perms_api_v2(
+            granted, "granted", REALM, None, None, granted_ids, perm, granted_grants
+        ),
+        f"clean_topics_granted{n_grants}": lambda: clean_topics(granted_topics),
+        "topic_matches_sub": lambda: [topic_matches_sub(sub, topic) for sub in filters],
+    }
+
+
+def clear_caches():
+    caches[settings.PERMISSIONS_CACHE_ALIAS].clear()
+
+
+def count_queries(func):
+    with CaptureQueriesContext(connection) as ctx:
+        func()
+    return len(ctx.captured_queries)
+
+
+def peak_allocation(func, repeat=5):
+    """Largest tracemalloc peak seen over a few calls, in bytes."""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            func()
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return max(peaks)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run_scenario(func, iterations):
+    clear_caches()
+    queries_cold = count_queries(func)
+    queries_warm = count_queries(func)
+    for _ in range(min(20, iterations)):
+        func()  # warm up caches and lazily compiled state
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter_ns()
+        func()
+        samples.append(time.perf_counter_ns() - begin)
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "p50_us": percentile(samples, 0.50) / 1000,
+        "p99_us": percentile(samples, 0.99) / 1000,
+        "mean_us": statistics.fmean(samples) / 1000,
+        "ops_per_sec": iterations / elapsed,
+        "peak_alloc_bytes": peak_allocation(func),
+        "queries_cold": queries_cold,
+        "queries_warm": queries_warm,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, base=None):
+    header = f"{'scenario':<34} {'p50 us':>10} {'p99 us':>10} {'ops/s':>10} {'peak KiB':>9} {'q cold':>6} {'q warm':>6}"
+    if base:
+        header += f" {'p50 vs base':>12}"
+    print(header)
+    for name, row in results.items():
+        line = (
+            f"{name:<34} {row['p50_us']:>10.1f} {row['p99_us']:>10.1f} {row['ops_per_sec']:>10.0f}"
+            f" {row['peak_alloc_bytes'] / 1024:>9.1f} {row['queries_cold']:>6} {row['queries_warm']:>6}"
+        )
+        if base and name in base:
+            line += f" {row['p50_us'] / base[name]['p50_us']:>11.2f}x"
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--scenes", type=int, default=5000)
+    parser.add_argument("--grants", type=int, default=1000)
+    parser.add_argument("--only", nargs="*", help="run only scenarios whose name contains one of these")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="earlier JSON results to compare p50 against")
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    # the test database of the sqlite backend lives in memory
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with override_settings(MQTT_TOKEN_PRIVKEY=PRIVATE_KEY_PATH):
+            seed(args.users, args.scenes, args.grants)
+            results = {}
+            for name, func in scenarios(args.grants).items():
+                if args.only and not any(part in name for part in args.only):
+                    continue
+                results[name] = run_scenario(func, args.iterations)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    base = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            base = json.load(fh)["results"]
+    print_results(results, base)
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "scale": {"users": args.users, "scenes": args.scenes, "grants": args.grants},
+                "results": results,
+            },
+            fh,
+            indent=2,
+            sort_keys=True,
+        )
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -17,4 +17,21 @@ u = User.objects.get(username=USER); \
 u.set_password(PASS);\
 u.save();" || true
 
-python manage.py runserver 0.0.0.0:8000
+# SERVER_MODE=runserver for the single-process development server, the default while DEBUG is on
+# (unset DEBUG is on, as in settings.py) for its static files and autoreload; SERVER_MODE=gunicorn overrides
+if [ -z "${SERVER_MODE}" ]; then
+    case "$(echo "${DEBUG:-True}" | tr '[:upper:]' '[:lower:]')" in
+        1|true|yes) SERVER_MODE=runserver ;;
+        *) SERVER_MODE=gunicorn ;;
+    esac
+fi
+if [ "${SERVER_MODE}" = "runserver" ]; then
+    python manage.py runserver 0.0.0.0:8000
+else
+    # production: multi-worker gunicorn, ASGI workers and async endpoints unless ASYNC_API=false.
+    # Workers must share CACHE_BACKEND, or one worker's cache invalidation (a revoked grant) is
+    # not seen by the others: gunicorn.conf.py defaults it to a file-based cache in CACHE_LOCATION
+    # (/tmp/arena-account-cache) and refuses to start more than one worker on LocMemCache.
+    export ASYNC_API="${ASYNC_API:-true}"
+    exec gunicorn --config gunicorn.conf.py
+fi
@@ -0,0 +1,67 @@
+"""Gunicorn settings for serving arena-account in production, see docker-entrypoint.sh.
+
+With ASYNC_API (the container default) workers are uvicorn ASGI workers running
+the coroutine endpoints of users/api_async.py; otherwise gthread WSGI workers.
+The app is preloaded, so workers fork with Django imported and the MQTT token
+signing key already parsed. More than one worker needs a cache they share, a
+file-based one under CACHE_LOCATION unless CACHE_BACKEND names another. Send HUP to the master for a graceful reload: new
+workers are started, old ones finish their requests within graceful_timeout.
+"""
+
+import multiprocessing
+import os
+
+ASYNC_API = os.getenv("ASYNC_API", "False").lower() in ("1", "true", "yes")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+# cache invalidations (revoked grants, scene flags, filestore tokens) must reach
+# every worker: with more than one, default to a cache on disk they all share and
+# refuse a per-process LocMemCache
+if workers > 1:
+    if not os.getenv("CACHE_BACKEND"):
+        os.environ["CACHE_BACKEND"] = "django.core.cache.backends.filebased.FileBasedCache"
+        os.environ.setdefault("CACHE_LOCATION", "/tmp/arena-account-cache")
+    elif os.environ["CACHE_BACKEND"].endswith(".LocMemCache"):
+        raise RuntimeError(
+            f"CACHE_BACKEND {os.environ['CACHE_BACKEND']} is per process, set one shared by all {workers} "
+            "workers (file-based, Redis, Memcached) or GUNICORN_WORKERS=1"
+        )
+if ASYNC_API:
+    wsgi_app = "arena_account.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "arena_account.wsgi:application"
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))  # seconds
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))  # seconds
+keepalive = 5  # seconds
+# recycle workers after this many requests, 0 never
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG")
+errorlog = "-"
+
+
+def when_ready(server):
+    # parse the signing key once in the master, every forked worker inherits it
+    from users.signing import get_signing_key
+
+    if get_signing_key() is None:
+        server.log.warning("MQTT token signing key not loaded: %s", os.getenv("MQTT_TOKEN_PRIVKEY"))
+
+
+def post_fork(server, worker):
+    # Mongo clients are not fork-safe, each worker connects on its own
+    from users import persist_db
+
+    persist_db.client = persist_db.db = None
+    persist_db.async_client = persist_db.async_loop = None
+    # nor are pooled connections, each worker opens its own filestore session
+    from users import filestore
+
+    filestore._session = None
@@ -1,20 +1,28 @@
 import datetime
+import itertools
+import json
 import os
 import re
 import secrets
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from allauth.socialaccount.models import SocialAccount
+from bson.errors import InvalidId
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import connection
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from ninja import Form, NinjaAPI, Schema
-from users.filestore import get_filestore_health, login_filestore_user
+from pymongo.errors import PyMongoError
+from users.circuit import CircuitOpenError
+from users.filestore import login_filestore_user
+from users.health import get_health
 from users.models import Scene
 from users.mqtt import ANON_REGEX, CLIENT_REGEX, generate_arena_token
-from users.persist_db import get_persist_db
-from users.schemas import MQTTAuthRequestSchema, NamespaceSchema, SceneSchema
+from users.permissions import load_permission_snapshot
+from users.persistence import iter_persist_scene_objects
+from users.schemas import MQTTAuthBatchRequestSchema, MQTTAuthRequestSchema, NamespaceSchema, SceneSchema
 from users.utils import (
+    device_edit_permission,
     get_my_edit_namespaces,
     get_my_edit_scenes,
     get_my_view_namespaces,
@@ -54,6 +62,11 @@ for version in SUPPORTED_API_VERSIONS:
     )
 
 router = VersionedRouter(SUPPORTED_API_VERSIONS)
+# I/O-bound endpoints, replaced by their users/api_async.py coroutines when settings.ASYNC_API
+sync_router = VersionedRouter(SUPPORTED_API_VERSIONS)
+
+MQTT_AUTH_BATCH_MAX = 100
+SCENE_OBJECTS_PAGE_MAX = 1000
 
 
 class UserStateSchema(Schema):
@@ -65,11 +78,21 @@ class UserStateSchema(Schema):
     is_staff: Optional[bool] = None
 
 
+class CircuitSchema(Schema):
+    state: str
+    failures: int
+    open_s: Optional[float] = None
+
+
 class HealthSchema(Schema):
     result: str
     sqlite_status: str
     mongo_status: str
     filestore_status: str
+    latency_ms: Dict[str, Optional[float]]
+    age_s: float
+    circuits: Dict[str, CircuitSchema]
+    filestore_http: Dict[str, Dict[str, int]]
 
 
 class StoreLoginSchema(Schema):
@@ -82,6 +105,19 @@ class MQTTAuthSchema(Schema):
     ids: dict
 
 
+class MQTTAuthBatchResultSchema(Schema):
+    scene: Optional[str] = None
+    device: Optional[str] = None
+    token: Optional[str] = None
+    ids: Optional[dict] = None
+    error: Optional[str] = None
+
+
+class MQTTAuthBatchSchema(Schema):
+    username: str
+    results: List[MQTTAuthBatchResultSchema]
+
+
 class ErrorSchema(Schema):
     error: str
 
@@ -90,22 +126,103 @@ class MessageSchema(Schema):
     message: str
 
 
-@router.api_operation(["GET", "POST"], "/user_state", response={200: UserStateSchema, 403: ErrorSchema})
-def user_state(request, id_token: str = Form(None)):
+def get_token_username(user, username):
     """
-    Endpoint request for the user's authenticated status, username, name, email: GET/POST.
-    - POST requires id_token for headless clients like Python apps.
+    Internal method returning the token username and None, or None and an error response.
     """
-    user = request.user
-    if request.method == "POST" and id_token:
-        try:
-            user = get_user_from_id_token(id_token)
-        except (ValueError, SocialAccount.DoesNotExist) as err:
-            return 403, {"error": str(err)}
+    if user.is_authenticated:
+        if not user.username:
+            return None, (401, {"error": "Invalid parameters"})
+        return user.username, None
+    if not username or not re.match(ANON_REGEX, username):
+        return None, (400, {"error": "Invalid form parameter: 'username'"})
+    return username, None
+
+
+def make_client_ids(username, payload, version):
+    """
+    Internal method to define user object_ids server-side to prevent spoofing.
+    """
+    # produce nonce with 32-bits secure randomness
+    nonce = f"{secrets.randbits(32):010d}"
+    if version == API_V2:
+        userid = f"{username}_{nonce}"
+    else:
+        userid = f"{nonce}_{username}"
+
+    # always include userid in responses for user_client origin checking
+    ids = {}
+    ids["userid"] = userid
+    ids["userclient"] = f"{userid}_{payload.client}"
+
+    # add avatar objects if requested
+    if payload.camid:
+        ids["camid"] = userid if version == API_V2 else f"camera_{userid}"
+    if payload.handleftid:
+        ids["handleftid"] = f"handLeft_{userid}"
+    if payload.handrightid:
+        ids["handrightid"] = f"handRight_{userid}"
+
+    # add host requests, permission checked later
+    if payload.renderfusionid:
+        ids["renderfusionid"] = "-"
+    if payload.environmentid:
+        ids["environmentid"] = "-"
+    return ids
 
+
+def get_token_duration(user):
+    """
+    Internal method for the token lifetime: a day for accounts, six hours for anonymous.
+    """
+    if user.is_authenticated:
+        return datetime.timedelta(days=1)
+    return datetime.timedelta(hours=6)
+
+
+def token_response(username, token, ids):
+    """
+    Internal method to build the mqtt_auth response, setting the mqtt_token cookie when it fits.
+    """
+    data = {
+        "username": username,
+        "token": token,
+        "ids": ids,
+    }
+
+    # Careful of token size in cookie:
+    # RFC 6265 states that user agents should support cookies of at least 4096 bytes. For many browsers this is also the maximum size. Django will not raise an exception if there’s an attempt to store a cookie of more than 4096 bytes, but many browsers will not set the cookie correctly.
+    response = JsonResponse(data)
+    if len(token) < 4096:
+        response.set_cookie(
+            "mqtt_token",
+            token,
+            max_age=86400000,
+            httponly=True,
+            secure=True,
+        )
+    return response
+
+
+def storelogin_response(fs_user_token):
+    """
+    Internal method to build the storelogin response, setting or clearing the filestore auth cookie.
+    """
+    response = HttpResponse()
+    if fs_user_token:
+        response.set_cookie("auth", fs_user_token)
+    else:
+        response.delete_cookie("auth")
+    return response
+
+
+def user_state_data(user):
+    """
+    Internal method for the user_state response body.
+    """
     if user.is_authenticated:
         auth_type = "arena" if user.username.startswith("admin") else "google"
-        return 200, {
+        return {
             "authenticated": True,
             "username": user.username,
             "fullname": user.get_full_name(),
@@ -113,11 +230,35 @@ def user_state(request, id_token: str = Form(None)):
             "type": auth_type,
             "is_staff": user.is_staff,
         }
-    else:
-        return 200, {"authenticated": False}
+    return {"authenticated": False}
+
+
+def merge_by_name(*lists):
+    """
+    Internal method to merge edit and view lists into one list sorted by name, deduplicated by name.
+    """
+    # merged_map keyed by name to deduplicate if needed, though they should be distinct lists typically
+    merged_map = {item["name"]: item for items in lists for item in items}
+    return sorted(list(merged_map.values()), key=lambda x: x["name"])
+
+
+@sync_router.api_operation(["GET", "POST"], "/user_state", response={200: UserStateSchema, 403: ErrorSchema})
+def user_state(request, id_token: str = Form(None)):
+    """
+    Endpoint request for the user's authenticated status, username, name, email: GET/POST.
+    - POST requires id_token for headless clients like Python apps.
+    """
+    user = request.user
+    if request.method == "POST" and id_token:
+        try:
+            user = get_user_from_id_token(id_token)
+        except (ValueError, SocialAccount.DoesNotExist) as err:
+            return 403, {"error": str(err)}
+
+    return 200, user_state_data(user)
 
 
-@router.api_operation(["GET", "POST"], "/storelogin", response={200: StoreLoginSchema, 403: ErrorSchema})
+@sync_router.api_operation(["GET", "POST"], "/storelogin", response={200: StoreLoginSchema, 403: ErrorSchema})
 def storelogin(request, id_token: str = Form(None)):
     """
     Endpoint request for the user's file store token: GET/POST.
@@ -130,16 +271,10 @@ def storelogin(request, id_token: str = Form(None)):
         except (ValueError, SocialAccount.DoesNotExist) as err:
             return 403, {"error": str(err)}
 
-    fs_user_token = login_filestore_user(user)
-    response = HttpResponse()
-    if fs_user_token:
-        response.set_cookie("auth", fs_user_token)
-    else:
-        response.delete_cookie("auth")
-    return response
+    return storelogin_response(login_filestore_user(user))
 
 
-@router.post("/mqtt_auth", response={200: MQTTAuthSchema, 400: ErrorSchema, 401: ErrorSchema, 403: ErrorSchema, 426: ErrorSchema})
+@sync_router.post("/mqtt_auth", response={200: MQTTAuthSchema, 400: ErrorSchema, 401: ErrorSchema, 403: ErrorSchema, 426: ErrorSchema})
 def mqtt_auth(
     request,
     payload: MQTTAuthRequestSchema = Form(...),
@@ -159,49 +294,15 @@ def mqtt_auth(
         except (ValueError, SocialAccount.DoesNotExist) as err:
             return 403, {"error": str(err)}
 
-    username = payload.username
-    if user.is_authenticated:
-        username = user.username
-        if not username:
-            return 401, {"error": "Invalid parameters"}
-    else:
-        if not username or not re.match(ANON_REGEX, username):
-            return 400, {"error": "Invalid form parameter: 'username'"}
+    username, error = get_token_username(user, payload.username)
+    if error:
+        return error
 
     if not payload.client or not re.match(CLIENT_REGEX, payload.client):
          return 400, {"error": "Invalid form parameter: 'client'"}
 
-    # produce nonce with 32-bits secure randomness
-    nonce = f"{secrets.randbits(32):010d}"
-    # define user object_ids server-side to prevent spoofing
-    if version == API_V2:
-        userid = f"{username}_{nonce}"
-    else:
-        userid = f"{nonce}_{username}"
-
-    # always include userid in responses for user_client origin checking
-    ids = {}
-    ids["userid"] = userid
-    ids["userclient"] = f"{userid}_{payload.client}"
-
-    # add avatar objects if requested
-    if payload.camid:
-        ids["camid"] = userid if version == API_V2 else f"camera_{userid}"
-    if payload.handleftid:
-        ids["handleftid"] = f"handLeft_{userid}"
-    if payload.handrightid:
-        ids["handrightid"] = f"handRight_{userid}"
-
-    # add host requests, permission checked later
-    if payload.renderfusionid:
-        ids["renderfusionid"] = "-"
-    if payload.environmentid:
-        ids["environmentid"] = "-"
-
-    if user.is_authenticated:
-        duration = datetime.timedelta(days=1)
-    else:
-        duration = datetime.timedelta(hours=6)
+    ids = make_client_ids(username, payload, version)
+    duration = get_token_duration(user)
 
     token = generate_arena_token(
         user=user,
@@ -216,59 +317,79 @@ def mqtt_auth(
     if not token:
         return 403, {"error": "Authentication required for this scene."}
 
-    data = {
-        "username": username,
-        "token": token,
-        "ids": ids,
-    }
+    return token_response(username, token, ids)
 
-    # Careful of token size in cookie:
-    # RFC 6265 states that user agents should support cookies of at least 4096 bytes. For many browsers this is also the maximum size. Django will not raise an exception if there’s an attempt to store a cookie of more than 4096 bytes, but many browsers will not set the cookie correctly.
-    response = JsonResponse(data)
-    if len(token) < 4096:
-        response.set_cookie(
-            "mqtt_token",
-            token,
-            max_age=86400000,
-            httponly=True,
-            secure=True,
-        )
-    return response
 
+@router.post("/mqtt_auth_batch", response={200: MQTTAuthBatchSchema, 400: ErrorSchema, 401: ErrorSchema, 403: ErrorSchema, 426: ErrorSchema})
+def mqtt_auth_batch(request, payload: MQTTAuthBatchRequestSchema):
+    """
+    Endpoint to request several ARENA tokens for one anonymous or authenticated user, one per scene
+    or device request, for headless clients like render-fusion hosts and bots joining many scenes.
+    - Identity and grants are resolved once for the whole batch.
+    - Each result carries either its token and ids or its own error.
+    """
+    version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
+    if version == API_V1:
+        return 426, {"error": f"ARENA User API {API_V2} token required."}
+
+    user = request.user
+    if payload.id_token:
+        try:
+            user = get_user_from_id_token(payload.id_token)
+        except (ValueError, SocialAccount.DoesNotExist) as err:
+            return 403, {"error": str(err)}
+
+    username, error = get_token_username(user, payload.username)
+    if error:
+        return error
+
+    if not payload.requests or len(payload.requests) > MQTT_AUTH_BATCH_MAX:
+        return 400, {"error": f"Invalid parameter: 'requests', 1 to {MQTT_AUTH_BATCH_MAX} entries required"}
+
+    grants = load_permission_snapshot(user).grants
+    duration = get_token_duration(user)
+    results = []
+    for entry in payload.requests:
+        result = {"scene": entry.scene, "device": entry.device}
+        if not entry.client or not re.match(CLIENT_REGEX, entry.client):
+            result["error"] = "Invalid parameter: 'client'"
+        elif entry.scene and entry.device:
+            result["error"] = "Request either 'scene' or 'device', not both."
+        elif entry.device and not device_edit_permission(user=user, device=entry.device):
+            result["error"] = f"User does not have permission for device: {entry.device}."
+        else:
+            ids = make_client_ids(username, entry, version)
+            token = generate_arena_token(
+                user=user,
+                username=username,
+                realm=entry.realm,
+                ns_scene=entry.scene,
+                ns_device=entry.device,
+                ids=ids,
+                duration=duration,
+                version=version,
+                grants=grants,
+            )
+            if token:
+                result["token"] = token
+                result["ids"] = ids
+            else:
+                result["error"] = "Authentication required for this scene."
+        results.append(result)
+
+    return 200, {"username": username, "results": results}
 
-@router.get("/health", response={200: HealthSchema, 503: HealthSchema})
+
+@sync_router.get("/health", response={200: HealthSchema, 503: HealthSchema})
 def health_state(request):
     """
     Endpoint request for the arena-account system health: GET.
+    - SQLite, MongoDB and File Store are checked concurrently, results cached, see users/health.py.
     """
-    # SQLite Check
-    try:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT 1")
-        sqlite_status = "healthy"
-    except Exception:
-        sqlite_status = "unhealthy"
-
-    # Mongo Check
-    try:
-        get_persist_db().command("ping")
-        mongo_status = "healthy"
-    except Exception:
-        mongo_status = "unhealthy"
-
-    # Filestore Check
-    if get_filestore_health():
-        filestore_status = "healthy"
-    else:
-        filestore_status = "unhealthy"
-
-    if sqlite_status == "healthy" and mongo_status == "healthy" and filestore_status == "healthy":
-        return 200, {"result": "success", "sqlite_status": sqlite_status, "mongo_status": mongo_status, "filestore_status": filestore_status}
-    else:
-        return 503, {"result": "failure", "sqlite_status": sqlite_status, "mongo_status": mongo_status, "filestore_status": filestore_status}
+    return get_health()
 
 
-@router.api_operation(["GET", "POST"], "/my_namespaces", response={200: List[NamespaceSchema], 403: ErrorSchema, 426: ErrorSchema})
+@sync_router.api_operation(["GET", "POST"], "/my_namespaces", response={200: List[NamespaceSchema], 403: ErrorSchema, 426: ErrorSchema})
 def list_my_namespaces(request, id_token: str = Form(None)):
     """
     Editable/viewable namespace headless endpoint for requesting a list of namespaces this user can edit and/or view: GET/POST.
@@ -287,12 +408,10 @@ def list_my_namespaces(request, id_token: str = Form(None)):
 
     edit_namespaces = get_my_edit_namespaces(user, version)
     view_namespaces = get_my_view_namespaces(user)
-    # merged_map keyed by name to deduplicate if needed, though they should be distinct lists typically
-    merged_map = {ns["name"]: ns for ns in edit_namespaces + view_namespaces}
-    return 200, sorted(list(merged_map.values()), key=lambda x: x["name"])
+    return 200, merge_by_name(edit_namespaces, view_namespaces)
 
 
-@router.api_operation(["GET", "POST"], "/my_scenes", response={200: List[SceneSchema], 403: ErrorSchema, 426: ErrorSchema})
+@sync_router.api_operation(["GET", "POST"], "/my_scenes", response={200: List[SceneSchema], 403: ErrorSchema, 426: ErrorSchema})
 def list_my_scenes(request, id_token: str = Form(None)):
     """
     Editable/viewable scenes headless endpoint for requesting a list of scenes this user can edit and/or view: GET/POST.
@@ -311,8 +430,7 @@ def list_my_scenes(request, id_token: str = Form(None)):
 
     edit_scenes = get_my_edit_scenes(user, version)
     view_scenes = get_my_view_scenes(user, version)
-    merged_map = {sc["name"]: sc for sc in edit_scenes + view_scenes}
-    return 200, sorted(list(merged_map.values()), key=lambda x: x["name"])
+    return 200, merge_by_name(edit_scenes, view_scenes)
 
 
 @router.api_operation(["GET", "POST", "PUT", "DELETE"], "/scenes/{path:scene_name}", response={200: SceneSchema, 201: SceneSchema, 400: ErrorSchema, 404: ErrorSchema})
@@ -402,6 +520,52 @@ def scene_detail(request, scene_name: str, payload: SceneSchema = None):
 
     return 400, {"error": "Method not allowed"}
 
+
+def stream_objects_page(objects, limit):
+    """
+    Internal generator writing {"objects": [...], "next": ...} one object at a time; next is the last _id when
+    the page is full, for after= of the following request, else null.
+    """
+    yield '{"objects": ['
+    last_id = None
+    count = 0
+    for obj in objects:
+        yield ("," if count else "") + json.dumps(obj)
+        last_id = obj.get("_id")
+        count += 1
+    yield f'], "next": {json.dumps(last_id if count == limit else None)}}}'
+
+
+@router.get("/scene_objects/{path:scene_name}", response={400: ErrorSchema, 403: ErrorSchema, 503: ErrorSchema})
+def scene_objects(request, scene_name: str, after: str = None, limit: int = 100):
+    """
+    Persisted objects of a scene, a page at a time in _id order and streamed as read from the database: GET.
+    - Pass the returned "next" as after= for the following page; it is null on the last page.
+    """
+    if not scene_edit_permission(user=request.user, scene=scene_name):
+        return 403, {"error": f"User does not have edit permission for scene: {scene_name}."}
+    if not 1 <= limit <= SCENE_OBJECTS_PAGE_MAX:
+        return 400, {"error": f"Invalid parameter: 'limit', 1 to {SCENE_OBJECTS_PAGE_MAX}"}
+    namespace, _, scene = scene_name.partition("/")
+    objects = iter_persist_scene_objects(namespace, scene, after=after, limit=limit)
+    try:
+        # fetch the first batch now, so a bad after= or an unavailable database is an error response
+        first = next(objects, None)
+    except InvalidId:
+        return 400, {"error": "Invalid parameter: 'after'"}
+    except (CircuitOpenError, PyMongoError) as err:
+        print(f"arena_persist: scene objects of {scene_name} not read: {err}")
+        return 503, {"error": "Persisted objects are unavailable, try again later."}
+    page = [] if first is None else itertools.chain([first], objects)
+    return StreamingHttpResponse(stream_objects_page(page, limit), content_type="application/json")
+
+
+if settings.ASYNC_API:
+    from users.api_async import async_router as io_router
+else:
+    io_router = sync_router
+
 # Add the router to all APIs
 for version, api in apis.items():
     api.add_router("", router.routers[version])
+    api.add_router("", io_router.routers[version])
@@ -0,0 +1,185 @@
+'''
+api_async.py: Coroutine versions of the I/O-bound endpoints in users/api.py,
+mounted in their place at the same paths when settings.ASYNC_API is set, for
+ASGI deployments. A worker then holds thousands of slow requests (Mongo,
+filestore, Google) on one event loop instead of one thread each.
+
+User lookups use the async ORM, persist reads the async client of
+users/persistence_async.py, and token signing runs on the bounded pool in
+users/signing.py. Helpers that are still synchronous run in threads via
+sync_to_async: those touching the ORM thread-sensitively, pure network calls
+(filestore, Google certs) on their own.
+'''
+
+import asyncio
+import re
+from typing import List
+
+from allauth.socialaccount.models import SocialAccount
+from asgiref.sync import sync_to_async
+from ninja import Form
+
+from users.api import (
+    ErrorSchema,
+    HealthSchema,
+    MQTTAuthSchema,
+    StoreLoginSchema,
+    UserStateSchema,
+    get_token_duration,
+    get_token_username,
+    make_client_ids,
+    merge_by_name,
+    storelogin_response,
+    token_response,
+    user_state_data,
+)
+from users.filestore import login_filestore_user
+from users.health import get_health
+from users.mqtt import CLIENT_REGEX, generate_arena_token
+from users.permissions import load_permission_snapshot
+from users.schemas import MQTTAuthRequestSchema, NamespaceSchema, SceneSchema
+from users.signing import run_in_signing_pool
+from users.utils import (
+    aget_my_edit_namespaces,
+    aget_my_edit_scenes,
+    aget_my_view_namespaces,
+    aget_my_view_scenes,
+    aget_user_from_id_token,
+)
+from users.versioning import API_V1, API_V2, SUPPORTED_API_VERSIONS, VersionedRouter
+
+async_router = VersionedRouter(SUPPORTED_API_VERSIONS)
+
+
+async def get_request_user(request, id_token):
+    """
+    Internal method returning the session user, or the id_token user when one is given.
+    """
+    if id_token:
+        return await aget_user_from_id_token(id_token)
+    return await request.auser()
+
+
+@async_router.api_operation(["GET", "POST"], "/user_state", response={200: UserStateSchema, 403: ErrorSchema})
+async def user_state(request, id_token: str = Form(None)):
+    """
+    Endpoint request for the user's authenticated status, username, name, email: GET/POST.
+    - POST requires id_token for headless clients like Python apps.
+    """
+    try:
+        user = await get_request_user(request, request.method == "POST" and id_token)
+    except (ValueError, SocialAccount.DoesNotExist) as err:
+        return 403, {"error": str(err)}
+    return 200, user_state_data(user)
+
+
+@async_router.api_operation(["GET", "POST"], "/storelogin", response={200: StoreLoginSchema, 403: ErrorSchema})
+async def storelogin(request, id_token: str = Form(None)):
+    """
+    Endpoint request for the user's file store token: GET/POST.
+    - POST requires id_token for headless clients like Python apps.
+    """
+    try:
+        user = await get_request_user(request, request.method == "POST" and id_token)
+    except (ValueError, SocialAccount.DoesNotExist) as err:
+        return 403, {"error": str(err)}
+    fs_user_token = await sync_to_async(login_filestore_user, thread_sensitive=False)(user)
+    return storelogin_response(fs_user_token)
+
+
+@async_router.post("/mqtt_auth", response={200: MQTTAuthSchema, 400: ErrorSchema, 401: ErrorSchema, 403: ErrorSchema, 426: ErrorSchema})
+async def mqtt_auth(
+    request,
+    payload: MQTTAuthRequestSchema = Form(...),
+):
+    """
+    Endpoint to request an ARENA token with permissions for an anonymous or authenticated user for
+    MQTT and Jitsi resources given incoming parameters.
+    """
+    version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
+    if version == API_V1:
+        return 426, {"error": f"ARENA User API {API_V2} token required."}
+
+    try:
+        user = await get_request_user(request, payload.id_token)
+    except (ValueError, SocialAccount.DoesNotExist) as err:
+        return 403, {"error": str(err)}
+
+    username, error = get_token_username(user, payload.username)
+    if error:
+        return error
+
+    if not payload.client or not re.match(CLIENT_REGEX, payload.client):
+         return 400, {"error": "Invalid form parameter: 'client'"}
+
+    ids = make_client_ids(username, payload, version)
+    duration = get_token_duration(user)
+
+    # load permissions here, so signing threads never touch the database
+    grants, perm = await sync_to_async(load_permission_snapshot)(user, payload.scene)
+    token = await run_in_signing_pool(
+        generate_arena_token,
+        user=user,
+        username=username,
+        realm=payload.realm,
+        ns_scene=payload.scene,
+        ids=ids,
+        duration=duration,
+        version=version,
+        grants=grants,
+        perm=perm,
+    )
+
+    if not token:
+        return 403, {"error": "Authentication required for this scene."}
+
+    return token_response(username, token, ids)
+
+
+@async_router.get("/health", response={200: HealthSchema, 503: HealthSchema})
+async def health_state(request):
+    """
+    Endpoint request for the arena-account system health: GET.
+    - SQLite, MongoDB and File Store are checked concurrently, results cached, see users/health.py.
+    """
+    return await sync_to_async(get_health, thread_sensitive=False)()
+
+
+@async_router.api_operation(["GET", "POST"], "/my_namespaces", response={200: List[NamespaceSchema], 403: ErrorSchema, 426: ErrorSchema})
+async def list_my_namespaces(request, id_token: str = Form(None)):
+    """
+    Editable/viewable namespace headless endpoint for requesting a list of namespaces this user can edit and/or view: GET/POST.
+    - POST requires id_token for headless clients like Python apps.
+    """
+    version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
+    if version == API_V1:
+        return 426, {"error": f"ARENA User API {API_V2} token required."}
+
+    try:
+        user = await get_request_user(request, request.method == "POST" and id_token)
+    except (ValueError, SocialAccount.DoesNotExist) as err:
+        return 403, {"error": str(err)}
+
+    edit_namespaces, view_namespaces = await asyncio.gather(
+        aget_my_edit_namespaces(user, version), aget_my_view_namespaces(user)
+    )
+    return 200, merge_by_name(edit_namespaces, view_namespaces)
+
+
+@async_router.api_operation(["GET", "POST"], "/my_scenes", response={200: List[SceneSchema], 403: ErrorSchema, 426: ErrorSchema})
+async def list_my_scenes(request, id_token: str = Form(None)):
+    """
+    Editable/viewable scenes headless endpoint for requesting a list of scenes this user can edit and/or view: GET/POST.
+    - POST requires id_token for headless clients like Python apps.
+    """
+    version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
+    if version == API_V1:
+        return 426, {"error": f"ARENA User API {API_V2} token required."}
+
+    try:
+        user = await get_request_user(request, request.method == "POST" and id_token)
+    except (ValueError, SocialAccount.DoesNotExist) as err:
+        return 403, {"error": str(err)}
+
+    edit_scenes, view_scenes = await asyncio.gather(aget_my_edit_scenes(user, version), aget_my_view_scenes(user, version))
+    return 200, merge_by_name(edit_scenes, view_scenes)
@@ -12,4 +12,7 @@ class UsersConfig(AppConfig):
     name = "users"
 
     def ready(self):
+        from .signals import connect_signals
+
         post_migrate.connect(post_migration_callback, sender=self)
+        connect_signals()
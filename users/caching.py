@@ -0,0 +1,29 @@
+'''
+caching.py: Timeouts for cache entries that are invalidated on change, so every
+process must see the invalidation.
+
+A revoked grant deletes or outdates its cached entry in the cache of the
+process that handled the change only, when that cache is per process
+(LocMemCache). Entries that must not outlive a change elsewhere are then kept
+at most settings.LOCAL_CACHE_TIMEOUT seconds, bounding how long another process
+can serve them. gunicorn.conf.py refuses LocMemCache for more than one worker.
+'''
+
+from django.conf import settings
+
+LOCAL_CACHE_BACKENDS = ("django.core.cache.backends.locmem.LocMemCache",)
+
+
+def is_shared_cache(alias):
+    """Returns True when the cache named alias is seen by every process, False for a per-process cache."""
+    return settings.CACHES[alias]["BACKEND"] not in LOCAL_CACHE_BACKENDS
+
+
+def invalidated_timeout(alias, timeout):
+    """Returns timeout for an entry invalidated on change, capped at settings.LOCAL_CACHE_TIMEOUT in a per-process
+    cache alias."""
+    if is_shared_cache(alias):
+        return timeout
+    if timeout is None:
+        return settings.LOCAL_CACHE_TIMEOUT
+    return min(timeout, settings.LOCAL_CACHE_TIMEOUT)
@@ -0,0 +1,146 @@
+'''
+circuit.py: Circuit breakers for the File Store and MongoDB dependencies, so an
+outage costs each request milliseconds instead of a full timeout.
+
+A breaker opens after settings.CIRCUIT_FAILURE_THRESHOLD consecutive failures
+and then fails calls at once with its open_error. After
+settings.CIRCUIT_RESET_TIMEOUT seconds it is half-open: a single trial call goes
+through, closing the breaker on success or opening it again on failure, while
+other calls keep failing fast. States are reported by /health.
+'''
+
+import functools
+import threading
+import time
+
+from django.conf import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_exceptions, failure_result=None, open_error=CircuitOpenError,
+                 failure_threshold=None, reset_timeout=None):
+        """
+        Args:
+            name (string): The dependency, for logs.
+            failure_exceptions (tuple): Exception types that count as the dependency failing; others mean it answered.
+            failure_result (callable): Optional test of a returned result counting as a failure, e.g. a 5xx response.
+            open_error (type): CircuitOpenError subclass raised while open, so callers can catch it with their
+                usual dependency errors.
+        """
+        self.name = name
+        self.failure_exceptions = failure_exceptions
+        self.failure_result = failure_result
+        self.open_error = open_error
+        self.failure_threshold = failure_threshold or settings.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or settings.CIRCUIT_RESET_TIMEOUT
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def before_call(self):
+        """Raises open_error unless a call may go through now; a half-open breaker lets one trial call through."""
+        with self._lock:
+            state = self._state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return
+        raise self.open_error(f"{self.name} unavailable, circuit open")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Circuit {self.name} open after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def call(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as err:
+            self._record_error(err)
+            raise
+        self._record_result(result)
+        return result
+
+    async def acall(self, func, *args, **kwargs):
+        """call() for a coroutine function."""
+        self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as err:
+            self._record_error(err)
+            raise
+        self._record_result(result)
+        return result
+
+    def _record_error(self, err):
+        if isinstance(err, self.failure_exceptions):
+            self.record_failure()
+        elif isinstance(err, Exception):
+            # the dependency answered, the error is ours or the request's
+            self.record_success()
+        else:
+            with self._lock:
+                self._trial = False
+
+    def _record_result(self, result):
+        if self.failure_result and self.failure_result(result):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def guard(self, func):
+        """Decorator running func through this breaker."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        return wrapper
+
+    def aguard(self, func):
+        """Decorator running the coroutine function func through this breaker."""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.acall(func, *args, **kwargs)
+        return wrapper
+
+    def snapshot(self):
+        """Returns {"state", "failures", "open_s"} for /health."""
+        with self._lock:
+            state = self._state()
+            return {
+                "state": state,
+                "failures": self._failures,
+                "open_s": None if self._opened_at is None else round(time.monotonic() - self._opened_at, 3),
+            }
@@ -1,30 +1,166 @@
 import base64
+import copy
 import hashlib
 import hmac
 import json
 import os
+import threading
+import time
 
+import jwt
 import requests
+from django.conf import settings
 from django.contrib.auth.models import User
-
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from .caching import invalidated_timeout
+from .circuit import CircuitBreaker, CircuitOpenError
 from .utils import get_rest_host
 
 # FILESTORE LOGIN FLOW:
 # 1. Attempt standard user login (`use_filestore_auth`) -> returns token on success.
 # 2. If login fails (403):
-#    a. Authenticate as Admin (`get_admin_login`).
+#    a. Authenticate as Admin (`get_admin_token`, cached until shortly before its exp).
 #    b. Check if the user exists in Filebrowser (`get_filestore_user_json`).
 #    c. If user exists: Password is out of sync. Force update password (`set_filestore_pass`).
 #    d. If user does not exist: Create new user (`add_filestore_auth`).
 #
 # FILESTORE DELETE FLOW:
-# 1. Authenticate as Admin (`get_admin_login`).
+# 1. Authenticate as Admin (`get_admin_token`).
 # 2. Find user ID in Filebrowser (`get_filestore_user_json`).
 # 3. If user ID is found: Delete user's files/directory using Admin token (`/api/resources/...`).
 # 4. If user ID is found: Delete user account using Admin token and Admin password.
 # 5. If user ID is not found: Assume user is already deleted, return True.
 
 FS_API_TIMEOUT = 15  # 15 seconds
+FS_API_CONNECT_TIMEOUT = 3  # seconds to open a connection, a dead host fails fast
+FS_API_RETRIES = 3  # idempotent calls only, not logins or user creation
+FS_API_CONNECT_RETRIES = 1  # of FS_API_RETRIES, on connection errors; read timeouts are not retried
+FS_API_BACKOFF = 0.3  # seconds, doubled on each retry
+FS_API_POOL_SIZE = 10  # keep-alive connections per filestore host
+FS_TOKEN_REFRESH_MARGIN = 60  # seconds before its exp a cached filebrowser jwt is renewed
+FS_TOKEN_FALLBACK_TTL = 300  # seconds a filebrowser jwt without a readable exp is kept
+FS_USER_INDEX_TTL = 300  # seconds before the filebrowser user list is downloaded again
+FS_PASSWORD_VERSION = 1  # bump when get_fs_password() derives passwords differently, retiring cached user tokens
+
+_session_lock = threading.Lock()
+_session = None
+_stats_lock = threading.Lock()
+_stats = {}
+_opened = threading.local()  # connections opened by this thread, counted by _CountingHTTPSConnection
+_admin_lock = threading.Lock()
+_admin_tokens = {}  # (host, verify): (admin jwt, exp)
+_users_lock = threading.Lock()
+_users_index = {}  # (host, verify): (time.monotonic() when loaded, {username: filebrowser user record})
+
+
+class FilestoreUnavailable(CircuitOpenError, requests.exceptions.ConnectionError):
+    """Raised without a request while the filestore circuit is open; handled like any connection error."""
+
+
+filestore_breaker = CircuitBreaker(
+    "filestore",
+    failure_exceptions=(requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+    failure_result=lambda response: response.status_code >= 500,
+    open_error=FilestoreUnavailable,
+)
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    """ An HTTPS connection counting itself in the thread that opens it, which is the thread whose request needs it,
+    so concurrent requests on the shared session never count each other's connections.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _opened.count = getattr(_opened, "count", 0) + 1
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+def get_filestore_session():
+    """ Helper method returning the process-wide keep-alive session for filebrowser api calls.
+    GET, PUT and DELETE are retried with backoff on 502/503/504 responses, and FS_API_CONNECT_RETRIES times
+    on connection errors. A read timeout is not retried, it already waited FS_API_TIMEOUT.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retries = Retry(
+                    total=FS_API_RETRIES,
+                    connect=FS_API_CONNECT_RETRIES,
+                    read=0,
+                    backoff_factor=FS_API_BACKOFF,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_maxsize=FS_API_POOL_SIZE, max_retries=retries)
+                adapter.poolmanager.pool_classes_by_scheme = {
+                    **adapter.poolmanager.pool_classes_by_scheme,
+                    "https": _CountingHTTPSConnectionPool,
+                }
+                session = requests.Session()
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _opened_connections():
+    return getattr(_opened, "count", 0)
+
+
+def filestore_request(method, host, path, verify, **kwargs):
+    """ Helper method to call the filebrowser api at https://host/storemng + path on the pooled session.
+    Connection reuse is recorded per method and api path, see get_filestore_http_stats().
+    While filestore_breaker is open, FilestoreUnavailable (a ConnectionError) is raised at once.
+
+    Returns:
+        requests.Response: The response, after any retries.
+    """
+    return filestore_breaker.call(_send_filestore_request, method, host, path, verify, **kwargs)
+
+
+def _send_filestore_request(method, host, path, verify, **kwargs):
+    session = get_filestore_session()
+    kwargs.setdefault("timeout", (FS_API_CONNECT_TIMEOUT, FS_API_TIMEOUT))
+    opened = _opened_connections()
+    response = None
+    try:
+        response = session.request(method, f"https://{host}/storemng{path}", verify=verify, **kwargs)
+        return response
+    finally:
+        retries = getattr(getattr(response, "raw", None), "retries", None)
+        _record_call(
+            f"{method} {'/'.join(path.split('/')[:3]) or '/'}",
+            _opened_connections() - opened,
+            len(retries.history) if isinstance(retries, Retry) else 0,
+        )
+
+
+def _record_call(call, new_connections, retries):
+    with _stats_lock:
+        stats = _stats.setdefault(call, {"calls": 0, "reused": 0, "new_connections": 0, "retries": 0})
+        stats["calls"] += 1
+        stats["reused"] += new_connections == 0
+        stats["new_connections"] += new_connections
+        stats["retries"] += retries
+
+
+def get_filestore_http_stats():
+    """ Helper method returning this process's filebrowser api connection reuse counts per call, reported by /health,
+    e.g. {"GET /api/users": {"calls": 4, "reused": 3, "new_connections": 1, "retries": 0}}.
+    """
+    with _stats_lock:
+        return {call: dict(stats) for call, stats in _stats.items()}
+
 
 def get_user_scope(user: User):
     """ Helper method to construct single user filebrowser scope.
@@ -37,6 +173,17 @@ def get_user_scope(user: User):
     return f"./users/{user.username}"
 
 
+def get_expected_scope(user: User):
+    """ Helper method to construct the filebrowser scope user should have: root for admin and staff, else their own.
+    Args:
+        user (User): The User model this action is for.
+
+    Returns:
+        path (string): The scope path relative to root filebrowser path.
+    """
+    return "." if user.is_staff else get_user_scope(user)
+
+
 def get_admin_login():
     """ Helper method to construct admin filebrowser login json string.
 
@@ -89,14 +236,14 @@ def get_user_login(user: User):
     return user_login
 
 
-def get_filestore_health():
+def get_filestore_health(timeout=FS_API_TIMEOUT):
     """ Helper method of to test filebrowser system will respond."""
     verify, host = get_rest_host()
     try:
-        r_users = requests.get(f"https://{host}/storemng", verify=verify, timeout=FS_API_TIMEOUT)
+        r_users = filestore_request("GET", host, "", verify, timeout=timeout)
         r_users.raise_for_status()
         return True
-    except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
+    except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError, requests.exceptions.Timeout) as err:
         print(err)
         return False
 
@@ -134,12 +281,7 @@ def get_filestore_token(user_login, host, verify):
         http_status (integer): HTTP status code from filebrowser api login.
     """
     try:
-        r_userlogin = requests.post(
-            f"https://{host}/storemng/api/login",
-            json=user_login,
-            verify=verify,
-            timeout=FS_API_TIMEOUT,
-        )
+        r_userlogin = filestore_request("POST", host, "/api/login", verify, json=user_login)
         r_userlogin.raise_for_status()
     except requests.exceptions.HTTPError:
         return None, getattr(r_userlogin, "status_code", None)
@@ -149,6 +291,78 @@ def get_filestore_token(user_login, host, verify):
     return r_userlogin.text, r_userlogin.status_code
 
 
+def get_token_exp(fs_token):
+    """ Helper method to read the exp claim of a filebrowser jwt, unverified, only to time its renewal.
+
+    Returns:
+        exp (integer): The jwt expiry in seconds since the epoch, None when unreadable.
+    """
+    try:
+        return int(jwt.decode(fs_token, options={"verify_signature": False})["exp"])
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return None
+
+
+def get_admin_token(host, verify, stale_token=None):
+    """ Helper method returning the cached filebrowser admin jwt, logging in again only when none is cached,
+    it is within FS_TOKEN_REFRESH_MARGIN of its exp, or it is stale_token (just rejected by filebrowser).
+    Concurrent callers wait for one login instead of each logging in.
+
+    Returns:
+        admin_token (string): The admin filebrowser api jwt, None when the admin login failed.
+    """
+    key = (host, verify)
+    with _admin_lock:
+        cached = _admin_tokens.get(key)
+        if cached and cached[0] != stale_token and cached[1] - FS_TOKEN_REFRESH_MARGIN > time.time():
+            return cached[0]
+        admin_token, _ = get_filestore_token(get_admin_login(), host, verify)
+        if admin_token:
+            _admin_tokens[key] = (admin_token, get_token_exp(admin_token) or time.time() + FS_TOKEN_FALLBACK_TTL)
+        else:
+            _admin_tokens.pop(key, None)
+        return admin_token
+
+
+def admin_request(method, host, path, verify, headers=None, **kwargs):
+    """ Helper method to call the filebrowser api as admin, logging in again once if the cached jwt is refused.
+
+    Returns:
+        requests.Response: The response.
+    """
+    admin_token = get_admin_token(host, verify)
+    response = filestore_request(
+        method, host, path, verify, headers={**(headers or {}), "X-Auth": admin_token}, **kwargs
+    )
+    if response.status_code == 401:
+        admin_token = get_admin_token(host, verify, stale_token=admin_token)
+        if admin_token:
+            response = filestore_request(
+                method, host, path, verify, headers={**(headers or {}), "X-Auth": admin_token}, **kwargs
+            )
+    return response
+
+
+def _user_token_key(username):
+    return f"fstoken:{FS_PASSWORD_VERSION}:{username}"
+
+
+def cache_user_token(username, fs_user_token):
+    """ Helper method to keep username's filebrowser jwt until FS_TOKEN_REFRESH_MARGIN before its exp.
+    A per-process cache keeps it settings.LOCAL_CACHE_TIMEOUT at most, other processes never see evict_user_token().
+    """
+    exp = get_token_exp(fs_user_token) or time.time() + FS_TOKEN_FALLBACK_TTL
+    timeout = int(exp - FS_TOKEN_REFRESH_MARGIN - time.time())
+    if timeout > 0:
+        timeout = invalidated_timeout(settings.FILESTORE_TOKEN_CACHE_ALIAS, timeout)
+        caches[settings.FILESTORE_TOKEN_CACHE_ALIAS].set(_user_token_key(username), fs_user_token, timeout)
+
+
+def evict_user_token(username):
+    """ Helper method to drop username's cached filebrowser jwt after their account changed. """
+    caches[settings.FILESTORE_TOKEN_CACHE_ALIAS].delete(_user_token_key(username))
+
+
 def login_filestore_user(user: User):
     """ Uses the filebrowser api to login the user.username's filebrowser account and return their auth jwt.
     Handles multiple situations: valid login, add new filebrowser user, update from django password reset.
@@ -157,12 +371,15 @@ def login_filestore_user(user: User):
         user (User): The User model this action is for.
 
     Returns:
-        fs_user_token (string): Updated filebrowser api jwt for user.username.
+        fs_user_token (string): Updated filebrowser api jwt for user.username, cached until shortly before its exp.
     """
 
     fs_user_token = None
     if not user.is_authenticated:
         return None
+    fs_user_token = caches[settings.FILESTORE_TOKEN_CACHE_ALIAS].get(_user_token_key(user.username))
+    if fs_user_token:
+        return fs_user_token
     # try user auth
     fs_user_token, status = use_filestore_auth(user)
     if status == 403: # Login failed
@@ -170,43 +387,88 @@ def login_filestore_user(user: User):
         if user.username == os.environ["STORE_ADMIN_USERNAME"]:
             return None  # root admin not allowed to alter scope or other properties of itself
         verify, host = get_rest_host()
-        admin_login = get_admin_login()
-        admin_token, status = get_filestore_token(admin_login, host, verify)
-        if not admin_token:
+        if not get_admin_token(host, verify):
             return None
 
-        # Check if user exists in FileStore
-        fs_user_json = get_filestore_user_json(user, host, verify, admin_token)
+        # Check if user exists in FileStore, not trusting the index: another worker may have added them since
+        fs_user_json = get_filestore_user_json(user, host, verify, refresh=True)
 
         if fs_user_json:
             # User exists but password incorrect -> likely needs update (e.g. from django reset or just out of sync)
-            fs_user_token = set_filestore_pass(user, host, verify, admin_token, fs_user_json)
+            fs_user_token = set_filestore_pass(user, host, verify, fs_user_json)
         elif not fs_user_token:
             # otherwise user needs to be added
-            fs_user_token = add_filestore_auth(user, host, verify, admin_token)
+            fs_user_token = add_filestore_auth(user, host, verify)
 
+    if fs_user_token:
+        cache_user_token(user.username, fs_user_token)
     return fs_user_token
 
 
-def get_filestore_user_json(user: User, host, verify, admin_token):
-    # find user, they may not have a valid password, loop through all
-    try:
-        r_users = requests.get(f"https://{host}/storemng/api/users",
-                               headers={"X-Auth": admin_token}, verify=verify, timeout=FS_API_TIMEOUT)
-        r_users.raise_for_status()
-    except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
-        print(err)
+def get_filestore_users(host, verify, refresh=False):
+    """ Helper method returning the index of filebrowser user records by username, downloading the
+    user list only when the index is older than FS_USER_INDEX_TTL or refresh is set.
+    Our own creates, updates and deletes are applied in place, see update_filestore_user_index().
+
+    Returns:
+        users (dict): The filebrowser user records by username, not to be modified, None on api errors.
+    """
+    key = (host, verify)
+    with _users_lock:
+        cached = _users_index.get(key)
+        if cached and not refresh and time.monotonic() - cached[0] < FS_USER_INDEX_TTL:
+            return cached[1]
+        try:
+            r_users = admin_request("GET", host, "/api/users", verify)
+            r_users.raise_for_status()
+        except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
+            print(err)
+            return None
+        users = {r_user["username"]: r_user for r_user in r_users.json()}
+        _users_index[key] = (time.monotonic(), users)
+        return users
+
+
+def update_filestore_user_index(host, verify, username, fs_user_json=None):
+    """ Helper method to apply our own change of username's filebrowser account to the user index:
+    the new record (without its password) after a create or update, None after a delete.
+    """
+    with _users_lock:
+        cached = _users_index.get((host, verify))
+        if not cached:
+            return
+        if fs_user_json is None:
+            cached[1].pop(username, None)
+        else:
+            record = copy.deepcopy(fs_user_json)
+            record.pop("password", None)
+            cached[1][username] = record
+
+
+def clear_filestore_user_index():
+    """ Helper method to drop the user index, so the next lookup downloads the user list. """
+    with _users_lock:
+        _users_index.clear()
+
+
+def get_filestore_user_json(user: User, host, verify, refresh=False):
+    """ Helper method to look up user.username's filebrowser account in the user index.
+
+    Returns:
+        fs_user_json (dict): A copy of the filebrowser user record, None when not found.
+    """
+    users = get_filestore_users(host, verify, refresh)
+    if users is None:
         return None
-    for r_user in json.loads(r_users.text):
-        # print(f"Checking user: {r_user['username']}")
-        if r_user["username"] == user.username:
-            return r_user
+    fs_user_json = users.get(user.username)
+    if fs_user_json:
+        return copy.deepcopy(fs_user_json)
 
-    print(f"User {user.username} not found in FileStore user list: {[u['username'] for u in json.loads(r_users.text)]}")
+    print(f"User {user.username} not found in FileStore user list of {len(users)} users")
     return None
 
 
-def set_filestore_pass(user: User, host, verify, admin_token, fs_user_json):
+def set_filestore_pass(user: User, host, verify, fs_user_json):
     """ Uses the filebrowser api to reset the user.username's filebrowser account password and return their auth jwt.
 
     Args:
@@ -230,19 +492,21 @@ def set_filestore_pass(user: User, host, verify, admin_token, fs_user_json):
     }
 
     try:
-        r_userupd = requests.put(f"https://{host}/storemng/api/users/{fs_user_json['id']}",
-                                 data=json.dumps(fs_user), headers={"X-Auth": admin_token}, verify=verify, timeout=FS_API_TIMEOUT)
+        r_userupd = admin_request("PUT", host, f"/api/users/{fs_user_json['id']}", verify,
+                                  data=json.dumps(fs_user))
         r_userupd.raise_for_status()
     except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
         print(f"Error updating filebrowser password: {err}")
         # Avoid printing r_userupd.text to prevent leaking passwords in logs
+        clear_filestore_user_index()
         return None
+    update_filestore_user_index(host, verify, user.username, fs_user_json)
 
     fs_user_token, status = get_filestore_token(get_user_login(user), host, verify)
     return fs_user_token
 
 
-def add_filestore_auth(user: User, host, verify, admin_token):
+def add_filestore_auth(user: User, host, verify):
     """ Uses the filebrowser api to add the user.username's filebrowser account and return their auth jwt.
 
     Args:
@@ -253,7 +517,7 @@ def add_filestore_auth(user: User, host, verify, admin_token):
     """
     admin_password = os.environ.get("STORE_ADMIN_PASSWORD", "")
     try:
-        r_settings = requests.get(f"https://{host}/storemng/api/settings", headers={"X-Auth": admin_token}, verify=verify, timeout=FS_API_TIMEOUT)
+        r_settings = admin_request("GET", host, "/api/settings", verify)
         r_settings.raise_for_status()
         settings = r_settings.json()
     except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
@@ -282,14 +546,20 @@ def add_filestore_auth(user: User, host, verify, admin_token):
 
     # add new user to filestore db
     try:
-        r_useradd = requests.post(f"https://{host}/storemng/api/users",
-                                  data=json.dumps(fs_user), headers={"X-Auth": admin_token}, verify=verify, timeout=FS_API_TIMEOUT)
+        r_useradd = admin_request("POST", host, "/api/users", verify, data=json.dumps(fs_user))
         r_useradd.raise_for_status()
         print(f"Created FileStore user: {user.username}")
     except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
         print(f"FileStore user creation failed for {user.username}: {err}")
         # Avoid printing r_useradd.text to prevent leaking passwords in logs
+        clear_filestore_user_index()
         return None
+    # filebrowser answers with the new user's location, e.g. /settings/users/42
+    user_id = r_useradd.headers.get("Location", "").rstrip("/").rsplit("/", 1)[-1]
+    if user_id.isdigit():
+        update_filestore_user_index(host, verify, user.username, {**fs_user["data"], "id": int(user_id)})
+    else:
+        clear_filestore_user_index()
 
     if user.is_staff:  # admin and staff get root scope
         set_filestore_scope(user)
@@ -308,12 +578,10 @@ def set_filestore_scope(user: User):
         bool: True when user.username's filebrowser account scope/permissions are updated.
     """
     verify, host = get_rest_host()
-    admin_login = get_admin_login()
-    admin_token, status = get_filestore_token(admin_login, host, verify)
-    if not admin_token:
+    if not get_admin_token(host, verify):
         return False
 
-    fs_user_json = get_filestore_user_json(user, host, verify, admin_token)
+    fs_user_json = get_filestore_user_json(user, host, verify)
     if not fs_user_json:
         return False
 
@@ -321,10 +589,7 @@ def set_filestore_scope(user: User):
     update_data = {}
 
     # update user scope
-    if user.is_staff:
-        update_data["scope"] = "."
-    else:
-        update_data["scope"] = get_user_scope(user)
+    update_data["scope"] = get_expected_scope(user)
 
     update_data["perm"] = fs_user_json["perm"]
     update_data["perm"]["admin"] = user.is_superuser
@@ -337,22 +602,27 @@ def set_filestore_scope(user: User):
     }
 
     try:
-        r_userupd = requests.put(f"https://{host}/storemng/api/users/{fs_user_json['id']}",
-                                 data=json.dumps(fs_user), headers={"X-Auth": admin_token}, verify=verify, timeout=FS_API_TIMEOUT)
+        r_userupd = admin_request("PUT", host, f"/api/users/{fs_user_json['id']}", verify,
+                                  data=json.dumps(fs_user))
         r_userupd.raise_for_status()
     except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
         print(f"Error updating filebrowser scope: {err}")
         # Avoid printing r_userupd.text to prevent leaking passwords in logs
+        clear_filestore_user_index()
         return False
 
+    fs_user_json.update(update_data)
+    update_filestore_user_index(host, verify, user.username, fs_user_json)
+    evict_user_token(user.username)
     return True
 
 
-def delete_filestore_user(user: User):
+def delete_filestore_user(user: User, fs_user_json=None):
     """ Uses the filebrowser api to delete the user.username's filebrowser account and files.
 
     Args:
         user (User): The User model this action is for.
+        fs_user_json (dict): The user's filebrowser record when already looked up, e.g. by a bulk reconcile.
 
     Returns:
         bool: True when user.username's filebrowser account and files are both removed.
@@ -363,15 +633,15 @@ def delete_filestore_user(user: User):
         return False  # root admin not allowed delete
     verify, host = get_rest_host()
     # get auth for removing user
-    admin_login = get_admin_login()
-    admin_token, _ = get_filestore_token(admin_login, host, verify)
-    if not admin_token:
+    if not get_admin_token(host, verify):
         return False
-    # find the user's filebrowser ID
-    fs_user_json = get_filestore_user_json(user, host, verify, admin_token)
+    # find the user's filebrowser ID, not trusting a cached miss
+    if not fs_user_json:
+        fs_user_json = get_filestore_user_json(user, host, verify, refresh=True)
 
     if not fs_user_json:
         print(f"delete_filestore_user: User '{user.username}' does not exist in filestore (checked admin list), returning true.")
+        evict_user_token(user.username)
         return True
 
     user_id_to_delete = fs_user_json['id']
@@ -381,8 +651,7 @@ def delete_filestore_user(user: User):
         try:  # only user scope files can be removed, not root
             # Filebrowser resource path expects the path without the leading './'
             resource_path = get_user_scope(user).lstrip('./')
-            r_filesdel = requests.delete(f"https://{host}/storemng/api/resources/{resource_path}",
-                                        headers={"X-Auth": admin_token}, verify=verify, timeout=FS_API_TIMEOUT)
+            r_filesdel = admin_request("DELETE", host, f"/api/resources/{resource_path}", verify)
             r_filesdel.raise_for_status()
             print(f"Deleted files for user: {user.username}")
         except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
@@ -394,13 +663,15 @@ def delete_filestore_user(user: User):
     r_userdel = None
     try:
         payload = {"current_password": admin_pass}
-        r_userdel = requests.delete(f"https://{host}/storemng/api/users/{user_id_to_delete}",
-                                    data=json.dumps(payload),
-                                    headers={"X-Auth": admin_token}, verify=verify, timeout=FS_API_TIMEOUT)
+        r_userdel = admin_request("DELETE", host, f"/api/users/{user_id_to_delete}", verify,
+                                  data=json.dumps(payload))
         r_userdel.raise_for_status()
+        update_filestore_user_index(host, verify, user.username, None)
+        evict_user_token(user.username)
         return True
     except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as err:
         print(f"Delete failed: {err}")
+        clear_filestore_user_index()
         # Avoid printing r_userdel.text to prevent leaking passwords in logs
         return False
 
@@ -0,0 +1,150 @@
+'''
+health.py: Dependency checks behind the /health endpoint. SQLite, MongoDB and
+the File Store are checked concurrently, each within settings.HEALTH_CHECK_TIMEOUT
+seconds, so one slow dependency never stalls the probe.
+
+With settings.HEALTH_CACHE_TTL above zero a background thread re-runs the checks
+every TTL seconds and probes are answered from the last result, reporting its
+age. A check still running from an earlier round is not started again, it stays
+unhealthy until it returns. The File Store and MongoDB checks go through their
+circuit breakers (users/circuit.py), whose live states are reported as well, as
+is this worker's File Store connection reuse per api call.
+'''
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import connection
+
+from .filestore import filestore_breaker, get_filestore_health, get_filestore_http_stats
+from .persist_db import get_persist_db
+from .persistence import mongo_breaker
+
+
+def check_sqlite(timeout):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+def check_mongo(timeout):
+    mongo_breaker.call(lambda: get_persist_db().command("ping", maxTimeMS=int(timeout * 1000)))
+
+
+def check_filestore(timeout):
+    return get_filestore_health(timeout=timeout)
+
+
+HEALTH_CHECKS = {
+    "sqlite": check_sqlite,
+    "mongo": check_mongo,
+    "filestore": check_filestore,
+}
+
+
+def _timed(check, timeout):
+    """Runs one check, returns (healthy, latency in ms); exceptions and False are unhealthy."""
+    begin = time.perf_counter()
+    try:
+        healthy = check(timeout) is not False
+    except Exception:
+        healthy = False
+    return healthy, round((time.perf_counter() - begin) * 1000, 3)
+
+
+class HealthMonitor:
+    def __init__(self, checks):
+        self.checks = checks
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._refresher = None
+        self._running = {}
+        self._result = None  # (time.monotonic() when checked, statuses, latencies)
+
+    def _start(self):
+        # threads do not survive a fork, so a worker starts its own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=len(self.checks), thread_name_prefix="health-check")
+            self._refresher = None
+            self._running = {}
+            self._result = None
+
+    def run_checks(self, timeout):
+        """Runs every check concurrently, returns ({name: status}, {name: latency ms or None})."""
+        with self._lock:
+            self._start()
+            futures = {}
+            for name, check in self.checks.items():
+                future = self._running.get(name)
+                if future is None or future.done():
+                    future = self._executor.submit(_timed, check, timeout)
+                    self._running[name] = future
+                futures[name] = future
+        deadline = time.monotonic() + timeout
+        statuses = {}
+        latencies = {}
+        for name, future in futures.items():
+            try:
+                healthy, latency = future.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                healthy, latency = False, None
+            statuses[name] = "healthy" if healthy else "unhealthy"
+            latencies[name] = latency
+        return statuses, latencies
+
+    def refresh(self, timeout):
+        statuses, latencies = self.run_checks(timeout)
+        self._result = (time.monotonic(), statuses, latencies)
+        return self._result
+
+    def _refresh_forever(self):
+        while True:
+            try:
+                self.refresh(settings.HEALTH_CHECK_TIMEOUT)
+            except Exception as err:
+                print(f"Health refresh failed: {err}")
+            time.sleep(settings.HEALTH_CACHE_TTL)
+
+    def _ensure_refresher(self):
+        with self._lock:
+            self._start()
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(target=self._refresh_forever, name="health-refresh", daemon=True)
+                self._refresher.start()
+
+    def get(self):
+        """Returns (checked_at, statuses, latencies), cached when settings.HEALTH_CACHE_TTL > 0."""
+        ttl = settings.HEALTH_CACHE_TTL
+        timeout = settings.HEALTH_CHECK_TIMEOUT
+        if ttl <= 0:
+            return self.refresh(timeout)
+        self._ensure_refresher()
+        result = self._result
+        # no result yet, or the refresher is stuck: check inline
+        if result is None or time.monotonic() - result[0] > 2 * (ttl + timeout):
+            result = self.refresh(timeout)
+        return result
+
+
+monitor = HealthMonitor(HEALTH_CHECKS)
+
+
+def get_health():
+    """Returns (http status, HealthSchema data) for the /health endpoint."""
+    checked_at, statuses, latencies = monitor.get()
+    healthy = all(status == "healthy" for status in statuses.values())
+    return (200 if healthy else 503), {
+        "result": "success" if healthy else "failure",
+        "sqlite_status": statuses["sqlite"],
+        "mongo_status": statuses["mongo"],
+        "filestore_status": statuses["filestore"],
+        "latency_ms": latencies,
+        "age_s": round(time.monotonic() - checked_at, 3),
+        "circuits": {"filestore": filestore_breaker.snapshot(), "mongo": mongo_breaker.snapshot()},
+        "filestore_http": get_filestore_http_stats(),
+    }
@@ -0,0 +1,148 @@
+'''
+check_persist_indexes: Reports how MongoDB plans each query users/persistence.py
+sends to arenaobjects, whose indexes are created by arena-persist's schema and
+never checked here.
+
+Lists the arenaobjects indexes, then explains every query shape at
+queryPlanner verbosity, which plans without running the query. Shapes that read
+every object by design, the unfiltered $group summaries, are reported but not
+flagged. Any other COLLSCAN is. --create-index adds the missing
+INDEXES: {namespace: 1, sceneId: 1, updatedAt: -1} serves the namespace and
+scene matches, including those ahead of the by-namespace and per-scene $group
+pipelines, {updatedAt: -1} finds the scenes an incremental stats build merges.
+Neither keeps the unfiltered $group summaries from scanning the collection.
+'''
+
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import PyMongoError
+
+from users.persist_db import get_persist_db
+from users.persistence import NAMESPACE_GROUP, SCENE_GROUP, scene_objects_query, scene_summary_pipeline
+
+COLLECTION = "arenaobjects"
+INDEXES = [
+    [("namespace", 1), ("sceneId", 1), ("updatedAt", -1)],
+    [("updatedAt", -1)],
+]
+
+
+def query_shapes(namespace, scene):
+    """
+    Returns (name, explain command, full scan expected) for each query persistence.py issues, with namespace and
+    scene as sample values.
+    """
+    def aggregate(pipeline):
+        return {"aggregate": COLLECTION, "pipeline": pipeline, "cursor": {}}
+
+    def find(query, sort=None):
+        command = {"find": COLLECTION, "filter": query}
+        if sort:
+            command["sort"] = sort
+        return command
+
+    def delete(query):
+        return {"delete": COLLECTION, "deletes": [{"q": query, "limit": 0}]}
+
+    scene_match = {"namespace": namespace, "sceneId": scene}
+    since = datetime.now(timezone.utc) - timedelta(hours=1)
+    return [
+        ("aggregate_persist_ns_all", aggregate([NAMESPACE_GROUP]), True),
+        ("aggregate_persist_scenes_all", aggregate([SCENE_GROUP]), True),
+        ("aggregate_persist_scenes_by_namespace", aggregate([
+            {"$match": {"namespace": {"$in": [namespace]}}},
+            SCENE_GROUP,
+        ]), False),
+        ("build_persist_scene_stats: touched scenes", aggregate([
+            {"$match": {"updatedAt": {"$gte": since}}},
+            {"$group": {"_id": {"namespace": "$namespace", "sceneId": "$sceneId"}}},
+        ]), False),
+        ("build_persist_scene_stats: incremental merge", aggregate([{"$match": {"$or": [scene_match]}}, SCENE_GROUP]), False),
+        ("read_persist_scene_summary", aggregate(scene_summary_pipeline(namespace, scene)), False),
+        ("iter_persist_scene_objects", find(scene_objects_query(namespace, scene, ObjectId()), sort={"_id": 1}), False),
+        ("delete_persist_scene_objects", delete(scene_match), False),
+        ("delete_persist_namespace_objects", delete({"namespace": namespace}), False),
+    ]
+
+
+def index_name(keys):
+    """The name MongoDB gives an index of keys by default."""
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def plan_stages(explain):
+    """Returns the (stage, index name) pairs of every plan stage in an explain result, in any nesting."""
+    stages = []
+    if isinstance(explain, dict):
+        if "stage" in explain and isinstance(explain["stage"], str):
+            stages.append((explain["stage"], explain.get("indexName")))
+        for key, value in explain.items():
+            if key != "rejectedPlans":
+                stages.extend(plan_stages(value))
+    elif isinstance(explain, list):
+        for item in explain:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+class Command(BaseCommand):
+    help = "Explain the arenaobjects queries of users/persistence.py and report collection scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--namespace", help="sample namespace to plan with (default: any stored object's)")
+        parser.add_argument("--scene", help="sample sceneId to plan with (default: any stored object's)")
+        parser.add_argument(
+            "--create-index",
+            action="store_true",
+            help=f"create the missing indexes first: {', '.join(index_name(keys) for keys in INDEXES)}",
+        )
+
+    def handle(self, *args, **options):
+        db = get_persist_db()
+        arenaobjects = db[COLLECTION]
+        try:
+            indexes = arenaobjects.index_information()
+            if options["create_index"]:
+                existing = [index["key"] for index in indexes.values()]
+                for keys in INDEXES:
+                    if keys in existing:
+                        self.stdout.write(f"Index {index_name(keys)} exists.")
+                    else:
+                        self.stdout.write(f"Creating index {index_name(keys)}...")
+                        arenaobjects.create_index(keys)
+                indexes = arenaobjects.index_information()
+            sample = arenaobjects.find_one({}, {"namespace": 1, "sceneId": 1}) or {}
+        except PyMongoError as err:
+            raise CommandError(f"Unable to read {COLLECTION}: {err}")
+
+        self.stdout.write(f"{COLLECTION} indexes:")
+        for name, index in sorted(indexes.items()):
+            self.stdout.write(f"  {name}: {dict(index['key'])}")
+
+        namespace = options["namespace"] or sample.get("namespace", "public")
+        scene = options["scene"] or sample.get("sceneId", "example")
+        scans = 0
+        for name, command, full_scan in query_shapes(namespace, scene):
+            try:
+                explain = db.command("explain", command, verbosity="queryPlanner")
+            except PyMongoError as err:
+                self.stderr.write(f"{name}: explain failed: {err}")
+                continue
+            stages = plan_stages(explain)
+            used = sorted({index for _, index in stages if index})
+            plan = " ".join(sorted({stage for stage, _ in stages}))
+            line = f"{name}: {plan or 'no plan'}" + (f" using {', '.join(used)}" if used else "")
+            if any(stage == "COLLSCAN" for stage, _ in stages) and not full_scan:
+                scans += 1
+                self.stdout.write(self.style.WARNING(f"{line} (COLLSCAN)"))
+            else:
+                self.stdout.write(line)
+
+        if scans:
+            self.stdout.write(self.style.WARNING(
+                f"{scans} queries scan {COLLECTION}, run with --create-index to add the missing indexes."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("No unexpected collection scans."))
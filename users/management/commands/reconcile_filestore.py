@@ -0,0 +1,131 @@
+'''
+reconcile_filestore: Brings Filebrowser accounts in line with Django users in
+one pass, instead of lazily on each user's first /storelogin.
+
+Reads the Filebrowser user list once and diffs it against the Django users:
+accounts missing for active users are created, scope and admin flags are fixed
+as set_filestore_scope() would set them, and accounts without any Django user
+are removed with their files. Actions run on the pooled filestore session,
+--concurrency at a time.
+
+Every action follows from the current diff and is safe to repeat, so an
+interrupted or partly failed run resumes by running the command again: finished
+work no longer shows up in the diff.
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from users.filestore import (
+    add_filestore_auth,
+    delete_filestore_user,
+    get_admin_token,
+    get_expected_scope,
+    get_filestore_users,
+    set_filestore_scope,
+)
+from users.utils import get_rest_host
+
+CREATE = "create"
+SCOPE = "scope"
+REMOVE = "remove"
+
+
+def plan_reconcile(users, fs_users, admin_username, keep_orphans=False):
+    """Returns the (action, user, filebrowser record) list turning fs_users into accounts for users.
+
+    Args:
+        users (list): All Django users; only active ones get accounts, inactive ones are left alone.
+        fs_users (dict): Filebrowser user records by username.
+        admin_username (string): The Filebrowser admin, never changed.
+        keep_orphans (bool): True to leave accounts without a Django user.
+    """
+    plan = []
+    usernames = {user.username for user in users}
+    for user in users:
+        if not user.is_active or user.username == admin_username:
+            continue
+        fs_user_json = fs_users.get(user.username)
+        if not fs_user_json:
+            plan.append((CREATE, user, None))
+        elif (
+            fs_user_json.get("scope") != get_expected_scope(user)
+            or fs_user_json.get("perm", {}).get("admin") != user.is_superuser
+        ):
+            plan.append((SCOPE, user, fs_user_json))
+    if not keep_orphans:
+        for username, fs_user_json in sorted(fs_users.items()):
+            if username not in usernames and username != admin_username:
+                plan.append((REMOVE, User(username=username), fs_user_json))
+    return plan
+
+
+def run_action(action, user, fs_user_json, host, verify):
+    """Applies one planned action, returns True on success."""
+    if action == CREATE:
+        add_filestore_auth(user, host, verify)
+        return user.username in (get_filestore_users(host, verify) or {})
+    if action == SCOPE:
+        return set_filestore_scope(user)
+    return delete_filestore_user(user, fs_user_json)
+
+
+class Command(BaseCommand):
+    help = "Create, fix and remove Filebrowser accounts to match Django users. Run again to resume."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="print the planned actions only")
+        parser.add_argument("--concurrency", type=int, default=4, help="filestore requests in flight (default 4)")
+        parser.add_argument(
+            "--keep-orphans", action="store_true", help="do not remove Filebrowser accounts without a Django user"
+        )
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+        verify, host = get_rest_host()
+        if not get_admin_token(host, verify):
+            raise CommandError("Filebrowser admin login failed.")
+        fs_users = get_filestore_users(host, verify, refresh=True)
+        if fs_users is None:
+            raise CommandError("Unable to read the Filebrowser user list.")
+
+        users = list(User.objects.only("username", "is_active", "is_staff", "is_superuser"))
+        plan = plan_reconcile(users, fs_users, os.environ["STORE_ADMIN_USERNAME"], options["keep_orphans"])
+        counts = {action: sum(1 for planned, _, _ in plan if planned == action) for action in (CREATE, SCOPE, REMOVE)}
+        self.stdout.write(
+            f"{len(users)} Django users, {len(fs_users)} Filebrowser accounts: "
+            f"{counts[CREATE]} to create, {counts[SCOPE]} to fix, {counts[REMOVE]} to remove."
+        )
+        if options["dry_run"]:
+            for action, user, _ in plan:
+                self.stdout.write(f"{action} {user.username}")
+            return
+
+        failed = 0
+        executor = ThreadPoolExecutor(max_workers=options["concurrency"])
+        try:
+            futures = {
+                executor.submit(run_action, action, user, fs_user_json, host, verify): (action, user)
+                for action, user, fs_user_json in plan
+            }
+            for future in as_completed(futures):
+                action, user = futures[future]
+                try:
+                    ok = future.result()
+                except Exception as err:
+                    self.stderr.write(f"{action} {user.username}: {err}")
+                    ok = False
+                failed += not ok
+                self.stdout.write(f"{action} {user.username}: {'done' if ok else 'failed'}")
+        except KeyboardInterrupt:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise CommandError("Interrupted, run again to resume.")
+        executor.shutdown()
+
+        if failed:
+            raise CommandError(f"{failed} of {len(plan)} actions failed, run again to retry them.")
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(plan)} Filebrowser accounts."))
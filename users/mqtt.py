@@ -1,21 +1,16 @@
 import base64
 import datetime
+import functools
 import os
 import re
+from types import SimpleNamespace
 
 import jwt
 from django.conf import settings
 
-from .models import (
-    SCENE_ANON_USERS_DEF,
-    SCENE_PUBLIC_READ_DEF,
-    SCENE_PUBLIC_WRITE_DEF,
-    SCENE_USERS_DEF,
-    SCENE_VIDEO_CONF_DEF,
-    Namespace,
-    Scene,
-)
-from .mqtt_match import topic_matches_sub
+from .mqtt_match import MQTTMatcher
+from .permissions import EMPTY_GRANTS, get_scene_perms, load_permission_snapshot
+from .signing import get_signing_algorithm, get_signing_key
 from .versioning import API_V2
 
 PUBLIC_NAMESPACE = "public"
@@ -23,6 +18,15 @@ ANON_REGEX = "anonymous-(?=.*?[a-zA-Z].*?[a-zA-Z])"
 CLIENT_REGEX = r"^[a-zA-Z]+[\w\-\:\.]*$"
 DEF_JWT_DURATION = datetime.timedelta(minutes=1)
 
+# topic levels substituted into compiled topic templates, in placeholder order
+TEMPLATE_VARS = ("realm", "username", "namespace", "sceneid", "deviceid")
+TEMPLATE_IDS = ("userid", "userclient", "camid", "handleftid", "handrightid")
+# a value is only substituted when it can neither match nor sort differently
+# from the placeholder it replaces: no wildcards or separators, and first
+# character above '+', as '{' is
+RE_TEMPLATE_VALUE = re.compile(r"^[^\x00-\x2b/+#][^/+#]*$")
+RE_TEMPLATE_PLACEHOLDER = re.compile(r"^\{\d+\}$")
+
 
 def generate_arena_token(
     *,
@@ -34,9 +38,19 @@ def generate_arena_token(
     ids=None,
     duration=DEF_JWT_DURATION,
     version=API_V2,
+    grants=None,
+    perm=None,
+    compact=None,
 ):
     """MQTT Token Constructor.
 
+    grants may carry the user's already loaded UserGrants, when one caller
+    issues several tokens for the same user. With perm, the ns_scene
+    ScenePerms, as well, no query is made at all.
+
+    compact (default settings.MQTT_TOKEN_COMPACT) writes the topics as
+    prefix-grouped publ_c/subs_c claims instead of publ/subs arrays.
+
     Returns:
         str: JWT or None
     """
@@ -44,34 +58,29 @@ def generate_arena_token(
     config = settings.PUBSUB
     if not realm:
         realm = config["mqtt_realm"]
-    privkeyfile = settings.MQTT_TOKEN_PRIVKEY
-    if not os.path.exists(privkeyfile):
+    private_key = get_signing_key()
+    if private_key is None:
         print("Error: keyfile not found")
         return None
-    with open(privkeyfile, encoding="utf-8") as privatefile:
-        private_key = privatefile.read()
+    algorithm = get_signing_algorithm(private_key)
+    if algorithm is None:
+        print(f"Error: unsupported keyfile type: {type(private_key).__name__}")
+        return None
+    if compact is None:
+        compact = settings.MQTT_TOKEN_COMPACT
     payload = {}
     payload["sub"] = username
     payload["exp"] = datetime.datetime.now(datetime.timezone.utc) + duration
     headers = None
 
-    perm = {
-        "public_read": SCENE_PUBLIC_READ_DEF,
-        "public_write": SCENE_PUBLIC_WRITE_DEF,
-        "anonymous_users": SCENE_ANON_USERS_DEF,
-        "video": SCENE_VIDEO_CONF_DEF,
-        "users": SCENE_USERS_DEF,
-    }
-    if ns_scene and Scene.objects.filter(name=ns_scene).exists():
-        p = Scene.objects.get(name=ns_scene)
-        perm["public_read"] = p.public_read
-        perm["public_write"] = p.public_write
-        perm["anonymous_users"] = p.anonymous_users
-        perm["video"] = p.video_conference
-        perm["users"] = p.users
+    # grants and scene flags in at most two queries
+    if grants is None:
+        grants, perm = load_permission_snapshot(user, ns_scene)
+    elif perm is None:
+        perm = get_scene_perms(ns_scene)
 
     # add jitsi server params if a/v scene
-    if ns_scene and "camid" in ids and perm["users"] and perm["video"]:
+    if ns_scene and "camid" in ids and perm.users and perm.video:
         host = os.getenv("HOSTNAME")
         headers = {"kid": host}
         payload["aud"] = "arena"
@@ -95,6 +104,40 @@ def generate_arena_token(
         namespace = parts[0]
         deviceid = parts[1]
 
+    # consolidate topics and issue token
+    pubs, subs = build_topic_lists(user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, version)
+    if len(pubs) > 0:
+        if compact:
+            payload["publ_c"] = compact_topics(pubs)
+        else:
+            payload["publ"] = pubs
+    if len(subs) > 0:
+        if compact:
+            payload["subs_c"] = compact_topics(subs)
+        else:
+            payload["subs"] = subs
+
+    return jwt.encode(payload, private_key, algorithm=algorithm, headers=headers)
+
+
+def build_topic_lists(user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, version):
+    """Publish and subscribe topic lists for a token, sorted and collapsed.
+
+    Anonymous, staff and non-granted v2 requests are filled in from a compiled
+    template of their permission shape, everything else is built topic by topic.
+    """
+    topics = fill_topic_template(user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, version)
+    if topics is not None:
+        return topics
+    return _build_topic_lists(user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, version)
+
+
+def _build_topic_lists(user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, version):
+    pubs, subs = _collect_topics(user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, version)
+    return clean_topics(pubs), clean_topics(subs)
+
+
+def _collect_topics(user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, version):
     pubs = []
     subs = []
 
@@ -102,9 +145,9 @@ def generate_arena_token(
     # scene and user session permissions
     if not deviceid:
         if version == API_V2:
-            pubs, subs = set_scene_perms_api_v2(user, username, realm, namespace, sceneid, ids, perm)
+            pubs, subs = set_scene_perms_api_v2(user, username, realm, namespace, sceneid, ids, perm, grants)
         else:
-            pubs, subs = set_scene_perms_api_v1(user, username, realm, namespace, sceneid, ids, perm)
+            pubs, subs = set_scene_perms_api_v1(user, username, realm, namespace, sceneid, ids, perm, grants)
 
     # -- NON-VERSIONED API TOPICS --
     # device permissions
@@ -130,13 +173,82 @@ def generate_arena_token(
     # every client can/should publish latency data
     pubs.append("$NETWORK/latency")
 
-    # consolidate topics and issue token
-    if len(pubs) > 0:
-        payload["publ"] = clean_topics(pubs)
-    if len(subs) > 0:
-        payload["subs"] = clean_topics(subs)
+    return pubs, subs
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_topic_template(is_authenticated, is_staff, perm, ids_keys, classes):
+    """Builds the cleaned topic lists of one permission shape once, with a
+    "{n}" placeholder per distinct variable value, n being the index of its
+    first occurrence in classes (-1 marks a variable that is None).
+    """
+    values = ["{%d}" % c if c >= 0 else None for c in classes]
+    realm, username, namespace, sceneid, deviceid = values[: len(TEMPLATE_VARS)]
+    ids = None
+    if ids_keys is not None:
+        ids_values = dict(zip(TEMPLATE_IDS, values[len(TEMPLATE_VARS) :]))
+        # keys like renderfusionid/environmentid only matter by presence
+        ids = {key: ids_values.get(key, "-") for key in ids_keys}
+    user = SimpleNamespace(is_authenticated=is_authenticated, is_staff=is_staff)
+    pubs, subs = _collect_topics(user, username, realm, namespace, sceneid, deviceid, ids, perm, EMPTY_GRANTS, API_V2)
+    # levels of collapsed topics count too, a value equal to one could change what collapses
+    literals = frozenset(
+        level
+        for topic in pubs + subs
+        for level in topic.split("/")
+        if not RE_TEMPLATE_PLACEHOLDER.match(level)
+    )
+    return tuple(clean_topics(pubs)), tuple(clean_topics(subs)), literals
+
+
+def fill_topic_template(user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, version):
+    """Returns (pubs, subs) from the compiled template of this request's
+    permission shape, or None when it has grants, uses API v1, or a value could
+    interact with the template's own levels and must be built topic by topic.
+    """
+    if version != API_V2 or not (user.is_staff or grants.is_empty):
+        return None
+    values = [realm, username, namespace, sceneid, deviceid]
+    if ids is not None:
+        values.extend(ids.get(key) for key in TEMPLATE_IDS)
+    else:
+        values.extend([None] * len(TEMPLATE_IDS))
+    classes = []
+    for index, value in enumerate(values):
+        if value is None:
+            classes.append(-1)
+        elif not isinstance(value, str) or not RE_TEMPLATE_VALUE.match(value):
+            return None
+        else:
+            classes.append(values.index(value))
+    ids_keys = tuple(sorted(ids)) if ids is not None else None
+    pubs, subs, literals = _compile_topic_template(
+        bool(user.is_authenticated), bool(user.is_staff), perm, ids_keys, tuple(classes)
+    )
+    if not literals.isdisjoint(values):
+        return None
+    return sorted(t.format(*values) for t in pubs), sorted(t.format(*values) for t in subs)
+
+
+def compact_topics(topics):
+    """Groups topics by their shared realm/type/namespace prefix, see docs/mqtt-v2.md.
+
+    Each topic of four or more levels is split after its third level, shorter
+    topics keep the empty prefix. expand_topics() restores the sorted list.
+    """
+    grouped = {}
+    for topic in topics:
+        levels = topic.split("/", 3)
+        if len(levels) == 4:
+            grouped.setdefault("/".join(levels[:3]) + "/", []).append(levels[3])
+        else:
+            grouped.setdefault("", []).append(topic)
+    return grouped
+
 
-    return jwt.encode(payload, private_key, algorithm="RS256", headers=headers)
+def expand_topics(grouped):
+    """Returns the topic list a compact publ_c/subs_c claim stands for."""
+    return sorted(prefix + suffix for prefix, suffixes in grouped.items() for suffix in suffixes)
 
 
 def set_scene_perms_api_v1(
@@ -147,6 +259,7 @@ def set_scene_perms_api_v1(
     sceneid,
     ids,
     perm,
+    grants,
 ):
     """V1 Topic Notes:
     Does _NOT_ use ./topics.py
@@ -177,13 +290,12 @@ def set_scene_perms_api_v1(
             subs.append(f"{realm}/env/{username}/#")
             pubs.append(f"{realm}/env/{username}/#")
             # add scenes that have been granted by other owners
-            u_scenes = Scene.objects.filter(editors=user)
-            for u_scene in u_scenes:
-                if not sceneid or (sceneid and u_scene.name == f"{namespace}/{sceneid}"):
-                    subs.append(f"{realm}/s/{u_scene.name}/#")
-                    pubs.append(f"{realm}/s/{u_scene.name}/#")
-                    subs.append(f"{realm}/env/{u_scene.name}/#")
-                    pubs.append(f"{realm}/env/{u_scene.name}/#")
+            for u_scene in grants.edit_scenes:
+                if not sceneid or (sceneid and u_scene == f"{namespace}/{sceneid}"):
+                    subs.append(f"{realm}/s/{u_scene}/#")
+                    pubs.append(f"{realm}/s/{u_scene}/#")
+                    subs.append(f"{realm}/env/{u_scene}/#")
+                    pubs.append(f"{realm}/env/{u_scene}/#")
     # everyone should be able to read all public scenes
     subs.append(f"{realm}/s/{PUBLIC_NAMESPACE}/#")
     # And transmit env data
@@ -191,16 +303,16 @@ def set_scene_perms_api_v1(
     # anon/non-owners have rights to view scene objects only
     if sceneid and not user.is_staff:
         # did the user set specific public read or public write?
-        if not user.is_authenticated and not perm["anonymous_users"]:
+        if not user.is_authenticated and not perm.anonymous_users:
             return pubs, subs  # anonymous not permitted
-        if perm["public_read"]:
+        if perm.public_read:
             subs.append(f"{realm}/s/{namespace}/{sceneid}/#")
             # Interactivity to extent of viewing objects is similar to publishing env
             pubs.append(f"{realm}/env/{namespace}/{sceneid}/#")
-        if perm["public_write"]:
+        if perm.public_write:
             pubs.append(f"{realm}/s/{namespace}/{sceneid}/#")
         # user presence objects
-        if perm["users"]:
+        if perm.users:
             if "camid" in ids:
                 pubs.append(f"{realm}/s/{namespace}/{sceneid}/{ids['camid']}")
                 pubs.append(f"{realm}/s/{namespace}/{sceneid}/{ids['camid']}/#")
@@ -209,7 +321,7 @@ def set_scene_perms_api_v1(
             if "handrightid" in ids:
                 pubs.append(f"{realm}/s/{namespace}/{sceneid}/{ids['handrightid']}")
     # chat messages
-    if sceneid and "userid" in ids and perm["users"]:
+    if sceneid and "userid" in ids and perm.users:
         userhandle = ids["userid"] + base64.b64encode(ids["userid"].encode()).decode()
         # receive private messages: Read
         subs.append(f"{realm}/c/{namespace}/p/{ids['userid']}/#")
@@ -239,6 +351,7 @@ def set_scene_perms_api_v2(
     sceneid,
     ids,
     perm,
+    grants,
 ):
     """V2 Topic Notes:
     See ./topics.py
@@ -263,46 +376,44 @@ def set_scene_perms_api_v2(
             topicv2_add_scene_writer(pubs, subs, realm, username, "+", ids)
 
             # add namespaces that have been granted by other owners
-            e_namespaces = Namespace.objects.filter(editors=user)
-            for u_namespace in e_namespaces:
-                if not sceneid or u_namespace.name == f"{namespace}":
-                    topicv2_add_scene_reader(pubs, subs, realm, u_namespace.name, "+", ids)
-                    topicv2_add_scene_writer(pubs, subs, realm, u_namespace.name, "+", ids)
-            v_namespaces = Namespace.objects.filter(viewers=user)
-            for u_namespace in v_namespaces:
-                if not sceneid or u_namespace.name == f"{namespace}":
-                    topicv2_add_scene_reader(pubs, subs, realm, u_namespace.name, "+", ids)
+            for u_namespace in grants.edit_namespaces:
+                if not sceneid or u_namespace == f"{namespace}":
+                    topicv2_add_scene_reader(pubs, subs, realm, u_namespace, "+", ids)
+                    topicv2_add_scene_writer(pubs, subs, realm, u_namespace, "+", ids)
+            for u_namespace in grants.view_namespaces:
+                if not sceneid or u_namespace == f"{namespace}":
+                    topicv2_add_scene_reader(pubs, subs, realm, u_namespace, "+", ids)
 
             # add scenes that have been granted by other owners
-            e_scenes = Scene.objects.filter(editors=user)
-            for u_scene in e_scenes:
-                if not sceneid or (sceneid and u_scene.name == f"{namespace}/{sceneid}"):
-                    topicv2_add_scene_reader(pubs, subs, realm, u_scene.namespace, u_scene.sceneid, ids)
-                    topicv2_add_scene_writer(pubs, subs, realm, u_scene.namespace, u_scene.sceneid, ids)
-            v_scenes = Scene.objects.filter(viewers=user)
-            for u_scene in v_scenes:
-                if not sceneid or (sceneid and u_scene.name == f"{namespace}/{sceneid}"):
-                    topicv2_add_scene_reader(pubs, subs, realm, u_scene.namespace, u_scene.sceneid, ids)
+            for u_scene in grants.edit_scenes:
+                if not sceneid or (sceneid and u_scene == f"{namespace}/{sceneid}"):
+                    u_namespace, u_sceneid = u_scene.split("/")[:2]
+                    topicv2_add_scene_reader(pubs, subs, realm, u_namespace, u_sceneid, ids)
+                    topicv2_add_scene_writer(pubs, subs, realm, u_namespace, u_sceneid, ids)
+            for u_scene in grants.view_scenes:
+                if not sceneid or (sceneid and u_scene == f"{namespace}/{sceneid}"):
+                    u_namespace, u_sceneid = u_scene.split("/")[:2]
+                    topicv2_add_scene_reader(pubs, subs, realm, u_namespace, u_sceneid, ids)
     # anon/non-owners have rights to view scene objects only
     if sceneid:
         # did the user set specific public read or public write?
-        if not user.is_authenticated and not perm["anonymous_users"]:
+        if not user.is_authenticated and not perm.anonymous_users:
             return pubs, subs  # anonymous not permitted
         # objectid - o
-        if perm["public_read"]:
+        if perm.public_read:
             topicv2_add_scene_reader(pubs, subs, realm, namespace, sceneid, ids)
-        if perm["public_write"]:
+        if perm.public_write:
             topicv2_add_scene_writer(pubs, subs, realm, namespace, sceneid, ids)
     # (all) everyone should be able to read all public scenes
     if not sceneid:
         topicv2_add_scene_reader(pubs, subs, realm, PUBLIC_NAMESPACE, "+", ids)
     # (all) user presence/chat
-    if sceneid and "userid" in ids and perm["users"]:
+    if sceneid and "userid" in ids and perm.users:
         # users enabled, so all message types for uuid = userid/idtag are enabled
         pubs.append(f"{realm}/s/{namespace}/{sceneid}/+/{ids['userclient']}/{ids['userid']}")
         pubs.append(f"{realm}/s/{namespace}/{sceneid}/+/{ids['userclient']}/{ids['userid']}/+")
         # userobjectid - u
-        if perm["users"]:
+        if perm.users:
             if "camid" in ids:
                 pubs.append(f"{realm}/s/{namespace}/{sceneid}/u/{ids['userclient']}/{ids['camid']}")
                 pubs.append(f"{realm}/s/{namespace}/{sceneid}/u/{ids['userclient']}/{ids['camid']}/+")
@@ -371,13 +482,13 @@ def clean_topics(topics):
     """
     topics = list(dict.fromkeys(topics))
     topics.sort()
-    # after sort, collapse overlapping topic levels to reduce size
+    # after sort, collapse overlapping topic levels to reduce size:
+    # kept filters share one trie, so each topic is a single walk instead of
+    # a comparison against every kept filter
+    kept = MQTTMatcher()
     _topics = []
     for topic in topics:
-        add = True
-        for have in _topics:
-            if topic_matches_sub(have, topic):
-                add = False
-        if add:
+        if next(kept.iter_match(topic), None) is None:
+            kept[topic] = True
             _topics.append(topic)
     return _topics
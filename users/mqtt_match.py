@@ -1,5 +1,8 @@
 # Source: eclipse/paho.mqtt.python
 
+import functools
+
+
 class MQTTMatcher:
     """Intended to manage topic filters including wildcards.
 
@@ -80,6 +83,44 @@ class MQTTMatcher:
         return rec(self._root)
 
 
+class CompiledFilter:
+    """A single topic filter split into levels once, for repeated matching.
+
+    Matches with the same rules as MQTTMatcher.iter_match(): '+' covers exactly
+    one level, a trailing '#' covers its parent level and everything below it,
+    a '#' that is not the last level is only a literal, and neither wildcard
+    may match the first level of a '$'-prefixed topic."""
+
+    __slots__ = '_levels', '_count', '_hash_tail', '_wild_first'
+
+    def __init__(self, sub):
+        levels = tuple(sub.split('/'))
+        self._hash_tail = levels[-1] == '#'
+        # the trailing '#' is checked separately, keep only the levels before it
+        self._levels = levels[:-1] if self._hash_tail else levels
+        self._count = len(self._levels)
+        self._wild_first = levels[0] in ('+', '#')
+
+    def match(self, topic):
+        """Return True when :topic is matched by this filter"""
+        parts = topic.split('/')
+        count = self._count
+        if len(parts) != count and not (self._hash_tail and len(parts) >= count):
+            return False
+        if self._wild_first and topic.startswith('$'):
+            return False
+        for f, t in zip(self._levels, parts):
+            if f != t and f != '+':
+                return False
+        return True
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_filter(sub: str) -> CompiledFilter:
+    """Return the compiled, cached matcher for the topic filter :sub"""
+    return CompiledFilter(sub)
+
+
 def topic_matches_sub(sub: str, topic: str) -> bool:
     """Check whether a topic matches a subscription.
 
@@ -88,10 +129,4 @@ def topic_matches_sub(sub: str, topic: str) -> bool:
     * Topic "foo/bar" would match the subscription "foo/#" or "+/bar"
     * Topic "non/matching" would not match the subscription "non/+/+"
     """
-    matcher = MQTTMatcher()
-    matcher[sub] = True
-    try:
-        next(matcher.iter_match(topic))
-        return True
-    except StopIteration:
-        return False
+    return compile_filter(sub).match(topic)
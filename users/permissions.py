@@ -0,0 +1,211 @@
+'''
+permissions.py: Compact, immutable snapshots of the permission rows the MQTT
+token builders read. A user's namespace/scene grants come back from a single
+UNION query and a scene's flags from a single row lookup, instead of one query
+per grant type plus an exists()/get() pair per token.
+
+Resolved grants are cached per user in the Django cache named by
+settings.PERMISSIONS_CACHE_ALIAS, keyed by user id and a per-user version
+counter. users/signals.py bumps the counter whenever a grant row changes, so a
+stale entry is never read again and simply ages out. The counter lives in the
+cache, so other processes only see the bump through a shared backend; in a
+per-process cache grants are kept settings.LOCAL_CACHE_TIMEOUT seconds at most
+(users/caching.py).
+
+Scene flags are cached the same way keyed by scene name, including scenes that
+have no row (they resolve to the defaults), and are dropped when a Scene is
+saved or deleted, with the same LOCAL_CACHE_TIMEOUT bound in a per-process
+cache. Anonymous viewers of one public scene then share one read.
+'''
+
+import time
+from typing import FrozenSet, NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import CharField, Value
+
+from .caching import invalidated_timeout
+from .models import (
+    RE_PATTERN_NS_SLASH_ID,
+    SCENE_ANON_USERS_DEF,
+    SCENE_PUBLIC_READ_DEF,
+    SCENE_PUBLIC_WRITE_DEF,
+    SCENE_USERS_DEF,
+    SCENE_VIDEO_CONF_DEF,
+    Namespace,
+    Scene,
+)
+
+# grant kinds tagged onto each row of the UNION query
+_EDIT_NS = "en"
+_VIEW_NS = "vn"
+_EDIT_SCENE = "es"
+_VIEW_SCENE = "vs"
+
+
+class ScenePerms(NamedTuple):
+    """The scene permission flags that shape a token, defaults when no Scene row exists."""
+
+    public_read: bool = SCENE_PUBLIC_READ_DEF
+    public_write: bool = SCENE_PUBLIC_WRITE_DEF
+    anonymous_users: bool = SCENE_ANON_USERS_DEF
+    video: bool = SCENE_VIDEO_CONF_DEF
+    users: bool = SCENE_USERS_DEF
+
+
+class UserGrants(NamedTuple):
+    """Names of the namespaces and namespace/scenes other owners granted to a user."""
+
+    edit_namespaces: FrozenSet[str] = frozenset()
+    view_namespaces: FrozenSet[str] = frozenset()
+    edit_scenes: FrozenSet[str] = frozenset()
+    view_scenes: FrozenSet[str] = frozenset()
+
+    @property
+    def is_empty(self):
+        return not (self.edit_namespaces or self.view_namespaces or self.edit_scenes or self.view_scenes)
+
+
+class PermissionSnapshot(NamedTuple):
+    grants: UserGrants
+    scene: ScenePerms
+
+
+DEFAULT_SCENE_PERMS = ScenePerms()
+EMPTY_GRANTS = UserGrants()
+
+SCENE_PERM_FIELDS = ("public_read", "public_write", "anonymous_users", "video_conference", "users")
+
+
+def _tagged_names(queryset, kind):
+    return queryset.annotate(kind=Value(kind, output_field=CharField())).values_list("kind", "name")
+
+
+def load_user_grants(user):
+    """Returns the UserGrants for user in one round-trip, empty for anonymous users."""
+    if not user.is_authenticated:
+        return EMPTY_GRANTS
+    rows = _tagged_names(Namespace.objects.filter(editors=user), _EDIT_NS).union(
+        _tagged_names(Namespace.objects.filter(viewers=user), _VIEW_NS),
+        _tagged_names(Scene.objects.filter(editors=user), _EDIT_SCENE),
+        _tagged_names(Scene.objects.filter(viewers=user), _VIEW_SCENE),
+        all=True,
+    )
+    names = {_EDIT_NS: set(), _VIEW_NS: set(), _EDIT_SCENE: set(), _VIEW_SCENE: set()}
+    for kind, name in rows:
+        names[kind].add(name)
+    return UserGrants(
+        edit_namespaces=frozenset(names[_EDIT_NS]),
+        view_namespaces=frozenset(names[_VIEW_NS]),
+        edit_scenes=frozenset(names[_EDIT_SCENE]),
+        view_scenes=frozenset(names[_VIEW_SCENE]),
+    )
+
+
+def _grants_cache():
+    return caches[settings.PERMISSIONS_CACHE_ALIAS]
+
+
+def _version_key(user_id):
+    return f"perms:version:{user_id}"
+
+
+def _grants_key(user_id, version):
+    return f"perms:grants:{user_id}:{version}"
+
+
+def _grants_version(cache, user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # start from the clock, so entries written under a counter that was
+        # evicted can never be mistaken for current ones
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_user_grants(user):
+    """Returns the UserGrants for user, from the permissions cache when current."""
+    if not user.is_authenticated:
+        return EMPTY_GRANTS
+    cache = _grants_cache()
+    key = _grants_key(user.pk, _grants_version(cache, user.pk))
+    grants = cache.get(key)
+    if grants is None:
+        grants = load_user_grants(user)
+        cache.set(key, grants, invalidated_timeout(settings.PERMISSIONS_CACHE_ALIAS, settings.PERMISSIONS_CACHE_TIMEOUT))
+    return grants
+
+
+def _bump_versions(user_ids):
+    cache = _grants_cache()
+    for user_id in user_ids:
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            pass  # no counter yet, so nothing cached for this user either
+
+
+def invalidate_user_grants(user_ids):
+    """Drop the cached grants of every user id in user_ids.
+
+    Bumps now, and again once the surrounding transaction commits, so a reader
+    that re-cached the pre-commit rows in between is invalidated as well.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    _bump_versions(user_ids)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump_versions(user_ids))
+
+
+def load_scene_perms(ns_scene):
+    """Returns the ScenePerms for namespace/scene name ns_scene, defaults when it has no row."""
+    if not ns_scene:
+        return DEFAULT_SCENE_PERMS
+    row = Scene.objects.filter(name=ns_scene).values_list(*SCENE_PERM_FIELDS).first()
+    if row is None:
+        return DEFAULT_SCENE_PERMS
+    return ScenePerms(*row)
+
+
+def _scene_perms_key(ns_scene):
+    return f"perms:scene:{ns_scene}"
+
+
+def get_scene_perms(ns_scene):
+    """Returns the ScenePerms for ns_scene, from the permissions cache when present."""
+    if not ns_scene or not RE_PATTERN_NS_SLASH_ID.match(ns_scene):
+        # not a storable scene name, so not a safe cache key either
+        return load_scene_perms(ns_scene)
+    cache = _grants_cache()
+    key = _scene_perms_key(ns_scene)
+    perm = cache.get(key)
+    if perm is None:
+        perm = load_scene_perms(ns_scene)
+        cache.set(key, perm, invalidated_timeout(settings.PERMISSIONS_CACHE_ALIAS, settings.SCENE_PERMS_CACHE_TIMEOUT))
+    return perm
+
+
+def invalidate_scene_perms(names):
+    """Drop the cached flags of every scene name in names, now and on commit."""
+    keys = [_scene_perms_key(name) for name in names if name]
+    if not keys:
+        return
+    cache = _grants_cache()
+    cache.delete_many(keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def load_permission_snapshot(user, ns_scene=None):
+    """Returns the grants and target scene flags a token for user and ns_scene needs.
+
+    Staff tokens never consult grants, so no grant query is made for them.
+    """
+    grants = EMPTY_GRANTS if user.is_staff else get_user_grants(user)
+    return PermissionSnapshot(grants=grants, scene=get_scene_perms(ns_scene))
@@ -3,15 +3,24 @@ persist_db.py: This Mongo connection manager is triggered at startup and checked
 before each database call, this allows a lazy connection to Mongo. There is no
 explicit disconnect from Mongo. PyMongo manages its own connection pooling and the OS
 handles socket cleanup on process exit. Plus, Django shutdown is hard to detect.
+The async client is the exception: one is opened per event loop and closed as
+its loop shuts down, since async views under WSGI run on a new loop per request.
 '''
 
+import asyncio
 import logging
 
-from pymongo import MongoClient
+from django.conf import settings
+from pymongo import AsyncMongoClient, MongoClient
 from pymongo.database import Database
 
+PERSIST_URI = "mongodb://mongodb/arena_persist?readPreference=primaryPreferred"
+
 client: MongoClient = None
 db: Database = None
+async_client: AsyncMongoClient = None
+async_loop = None
+_async_closers = set()  # pending _close_with_loop tasks, referenced so they are not collected
 
 logging.getLogger("pymongo").setLevel(logging.WARNING)
 
@@ -22,7 +31,7 @@ def get_persist_db():
 
     # connect to mongodb, read-only
     print("arena_persist: connecting...")
-    client = MongoClient("mongodb://mongodb/arena_persist?readPreference=primaryPreferred")
+    client = MongoClient(PERSIST_URI)
 
     try:
         dba = client.admin
@@ -37,3 +46,31 @@ def get_persist_db():
 
     db = client.arena_persist
     return db
+
+
+def get_async_persist_db():
+    """The async API client for coroutines, one per event loop since it is bound to the loop it runs on."""
+    global async_client, async_loop
+    loop = asyncio.get_running_loop()
+    if async_client is None or async_loop is not loop:
+        print("arena_persist: async client connecting...")
+        # its own pool, and a short server selection so an unreachable mongodb fails a request instead of hanging it
+        async_client = AsyncMongoClient(
+            PERSIST_URI,
+            maxPoolSize=settings.PERSIST_ASYNC_POOL_SIZE,
+            serverSelectionTimeoutMS=int(settings.PERSIST_ASYNC_SELECTION_TIMEOUT * 1000),
+        )
+        async_loop = loop
+        closer = loop.create_task(_close_with_loop(async_client))
+        _async_closers.add(closer)
+        closer.add_done_callback(_async_closers.discard)
+    return async_client.arena_persist
+
+
+async def _close_with_loop(async_client):
+    """Closes async_client once its loop cancels the tasks left at shutdown, as asyncio.run() and async_to_sync do."""
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print("arena_persist: async client closing...")
+        await async_client.close()
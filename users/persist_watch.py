@@ -0,0 +1,279 @@
+'''
+persist_watch.py: Keeps scene summaries (object count, newest updatedAt) of
+arenaobjects current in process by tailing a MongoDB change stream, opt-in with
+settings.PERSIST_WATCH.
+
+The summaries are seeded by one aggregation read at a snapshot, then updated per
+insert, update and delete event from just after that snapshot's cluster time,
+so reads need no query at all and no change is counted twice. Checkpoints store
+one document per scene in WATCH_COLLECTION and the resume token they match in
+STATS_META_COLLECTION, so a restarted worker resumes the stream where the
+checkpoint left off instead of aggregating again. Delete events carry the
+deleted object's scene only when arenaobjects has changeStreamPreAndPostImages
+enabled (MongoDB 6+); other deletes reseed the summaries, at most every
+WATCH_RESEED_INTERVAL seconds.
+
+Change streams and snapshot reads need a replica set of MongoDB 5+. On a
+standalone mongod, or any server that rejects either, the watcher stops for good
+and get() returns None, so the persistence reads fall back to the scene stats or
+aggregation.
+'''
+
+import os
+import threading
+import time
+
+from bson import ObjectId, Timestamp
+from bson.errors import InvalidDocument
+from pymongo.errors import ConfigurationError, DuplicateKeyError, OperationFailure, PyMongoError
+
+from .persistence import aggregate_persist_scenes_all, get_arenaobjects_collection, get_stats_meta_collection
+
+WATCH_COLLECTION = "arenaobjects_scene_watch"
+WATCH_META_ID = "scene_watch"
+WATCH_CHECKPOINT_INTERVAL = 300  # seconds between checkpoints of changed summaries
+WATCH_CHECKPOINT_BATCH = 1000  # scene documents per checkpoint insert
+WATCH_RESEED_INTERVAL = 60  # seconds between reseeds for deletes without a pre-image
+WATCH_RETRY = 5  # seconds before reopening a failed stream
+# the stored resume token can no longer be used: InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost
+RESUME_ERRORS = (260, 280, 286)
+# the seed snapshot expired or is not available yet: SnapshotTooOld, SnapshotUnavailable
+SNAPSHOT_ERRORS = (239, 246)
+
+WATCH_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+    {"$project": {
+        "operationType": 1,
+        "fullDocument.namespace": 1,
+        "fullDocument.sceneId": 1,
+        "fullDocument.updatedAt": 1,
+        "fullDocumentBeforeChange.namespace": 1,
+        "fullDocumentBeforeChange.sceneId": 1,
+    }},
+]
+
+
+def get_scene_watch_collection():
+    from .persist_db import get_persist_db
+    return get_persist_db()[WATCH_COLLECTION]
+
+
+def _scene_name(doc):
+    return f"{doc.get('namespace')}/{doc.get('sceneId')}"
+
+
+def _newer(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class SceneWatcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._unsupported = False
+        self._reset()
+
+    def _reset(self):
+        self._scenes = {}
+        self._token = None
+        self._ready = False
+        self._changed = False
+        self._reseed = False
+        self._seeded_at = 0
+        self._checkpoint_loaded = False
+
+    def start(self):
+        """Starts the watcher thread of this process, unless running or the server does not support change streams."""
+        with self._lock:
+            if self._unsupported:
+                return
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._reset()  # forked, the parent's summaries and thread are not ours
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="persist-scene-watch", daemon=True)
+            self._thread.start()
+
+    def get(self):
+        """Returns a copy of the {"namespace/sceneId": {"last_updated", "count"}} summaries, None while not watching."""
+        self.start()
+        with self._lock:
+            if not self._ready:
+                return None
+            return {name: dict(summary) for name, summary in self._scenes.items()}
+
+    def _run(self):
+        while True:
+            try:
+                if self._watch():
+                    continue  # reseeding, reopen the stream at once
+            except (ConfigurationError, OperationFailure) as err:
+                # ConfigurationError: the server is too old for snapshot reads
+                code = getattr(err, "code", None)
+                with self._lock:
+                    self._ready = False
+                    if code in RESUME_ERRORS:
+                        self._token = None
+                    elif code not in SNAPSHOT_ERRORS:
+                        self._unsupported = True
+                        print(f"arena_persist: change stream unavailable, summaries read from queries: {err}")
+                        return
+                print(f"arena_persist: change stream cannot resume, reseeding: {err}")
+            except PyMongoError as err:
+                with self._lock:
+                    self._ready = False
+                print(f"arena_persist: change stream failed, retrying: {err}")
+            time.sleep(WATCH_RETRY)
+
+    def _watch(self):
+        """Follows the change stream until it closes. Returns True when it stopped to reseed the summaries."""
+        if self._token is None and not self._checkpoint_loaded:
+            # once: after a failed resume the checkpoint's token is no good either
+            self._checkpoint_loaded = True
+            self._load_checkpoint()
+        start_at = None
+        if self._token is None:
+            # aggregate first, then stream from just after the snapshot it read
+            read_at = self._seed()
+            start_at = Timestamp(read_at.time, read_at.inc + 1)
+        with get_arenaobjects_collection().watch(
+            WATCH_PIPELINE,
+            full_document="updateLookup",
+            full_document_before_change="whenAvailable",
+            resume_after=self._token,
+            start_at_operation_time=start_at,
+        ) as stream:
+            with self._lock:
+                self._ready = True
+            checkpointed = time.monotonic()
+            while stream.alive:
+                change = stream.try_next()
+                with self._lock:
+                    if change is not None:
+                        self._apply(change)
+                    self._token = stream.resume_token
+                    if self._reseed and time.monotonic() - self._seeded_at >= WATCH_RESEED_INTERVAL:
+                        # the summaries are still served until the new seed replaces them
+                        self._token = None
+                        return True
+                if self._changed and time.monotonic() - checkpointed >= WATCH_CHECKPOINT_INTERVAL:
+                    self._save_checkpoint()
+                    checkpointed = time.monotonic()
+        # invalidated, e.g. arenaobjects dropped or renamed
+        with self._lock:
+            self._ready = False
+            self._token = None
+        return False
+
+    def _seed(self):
+        """Replaces the summaries by one aggregation at a snapshot, returning the snapshot's cluster time."""
+        client = get_arenaobjects_collection().database.client
+        with client.start_session(snapshot=True) as session:
+            scenes = aggregate_persist_scenes_all(session=session)
+            # a snapshot read reports the cluster time it read at as its operation time
+            read_at = session.operation_time
+        with self._lock:
+            self._scenes = scenes
+            self._changed = True
+            self._reseed = False
+            self._seeded_at = time.monotonic()
+        return read_at
+
+    def _apply(self, change):
+        """Applies one change event to the summaries, the lock held."""
+        operation = change["operationType"]
+        if operation == "delete":
+            doc = change.get("fullDocumentBeforeChange")
+            if not doc:
+                self._reseed = True  # no pre-image, the scene is unknown
+                return
+            name = _scene_name(doc)
+            summary = self._scenes.get(name)
+            if summary is None:
+                self._reseed = True
+                return
+            summary["count"] -= 1
+            if summary["count"] <= 0:
+                del self._scenes[name]
+        else:
+            doc = change.get("fullDocument")
+            if not doc:
+                return  # deleted before the lookup, its delete event follows
+            name = _scene_name(doc)
+            summary = self._scenes.get(name)
+            if summary is None:
+                if operation != "insert":
+                    self._reseed = True  # an object of a scene we do not know of
+                    return
+                summary = self._scenes[name] = {"last_updated": None, "count": 0}
+            if operation == "insert":
+                summary["count"] += 1
+            summary["last_updated"] = _newer(summary["last_updated"], doc.get("updatedAt"))
+        self._changed = True
+
+    def _load_checkpoint(self):
+        meta = get_stats_meta_collection()
+        try:
+            checkpoint = meta.find_one({"_id": WATCH_META_ID})
+            if not checkpoint or not checkpoint.get("token") or not checkpoint.get("checkpoint"):
+                return
+            docs = get_scene_watch_collection().find({"checkpoint": checkpoint["checkpoint"]})
+            scenes = {doc["name"]: {"last_updated": doc.get("last_updated"), "count": doc["count"]} for doc in docs}
+            # a newer checkpoint saved meanwhile drops the documents of this one
+            current = meta.find_one({"_id": WATCH_META_ID}, {"checkpoint": 1}) or {}
+        except PyMongoError as err:
+            print(f"arena_persist: change stream checkpoint not loaded: {err}")
+            return
+        if current.get("checkpoint") != checkpoint["checkpoint"]:
+            return
+        with self._lock:
+            self._scenes = scenes
+            self._token = checkpoint["token"]
+            self._seeded_at = time.monotonic()
+
+    def _save_checkpoint(self):
+        """
+        Writes the summaries as one WATCH_COLLECTION document per scene under a new checkpoint id, then points
+        the WATCH_META_ID document and its resume token at them and drops older checkpoints. When another worker
+        saved a newer checkpoint meanwhile, that one is kept and ours dropped.
+        """
+        with self._lock:
+            token = self._token
+            scenes = [(name, summary["count"], summary["last_updated"]) for name, summary in self._scenes.items()]
+            self._changed = False
+        checkpoint = ObjectId()
+        collection = get_scene_watch_collection()
+        try:
+            collection.create_index("checkpoint")
+            for start in range(0, len(scenes), WATCH_CHECKPOINT_BATCH):
+                collection.insert_many([
+                    {"checkpoint": checkpoint, "name": name, "count": count, "last_updated": last_updated}
+                    for name, count, last_updated in scenes[start:start + WATCH_CHECKPOINT_BATCH]
+                ], ordered=False)
+            try:
+                get_stats_meta_collection().update_one(
+                    {"_id": WATCH_META_ID, "$or": [
+                        {"checkpoint": {"$lt": checkpoint}},
+                        {"checkpoint": {"$exists": False}},
+                    ]},
+                    {
+                        "$set": {"token": token, "checkpoint": checkpoint, "saved_at": time.time()},
+                        "$unset": {"scenes": ""},  # summaries once held in this document itself
+                    },
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                collection.delete_many({"checkpoint": checkpoint})
+                return
+            collection.delete_many({"checkpoint": {"$lt": checkpoint}})
+        except (InvalidDocument, PyMongoError) as err:
+            print(f"arena_persist: change stream checkpoint to {WATCH_COLLECTION} failed: {err}")
+
+
+scene_watcher = SceneWatcher()
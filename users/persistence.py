@@ -1,11 +1,93 @@
 '''
 Mongo DB PyMongo queries for Persist:
 https://pymongo.readthedocs.io/en/stable/index.html
+
+Scene and namespace summaries (object count, newest updatedAt) are served from
+the materialized SCENE_STATS_COLLECTION, one document per scene, instead of a
+$group over all of arenaobjects per page view. build_persist_scene_stats()
+refreshes it with $merge: every settings.PERSIST_STATS_INTERVAL seconds only the
+scenes updated since the last build, every settings.PERSIST_STATS_FULL_INTERVAL
+seconds all of them, also dropping scenes deleted elsewhere. Deletes leave no
+updatedAt to find, so a scene that lost objects to arena-persist, by a delete or
+an expireAt TTL, keeps its old count and last_updated until the next full build:
+up to PERSIST_STATS_FULL_INTERVAL seconds stale. Builds are started
+in the background by reads that find the stats due, and leased in
+STATS_META_COLLECTION so one worker builds at a time. Until the first build
+completes, reads aggregate arenaobjects directly. With settings.PERSIST_WATCH
+the summaries are served from memory instead while the change stream watcher of
+users/persist_watch.py is running.
 '''
-import json
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timezone
+from operator import itemgetter
 
 from bson import ObjectId
+from django.conf import settings
+from pymongo import ReturnDocument
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+
+from .circuit import CircuitBreaker, CircuitOpenError
+
+
+class PersistUnavailable(CircuitOpenError, ConnectionFailure):
+    """Raised without a query while the mongo circuit is open; a pymongo ConnectionFailure like any other."""
+
+
+# every query below runs through this breaker, so an unreachable mongodb fails fast once it is open
+mongo_breaker = CircuitBreaker("mongo", failure_exceptions=(ConnectionFailure,), open_error=PersistUnavailable)
+
+
+SCENE_STATS_COLLECTION = "arenaobjects_scene_stats"
+STATS_META_COLLECTION = "arena_account_meta"
+STATS_META_ID = "scene_stats"
+STATS_OVERLAP = 60  # seconds an incremental build looks back before the last one, for clock skew and late writes
+STATS_LEASE = 600  # seconds a worker may hold the build lease
+STATS_MATCH_BATCH = 500  # scenes per incremental $merge
+PERSIST_OBJECTS_BATCH = 500  # objects per cursor batch when listing a scene
+
+_build_lock = threading.Lock()
+
+SCENE_GROUP = {
+    "$group": {
+        "_id": {
+            "namespace": "$namespace",
+            "sceneId": "$sceneId",
+        },
+        "last_updated": {"$max": "$updatedAt"},
+        "count": {"$sum": 1}
+    }
+}
+
+NAMESPACE_GROUP = {
+    "$group": {
+        "_id": {
+            "namespace": "$namespace",
+        },
+        "last_updated": {"$max": "$updatedAt"},
+        "count": {"$sum": 1}
+    }
+}
+
+SCENE_NAME = {
+    "$project": {
+        "name": {
+            "$concat": ["$_id.namespace", "/", "$_id.sceneId"]
+        },
+        "last_updated": 1,
+        "count": 1
+    }
+}
+
+STATS_NAMESPACE_GROUP = {
+    "$group": {
+        "_id": "$namespace",
+        "last_updated": {"$max": "$last_updated"},
+        "count": {"$sum": "$count"}
+    }
+}
+
+STATS_PROJECTION = {"_id": 0, "run": 0}
 
 
 # assign accessible model for persist collection
@@ -13,6 +95,16 @@ def get_arenaobjects_collection():
     from .persist_db import get_persist_db
     return get_persist_db()['arenaobjects']
 
+
+def get_scene_stats_collection():
+    from .persist_db import get_persist_db
+    return get_persist_db()[SCENE_STATS_COLLECTION]
+
+
+def get_stats_meta_collection():
+    from .persist_db import get_persist_db
+    return get_persist_db()[STATS_META_COLLECTION]
+
 # arenaobjects schema reference:
 # https://github.com/arenaxr/arena-persist/blob/master/server.js#L30-L43
 # object_id: {type: String, required: true, index: true},
@@ -28,97 +120,272 @@ def get_arenaobjects_collection():
 # updatedAt: {type: Date}, // via timestamps: true
 
 
-class MongoJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, ObjectId):
-            return str(o)  # Convert ObjectId to string
-        if isinstance(o, datetime):
-            return o.isoformat()  # Convert datetime to ISO format
-        return super().default(o)  # Call the default method for other types
+def bson_to_json(value):
+    """Returns a BSON document or value made JSON-serializable: ObjectIds as strings, datetimes in ISO format."""
+    if isinstance(value, dict):
+        return {key: bson_to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [bson_to_json(item) for item in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
 
 
-def read_persist_ns_all():
-    arenaobjects = get_arenaobjects_collection().aggregate([{
-        "$group": {
-            "_id": {
-                "namespace": "$namespace",
-            },
-            "last_updated": {"$max": "$updatedAt"},
-            "count": {"$sum": 1}
-        }
-    }])
-    return {doc['_id']['namespace']: {'last_updated': doc.get('last_updated'), 'count': doc.get('count', 0)} for doc in arenaobjects}
+def summarize(docs, name):
+    """Returns {name(doc): {"last_updated", "count"}} of summary documents."""
+    return {name(doc): {'last_updated': doc.get('last_updated'), 'count': doc.get('count', 0)} for doc in docs}
 
 
-def read_persist_scenes_all():
-    arenaobjects = get_arenaobjects_collection().aggregate([
-        {
-            "$group": {
-                "_id": {
-                    "namespace": "$namespace",
-                    "sceneId": "$sceneId",
-                },
-                "last_updated": {"$max": "$updatedAt"},
-                "count": {"$sum": 1}
-            }
-        },
-        {
-            "$project": {
-                "name": {
-                    "$concat": ["$_id.namespace", "/", "$_id.sceneId"]
-                },
-                "last_updated": 1,
-                "count": 1
-            }
-        }
-    ])
-    return {doc['name']: {'last_updated': doc.get('last_updated'), 'count': doc.get('count', 0)} for doc in arenaobjects}
+def scene_name(doc):
+    return f"{doc['namespace']}/{doc['sceneId']}"
 
 
-def read_persist_scenes_by_namespace(namespaces):
+def aggregate_persist_ns_all():
+    arenaobjects = get_arenaobjects_collection().aggregate([NAMESPACE_GROUP])
+    return summarize(arenaobjects, lambda doc: doc['_id']['namespace'])
+
+
+def aggregate_persist_scenes_all(session=None):
+    arenaobjects = get_arenaobjects_collection().aggregate([SCENE_GROUP, SCENE_NAME], session=session)
+    return summarize(arenaobjects, itemgetter('name'))
+
+
+def aggregate_persist_scenes_by_namespace(namespaces):
     arenaobjects = get_arenaobjects_collection().aggregate([
         {
             "$match": {
                 "namespace": {"$in": namespaces}
             }
         },
-        {
-            "$group": {
-                "_id": {
-                    "namespace": "$namespace",
-                    "sceneId": "$sceneId",
-                },
-                "last_updated": {"$max": "$updatedAt"},
-                "count": {"$sum": 1}
-            }
-        },
-        {
-            "$project": {
-                "name": {
-                    "$concat": ["$_id.namespace", "/", "$_id.sceneId"]
-                },
-                "last_updated": 1,
-                "count": 1
-            }
-        }
+        SCENE_GROUP,
+        SCENE_NAME,
     ])
-    return {doc['name']: {'last_updated': doc.get('last_updated'), 'count': doc.get('count', 0)} for doc in arenaobjects}
+    return summarize(arenaobjects, itemgetter('name'))
+
+
+def get_watched_scenes():
+    """
+    Returns the scene summaries kept by the change stream watcher, None when settings.PERSIST_WATCH is off or the
+    stream is not running.
+    """
+    if not settings.PERSIST_WATCH:
+        return None
+    from .persist_watch import scene_watcher
+    return scene_watcher.get()
+
+
+def namespace_totals(scenes):
+    """Returns namespace summaries totalling the scene summaries scenes."""
+    namespaces = {}
+    for name, summary in scenes.items():
+        ns = namespaces.setdefault(name.partition("/")[0], {'last_updated': None, 'count': 0})
+        if summary['last_updated'] is not None and (
+                ns['last_updated'] is None or summary['last_updated'] > ns['last_updated']):
+            ns['last_updated'] = summary['last_updated']
+        ns['count'] += summary['count']
+    return namespaces
+
 
+def scenes_in_namespaces(scenes, namespaces):
+    namespaces = set(namespaces)
+    return {name: summary for name, summary in scenes.items() if name.partition("/")[0] in namespaces}
+
+
+@mongo_breaker.guard
+def read_persist_ns_all():
+    scenes = get_watched_scenes()
+    if scenes is not None:
+        return namespace_totals(scenes)
+    if not use_persist_scene_stats():
+        return aggregate_persist_ns_all()
+    return summarize(get_scene_stats_collection().aggregate([STATS_NAMESPACE_GROUP]), itemgetter('_id'))
+
+
+@mongo_breaker.guard
+def read_persist_scenes_all():
+    scenes = get_watched_scenes()
+    if scenes is not None:
+        return scenes
+    if not use_persist_scene_stats():
+        return aggregate_persist_scenes_all()
+    return summarize(get_scene_stats_collection().find({}, STATS_PROJECTION), scene_name)
+
+
+@mongo_breaker.guard
+def read_persist_scenes_by_namespace(namespaces):
+    scenes = get_watched_scenes()
+    if scenes is not None:
+        return scenes_in_namespaces(scenes, namespaces)
+    if not use_persist_scene_stats():
+        return aggregate_persist_scenes_by_namespace(namespaces)
+    stats = get_scene_stats_collection().find({"namespace": {"$in": namespaces}}, STATS_PROJECTION)
+    return summarize(stats, scene_name)
 
-def read_persist_scene_objects(namespace, scene):
+
+@mongo_breaker.guard
+def build_persist_scene_stats(full=False):
+    """
+    Refreshes SCENE_STATS_COLLECTION from arenaobjects with $merge: all scenes when full, dropping scenes no
+    longer found, else only scenes with objects updated since the last build.
+    Returns the number of scenes merged, None when another worker holds the build lease.
+    """
+    meta = get_stats_meta_collection()
+    started = time.time()
+    try:
+        meta.update_one({"_id": STATS_META_ID}, {"$setOnInsert": {"lease_until": 0}}, upsert=True)
+    except DuplicateKeyError:
+        pass  # inserted concurrently
+    state = meta.find_one_and_update(
+        {"_id": STATS_META_ID, "lease_until": {"$lt": started}},
+        {"$set": {"lease_until": started + STATS_LEASE}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if state is None:
+        return None
+    try:
+        full = full or not state.get("full_built_at")
+        arenaobjects = get_arenaobjects_collection()
+        stats = get_scene_stats_collection()
+        run = ObjectId()
+        merge = [
+            SCENE_GROUP,
+            {"$set": {"namespace": "$_id.namespace", "sceneId": "$_id.sceneId", "run": {"$literal": run}}},
+            {"$merge": {"into": SCENE_STATS_COLLECTION, "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]
+        if full:
+            stats.create_index([("namespace", 1), ("sceneId", 1)])
+            arenaobjects.aggregate(merge)
+            stats.delete_many({"run": {"$ne": run}})
+            merged = stats.count_documents({})
+        else:
+            since = datetime.fromtimestamp(state["built_at"] - STATS_OVERLAP, timezone.utc)
+            touched = [doc["_id"] for doc in arenaobjects.aggregate([
+                {"$match": {"updatedAt": {"$gte": since}}},
+                {"$group": {"_id": {"namespace": "$namespace", "sceneId": "$sceneId"}}},
+            ])]
+            for i in range(0, len(touched), STATS_MATCH_BATCH):
+                arenaobjects.aggregate([{"$match": {"$or": touched[i:i + STATS_MATCH_BATCH]}}, *merge])
+            merged = len(touched)
+        update = {"built_at": started, "lease_until": 0}
+        if full:
+            update["full_built_at"] = started
+        meta.update_one({"_id": STATS_META_ID}, {"$set": update})
+        return merged
+    except BaseException:
+        meta.update_one({"_id": STATS_META_ID}, {"$set": {"lease_until": 0}})
+        raise
+
+
+def _build_in_background(full):
+    if not _build_lock.acquire(blocking=False):
+        return  # this process is building already
+
+    def build():
+        try:
+            build_persist_scene_stats(full)
+        except Exception as err:
+            print(f"arena_persist: scene stats build failed: {err}")
+        finally:
+            _build_lock.release()
+    threading.Thread(target=build, name="persist-scene-stats", daemon=True).start()
+
+
+def stats_usable(state):
+    """
+    Returns True when reads may be served from SCENE_STATS_COLLECTION given its STATS_META_ID document, starting
+    a background build when one is due. False when not built yet.
+    """
+    state = state or {}
+    now = time.time()
+    full_built_at = state.get("full_built_at")
+    if not full_built_at:
+        _build_in_background(full=True)
+        return False
+    if now - full_built_at > settings.PERSIST_STATS_FULL_INTERVAL:
+        _build_in_background(full=True)
+    elif now - state.get("built_at", 0) > settings.PERSIST_STATS_INTERVAL:
+        _build_in_background(full=False)
+    return True
+
+
+def use_persist_scene_stats():
+    """
+    Returns True when reads may be served from SCENE_STATS_COLLECTION, starting a background build when one is due.
+    False when stats are disabled (settings.PERSIST_STATS_INTERVAL 0) or not built yet.
+    """
+    if settings.PERSIST_STATS_INTERVAL <= 0:
+        return False
+    return stats_usable(get_stats_meta_collection().find_one({"_id": STATS_META_ID}))
+
+
+def scene_summary_pipeline(namespace, scene):
+    return [
+        {"$match": {"namespace": namespace, "sceneId": scene}},
+        {"$project": {"_id": 0, "updatedAt": 1}},
+        {"$group": {"_id": None, "last_updated": {"$max": "$updatedAt"}, "count": {"$sum": 1}}},
+    ]
+
+
+def scene_summary(docs):
+    for doc in docs:
+        return {'last_updated': doc.get('last_updated'), 'count': doc.get('count', 0)}
+    return {'last_updated': None, 'count': 0}
+
+
+@mongo_breaker.guard
+def read_persist_scene_summary(namespace, scene):
+    """Returns {"last_updated", "count"} of one scene's objects, reading only their updatedAt."""
+    return scene_summary(get_arenaobjects_collection().aggregate(scene_summary_pipeline(namespace, scene)))
+
+
+def scene_objects_query(namespace, scene, after=None):
+    """Raises bson.errors.InvalidId for a malformed after."""
     query = {"namespace": namespace, "sceneId": scene}
-    arenaobjects = get_arenaobjects_collection().find(query)
-    json_str = MongoJSONEncoder().encode(list(arenaobjects))
-    return json.loads(json_str)
+    if after:
+        query["_id"] = {"$gt": ObjectId(after)}
+    return query
+
+
+def iter_persist_scene_objects(namespace, scene, after=None, limit=0):
+    """
+    Yields a scene's objects in _id order as JSON-compatible dicts, fetched PERSIST_OBJECTS_BATCH at a time, so
+    memory stays flat however large the scene.
+    Args:
+        after (string): Object _id to continue after, the last one of the previous page.
+        limit (int): Objects to yield at most, 0 for all.
+    Raises bson.errors.InvalidId for a malformed after.
+    """
+    query = scene_objects_query(namespace, scene, after)
+    cursor = get_arenaobjects_collection().find(query, sort=[("_id", 1)], limit=limit, batch_size=PERSIST_OBJECTS_BATCH)
+    # the cursor queries as it is iterated, so the breaker spans the iteration rather than the find() call
+    mongo_breaker.before_call()
+    failed = False
+    try:
+        for doc in cursor:
+            yield bson_to_json(doc)
+    except ConnectionFailure:
+        failed = True
+        mongo_breaker.record_failure()
+        raise
+    finally:
+        cursor.close()
+        if not failed:
+            mongo_breaker.record_success()
 
 
+@mongo_breaker.guard
 def delete_persist_scene_objects(namespace, scene):
     query = {"namespace": namespace, "sceneId": scene}
     result = get_arenaobjects_collection().delete_many(query)
+    get_scene_stats_collection().delete_many(query)
     return getattr(result, "deleted_count", 0) > 0
 
 
+@mongo_breaker.guard
 def delete_persist_namespace_objects(namespace):
     query = {"namespace": namespace}
     result = get_arenaobjects_collection().delete_many(query)
+    get_scene_stats_collection().delete_many(query)
     return getattr(result, "deleted_count", 0) > 0
@@ -0,0 +1,168 @@
+'''
+persistence_async.py: Coroutine versions of the Persist queries in
+users/persistence.py, on PyMongo's async API, for async endpoints and views.
+
+Queries run on the event loop's client from get_async_persist_db(), with its
+own pool (settings.PERSIST_ASYNC_POOL_SIZE) and server selection timeout
+(settings.PERSIST_ASYNC_SELECTION_TIMEOUT), so a request can await a Mongo
+aggregation while its SQLite queries run in a thread. Pipelines, summary
+formats, the scene stats and change stream watcher, and the mongo circuit
+breaker are shared with users/persistence.py; stats builds still run in its
+background thread.
+'''
+
+from operator import itemgetter
+
+from django.conf import settings
+from pymongo.errors import ConnectionFailure
+
+from .persistence import (
+    NAMESPACE_GROUP,
+    PERSIST_OBJECTS_BATCH,
+    SCENE_GROUP,
+    SCENE_NAME,
+    SCENE_STATS_COLLECTION,
+    STATS_META_COLLECTION,
+    STATS_META_ID,
+    STATS_NAMESPACE_GROUP,
+    STATS_PROJECTION,
+    bson_to_json,
+    get_watched_scenes,
+    mongo_breaker,
+    namespace_totals,
+    scene_name,
+    scene_objects_query,
+    scene_summary,
+    scene_summary_pipeline,
+    scenes_in_namespaces,
+    stats_usable,
+    summarize,
+)
+
+
+def get_arenaobjects_collection():
+    from .persist_db import get_async_persist_db
+    return get_async_persist_db()['arenaobjects']
+
+
+def get_scene_stats_collection():
+    from .persist_db import get_async_persist_db
+    return get_async_persist_db()[SCENE_STATS_COLLECTION]
+
+
+def get_stats_meta_collection():
+    from .persist_db import get_async_persist_db
+    return get_async_persist_db()[STATS_META_COLLECTION]
+
+
+async def aggregate(collection, pipeline):
+    return await (await collection.aggregate(pipeline)).to_list()
+
+
+async def aggregate_persist_ns_all():
+    return summarize(await aggregate(get_arenaobjects_collection(), [NAMESPACE_GROUP]), lambda doc: doc['_id']['namespace'])
+
+
+async def aggregate_persist_scenes_all():
+    return summarize(await aggregate(get_arenaobjects_collection(), [SCENE_GROUP, SCENE_NAME]), itemgetter('name'))
+
+
+async def aggregate_persist_scenes_by_namespace(namespaces):
+    arenaobjects = await aggregate(get_arenaobjects_collection(), [
+        {
+            "$match": {
+                "namespace": {"$in": namespaces}
+            }
+        },
+        SCENE_GROUP,
+        SCENE_NAME,
+    ])
+    return summarize(arenaobjects, itemgetter('name'))
+
+
+async def use_persist_scene_stats():
+    """
+    Returns True when reads may be served from SCENE_STATS_COLLECTION, starting a background build when one is due.
+    False when stats are disabled (settings.PERSIST_STATS_INTERVAL 0) or not built yet.
+    """
+    if settings.PERSIST_STATS_INTERVAL <= 0:
+        return False
+    return stats_usable(await get_stats_meta_collection().find_one({"_id": STATS_META_ID}))
+
+
+@mongo_breaker.aguard
+async def read_persist_ns_all():
+    scenes = get_watched_scenes()
+    if scenes is not None:
+        return namespace_totals(scenes)
+    if not await use_persist_scene_stats():
+        return await aggregate_persist_ns_all()
+    return summarize(await aggregate(get_scene_stats_collection(), [STATS_NAMESPACE_GROUP]), itemgetter('_id'))
+
+
+@mongo_breaker.aguard
+async def read_persist_scenes_all():
+    scenes = get_watched_scenes()
+    if scenes is not None:
+        return scenes
+    if not await use_persist_scene_stats():
+        return await aggregate_persist_scenes_all()
+    return summarize(await get_scene_stats_collection().find({}, STATS_PROJECTION).to_list(), scene_name)
+
+
+@mongo_breaker.aguard
+async def read_persist_scenes_by_namespace(namespaces):
+    scenes = get_watched_scenes()
+    if scenes is not None:
+        return scenes_in_namespaces(scenes, namespaces)
+    if not await use_persist_scene_stats():
+        return await aggregate_persist_scenes_by_namespace(namespaces)
+    stats = get_scene_stats_collection().find({"namespace": {"$in": namespaces}}, STATS_PROJECTION)
+    return summarize(await stats.to_list(), scene_name)
+
+
+@mongo_breaker.aguard
+async def read_persist_scene_summary(namespace, scene):
+    """Returns {"last_updated", "count"} of one scene's objects, reading only their updatedAt."""
+    return scene_summary(await aggregate(get_arenaobjects_collection(), scene_summary_pipeline(namespace, scene)))
+
+
+async def iter_persist_scene_objects(namespace, scene, after=None, limit=0):
+    """
+    Yields a scene's objects in _id order as JSON-compatible dicts, fetched PERSIST_OBJECTS_BATCH at a time.
+    Args:
+        after (string): Object _id to continue after, the last one of the previous page.
+        limit (int): Objects to yield at most, 0 for all.
+    Raises bson.errors.InvalidId for a malformed after.
+    """
+    query = scene_objects_query(namespace, scene, after)
+    cursor = get_arenaobjects_collection().find(query, sort=[("_id", 1)], limit=limit, batch_size=PERSIST_OBJECTS_BATCH)
+    mongo_breaker.before_call()
+    failed = False
+    try:
+        async for doc in cursor:
+            yield bson_to_json(doc)
+    except ConnectionFailure:
+        failed = True
+        mongo_breaker.record_failure()
+        raise
+    finally:
+        await cursor.close()
+        if not failed:
+            mongo_breaker.record_success()
+
+
+@mongo_breaker.aguard
+async def delete_persist_scene_objects(namespace, scene):
+    query = {"namespace": namespace, "sceneId": scene}
+    result = await get_arenaobjects_collection().delete_many(query)
+    await get_scene_stats_collection().delete_many(query)
+    return getattr(result, "deleted_count", 0) > 0
+
+
+@mongo_breaker.aguard
+async def delete_persist_namespace_objects(namespace):
+    query = {"namespace": namespace}
+    result = await get_arenaobjects_collection().delete_many(query)
+    await get_scene_stats_collection().delete_many(query)
+    return getattr(result, "deleted_count", 0) > 0
@@ -64,3 +64,21 @@ class MQTTAuthRequestSchema(Schema):
     handrightid:  Optional[bool] = Field(False, description="Request permission for right controller object.")
     renderfusionid:  Optional[bool] = Field(False, description="Request render-fusion host permission.")
     environmentid:  Optional[bool] = Field(False, description="Request environment host permission.")
+
+
+class MQTTAuthBatchEntrySchema(Schema):
+    scene: Optional[str] = Field(None, description="ARENA namespaced scene name: 'ns/sn'.")
+    device: Optional[str] = Field(None, description="ARENA namespaced device name: 'ns/dn', instead of a scene.")
+    realm: Optional[str] = Field(None, description="ARENA realm.")
+    client: Optional[str] = Field(None, description="Client type for reference, e.g. 'webScene', 'py1.2.3', 'unity'.")
+    camid: Optional[bool] = Field(False, description="Request permission for camera object.")
+    handleftid: Optional[bool] = Field(False, description="Request permission for left controller object.")
+    handrightid: Optional[bool] = Field(False, description="Request permission for right controller object.")
+    renderfusionid: Optional[bool] = Field(False, description="Request render-fusion host permission.")
+    environmentid: Optional[bool] = Field(False, description="Request environment host permission.")
+
+
+class MQTTAuthBatchRequestSchema(Schema):
+    id_token: Optional[str] = Field(None, description="ID token for authentication.")
+    username: Optional[str] = Field(None, description="ARENA account username, only used for anonymous.")
+    requests: List[MQTTAuthBatchEntrySchema] = Field(..., description="Scene or device token requests.")
@@ -0,0 +1,90 @@
+'''
+signals.py: Cache invalidation receivers, connected in UsersConfig.ready().
+Any change to a Namespace/Scene editors or viewers row, a rename or delete of a
+granted Namespace/Scene, or a User row being created/deleted invalidates the
+cached grants of exactly the users involved. Any Scene save or delete drops the
+cached flags of its old and new name.
+'''
+
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+
+from .models import Namespace, Scene
+from .permissions import invalidate_scene_perms, invalidate_user_grants
+
+GRANT_MODELS = (Namespace, Scene)
+GRANT_FIELDS = ("editors", "viewers")
+
+
+def _granted_user_ids(instance):
+    if instance.pk is None:
+        return set()
+    user_ids = set()
+    for field in GRANT_FIELDS:
+        user_ids.update(getattr(instance, field).values_list("pk", flat=True))
+    return user_ids
+
+
+def grant_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # user.namespace_editors.add(...) and friends: instance is the User
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_user_grants([instance.pk])
+        return
+    if action == "pre_clear":
+        # the cleared rows are gone by post_clear, remember who held them
+        field = next(f for f in GRANT_FIELDS if getattr(type(instance), f).through is sender)
+        instance._cleared_grant_user_ids = set(getattr(instance, field).values_list("pk", flat=True))
+    elif action == "post_clear":
+        invalidate_user_grants(getattr(instance, "_cleared_grant_user_ids", ()))
+    elif action in ("post_add", "post_remove"):
+        invalidate_user_grants(pk_set or ())
+
+
+def grant_saved(sender, instance, created, **kwargs):
+    # a renamed namespace/scene changes every grant that points at it
+    if not created:
+        invalidate_user_grants(_granted_user_ids(instance))
+
+
+def grant_pre_delete(sender, instance, **kwargs):
+    instance._deleted_grant_user_ids = _granted_user_ids(instance)
+
+
+def grant_deleted(sender, instance, **kwargs):
+    invalidate_user_grants(getattr(instance, "_deleted_grant_user_ids", ()))
+
+
+def user_changed(sender, instance, created=True, **kwargs):
+    # ids can be reused after a delete, never let a new user see old grants
+    if created:
+        invalidate_user_grants([instance.pk])
+
+
+def scene_pre_save(sender, instance, **kwargs):
+    # remember the stored name, a rename must also drop the old name's flags
+    instance._stored_scene_name = None
+    if instance.pk is not None:
+        instance._stored_scene_name = Scene.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+
+
+def scene_changed(sender, instance, **kwargs):
+    invalidate_scene_perms({instance.name, getattr(instance, "_stored_scene_name", None)})
+
+
+def connect_signals():
+    for model in GRANT_MODELS:
+        for field in GRANT_FIELDS:
+            m2m_changed.connect(
+                grant_m2m_changed,
+                sender=getattr(model, field).through,
+                dispatch_uid=f"users_grants_{model.__name__}_{field}",
+            )
+        post_save.connect(grant_saved, sender=model, dispatch_uid=f"users_grants_save_{model.__name__}")
+        pre_delete.connect(grant_pre_delete, sender=model, dispatch_uid=f"users_grants_pre_delete_{model.__name__}")
+        post_delete.connect(grant_deleted, sender=model, dispatch_uid=f"users_grants_delete_{model.__name__}")
+    pre_save.connect(scene_pre_save, sender=Scene, dispatch_uid="users_scene_perms_pre_save")
+    post_save.connect(scene_changed, sender=Scene, dispatch_uid="users_scene_perms_save")
+    post_delete.connect(scene_changed, sender=Scene, dispatch_uid="users_scene_perms_delete")
+    post_save.connect(user_changed, sender=User, dispatch_uid="users_grants_user_save")
+    post_delete.connect(user_changed, sender=User, dispatch_uid="users_grants_user_delete")
@@ -0,0 +1,100 @@
+'''
+signing.py: Process-wide cache of the parsed MQTT token signing key. The PEM at
+settings.MQTT_TOKEN_PRIVKEY is read and parsed once, then only re-read when the
+file's identity (device, inode, mtime, size) changes, so key rotation by
+replacing the file still takes effect without a restart.
+
+The JWT algorithm follows the key type: RS256 for RSA keys, ES256/ES384/ES512
+for EC keys on the matching NIST curve, and EdDSA for Ed25519/Ed448 keys.
+'''
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed448, ed25519, rsa
+from django.conf import settings
+
+_lock = threading.Lock()
+_key_path = None
+_key_stat = None
+_key = None
+
+_pool = None
+
+EC_ALGORITHMS = {"secp256r1": "ES256", "secp384r1": "ES384", "secp521r1": "ES512"}
+
+
+def _stat_signature(st):
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def get_signing_key():
+    """Returns the parsed private key for signing MQTT tokens.
+
+    Returns:
+        PrivateKeyTypes: The loaded private key object, or None when the keyfile is missing.
+    """
+    global _key_path, _key_stat, _key
+    path = settings.MQTT_TOKEN_PRIVKEY
+    try:
+        signature = _stat_signature(os.stat(path))
+    except (OSError, TypeError, ValueError):
+        return None
+    # fast path: same file as last load, no lock needed to read the cached key
+    key = _key
+    if key is not None and _key_path == path and _key_stat == signature:
+        return key
+
+    with _lock:
+        if _key is not None and _key_path == path and _key_stat == signature:
+            return _key
+        try:
+            with open(path, "rb") as privatefile:
+                pem = privatefile.read()
+        except OSError:
+            return None
+        key = serialization.load_pem_private_key(pem, password=None)
+        _key_path, _key_stat, _key = path, signature, key
+        print(f"Loaded MQTT token signing key: {path}")
+        return key
+
+
+def clear_signing_key():
+    """Drop the cached key, the next get_signing_key() call reloads it from disk."""
+    global _key_path, _key_stat, _key
+    with _lock:
+        _key_path = _key_stat = _key = None
+
+
+def get_signing_algorithm(key):
+    """Returns the JWT algorithm for signing with key, None for an unsupported key type."""
+    if isinstance(key, rsa.RSAPrivateKey):
+        return "RS256"
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        return EC_ALGORITHMS.get(key.curve.name)
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed448.Ed448PrivateKey)):
+        return "EdDSA"
+    return None
+
+
+def _signing_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=settings.TOKEN_SIGNING_THREADS, thread_name_prefix="token-signing")
+    return _pool
+
+
+async def run_in_signing_pool(func, *args, **kwargs):
+    """Await func(*args, **kwargs) on the bounded token signing thread pool.
+
+    Keeps CPU-bound JWT signing off the event loop without starting a thread
+    per request; func must not touch the database.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_signing_pool(), functools.partial(func, *args, **kwargs))
@@ -0,0 +1,115 @@
+"""Tests for users/api_async.py, the coroutine endpoints served under ASGI.
+
+The views are awaited directly with RequestFactory requests, so they are
+covered whatever settings.ASYNC_API the test process was started with. Each
+must answer exactly like its synchronous twin in users/api.py.
+"""
+
+from unittest import mock
+
+from allauth.socialaccount.models import SocialAccount
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.test import RequestFactory, TestCase, override_settings
+
+from users import api_async, utils, views
+from users.models import Namespace, Scene
+from users.schemas import MQTTAuthRequestSchema
+from users.tests.mqtt_keys import PRIVATE_KEY_PATH, decode_token
+from users.versioning import API_V1, API_V2
+
+
+@override_settings(MQTT_TOKEN_PRIVKEY=PRIVATE_KEY_PATH)
+class AsyncApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bob = User.objects.create_user(username="bob", password="pw", first_name="Bob")
+        SocialAccount.objects.create(user=cls.bob, provider="google", uid="google-sub-1")
+
+    def setUp(self):
+        caches[settings.PERMISSIONS_CACHE_ALIAS].clear()
+
+    def request(self, method="get", user=None, version=API_V2):
+        request = getattr(RequestFactory(), method)("/")
+        user = user or AnonymousUser()
+
+        async def auser():
+            return user
+
+        request.auser = auser
+        request.version = version
+        return request
+
+    async def test_user_state_session_and_id_token(self):
+        status, data = await api_async.user_state(self.request(user=self.bob))
+        self.assertEqual((status, data["username"], data["fullname"]), (200, "bob", "Bob"))
+        status, data = await api_async.user_state(self.request())
+        self.assertEqual(data, {"authenticated": False})
+        with mock.patch("users.utils.get_google_uid_from_id_token", return_value="google-sub-1"):
+            status, data = await api_async.user_state(self.request("post"), id_token="token")
+        self.assertEqual(data["username"], "bob")
+        with mock.patch("users.utils.get_google_uid_from_id_token", return_value="google-sub-2"):
+            status, data = await api_async.user_state(self.request("post"), id_token="token")
+        self.assertEqual(status, 403)
+
+    async def test_mqtt_auth_issues_signed_token(self):
+        payload = MQTTAuthRequestSchema(scene="bob/lobby", client="webScene", camid=True)
+        response = await api_async.mqtt_auth(self.request("post", user=self.bob), payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("mqtt_token", response.cookies)
+        claims = decode_token(response.cookies["mqtt_token"].value)
+        self.assertEqual(claims["sub"], "bob")
+        self.assertIn("realm/s/bob/+/+/+/+", claims["subs"])
+
+    async def test_mqtt_auth_rejects_v1_and_bad_parameters(self):
+        payload = MQTTAuthRequestSchema(username="anonymous-joe", client="webScene")
+        status, _ = await api_async.mqtt_auth(self.request("post", version=API_V1), payload)
+        self.assertEqual(status, 426)
+        status, data = await api_async.mqtt_auth(self.request("post"), payload.copy(update={"client": "bad client"}))
+        self.assertEqual((status, data["error"]), (400, "Invalid form parameter: 'client'"))
+        status, _ = await api_async.mqtt_auth(self.request("post"), payload.copy(update={"username": "joe"}))
+        self.assertEqual(status, 400)
+
+    async def test_health_shares_the_cached_checks(self):
+        data = {"result": "success", "sqlite_status": "healthy", "mongo_status": "healthy", "filestore_status": "healthy"}
+        with mock.patch.object(api_async, "get_health", return_value=(200, data)) as get_health:
+            self.assertEqual(await api_async.health_state(self.request()), (200, data))
+        get_health.assert_called_once_with()
+
+    async def test_my_scenes_merges_edit_and_view_lists(self):
+        with mock.patch.object(api_async, "aget_my_edit_scenes", return_value=[{"name": "bob/b"}]), mock.patch.object(
+            api_async, "aget_my_view_scenes", return_value=[{"name": "amy/a"}, {"name": "bob/b"}]
+        ):
+            status, data = await api_async.list_my_scenes(self.request(user=self.bob))
+        self.assertEqual((status, data), (200, [{"name": "amy/a"}, {"name": "bob/b"}]))
+
+    async def test_persist_lists_match_the_sync_helpers(self):
+        await Scene.objects.acreate(name="bob/lobby")
+        await Namespace.objects.acreate(name="carol")
+        persisted = {"bob/lobby": {"last_updated": None, "count": 2}, "bob/hall": {"last_updated": None, "count": 1}}
+        namespaces = {"bob": {"last_updated": None, "count": 3}, "carol": {"last_updated": None, "count": 1}}
+        with mock.patch.object(utils, "read_persist_scenes_by_namespace", return_value=persisted), mock.patch.object(
+            utils, "read_persist_ns_all", return_value=namespaces
+        ):
+            scenes = await utils.sync_to_async(utils.get_my_edit_scenes)(self.bob, API_V2)
+            ns = await utils.sync_to_async(utils.get_my_edit_namespaces)(self.bob, API_V2)
+        with mock.patch.object(utils, "aread_persist_scenes_by_namespace", return_value=persisted) as aread, \
+                mock.patch.object(utils, "aread_persist_ns_all", return_value=namespaces):
+            self.assertEqual(await utils.aget_my_edit_scenes(self.bob, API_V2), scenes)
+            self.assertEqual(await utils.aget_my_edit_namespaces(self.bob, API_V2), ns)
+            self.assertEqual(await utils.aget_my_view_scenes(self.bob, API_V2), [])
+        aread.assert_awaited_once_with(["bob"])
+        self.assertEqual({sc["name"] for sc in scenes}, {"bob/lobby", "bob/hall"})
+
+    async def test_profile_pages_render_async(self):
+        request = self.request(user=self.bob)
+        request.user = self.bob
+        request.session = {}
+        with mock.patch.object(views, "aget_my_edit_scenes", return_value=[{"name": "bob/lobby"}]), mock.patch.object(
+            views, "aget_my_edit_namespaces", return_value=[{"name": "bob"}]
+        ):
+            response = await views.aprofile_scenes(request)
+            self.assertContains(response, "bob/lobby")
+            response = await views.auser_profile(request)
+            self.assertContains(response, "bob/lobby")
@@ -0,0 +1,72 @@
+"""Tests for the check_persist_indexes management command.
+
+Every arenaobjects query shape must be explained without running it, a COLLSCAN
+flagged unless the shape reads every object by design, and --create-index must
+add only the missing indexes. Mongo is mocked.
+"""
+
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from users.management.commands import check_persist_indexes
+from users.management.commands.check_persist_indexes import INDEXES, plan_stages, query_shapes
+
+COLLSCAN = {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+IXSCAN = {
+    "stages": [
+        {"$cursor": {"queryPlanner": {
+            "winningPlan": {"stage": "PROJECTION_COVERED", "inputStage": {"stage": "IXSCAN", "indexName": "scene"}},
+            "rejectedPlans": [{"stage": "COLLSCAN"}],
+        }}},
+        {"$group": {}},
+    ]
+}
+
+
+class CheckPersistIndexesTests(SimpleTestCase):
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.objects = self.db.__getitem__.return_value
+        self.objects.index_information.return_value = {"_id_": {"key": [("_id", 1)]}}
+        self.objects.find_one.return_value = {"namespace": "bob", "sceneId": "lobby"}
+        patcher = mock.patch.object(check_persist_indexes, "get_persist_db", return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        call_command("check_persist_indexes", *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_plan_stages_skips_rejected_plans(self):
+        self.assertEqual(sorted(plan_stages(IXSCAN)), [("IXSCAN", "scene"), ("PROJECTION_COVERED", None)])
+
+    def test_collscans_flagged_unless_expected(self):
+        self.db.command.return_value = COLLSCAN
+        out = self.run_command()
+        shapes = query_shapes("bob", "lobby")
+        self.assertEqual(self.db.command.call_count, len(shapes))
+        for call in self.db.command.call_args_list:
+            self.assertEqual(call[0][0], "explain")
+            self.assertEqual(call[1], {"verbosity": "queryPlanner"})
+        self.assertIn(f"{sum(not full for _, _, full in shapes)} queries scan arenaobjects", out)
+        self.assertNotIn("aggregate_persist_scenes_all: COLLSCAN (COLLSCAN)", out)
+        self.assertIn("read_persist_scene_summary: COLLSCAN (COLLSCAN)", out)
+        self.objects.create_index.assert_not_called()
+
+    def test_index_scans_pass(self):
+        self.db.command.return_value = IXSCAN
+        out = self.run_command("--scene", "hall")
+        self.assertIn("read_persist_scene_summary: IXSCAN PROJECTION_COVERED using scene", out)
+        self.assertIn("No unexpected collection scans.", out)
+        summary = next(command for name, command, _ in query_shapes("bob", "hall") if name == "read_persist_scene_summary")
+        self.assertIn(mock.call("explain", summary, verbosity="queryPlanner"), self.db.command.call_args_list)
+
+    def test_create_index_adds_missing_only(self):
+        self.objects.index_information.return_value["scene"] = {"key": INDEXES[0]}
+        self.db.command.return_value = IXSCAN
+        self.run_command("--create-index")
+        self.objects.create_index.assert_called_once_with(INDEXES[1])
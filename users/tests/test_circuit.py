@@ -0,0 +1,126 @@
+"""Tests for users/circuit.py and the breakers around the File Store and MongoDB.
+
+A breaker must open after the configured consecutive failures, fail fast while
+open with an error callers already handle, let one trial call through when
+half-open, and be reported by /health.
+"""
+
+import time
+from unittest import mock
+
+import requests
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from pymongo.errors import ConnectionFailure, OperationFailure, ServerSelectionTimeoutError
+
+from users import filestore, persistence
+from users.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker("test", failure_exceptions=(ConnectionError,), failure_threshold=3,
+                                      reset_timeout=30)
+        self.down = mock.Mock(side_effect=ConnectionError("down"))
+
+    def trip(self):
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                self.breaker.call(self.down)
+
+    def test_opens_after_consecutive_failures_and_fails_fast(self):
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(self.down)
+        self.breaker.call(lambda: "ok")  # a success resets the count
+        self.trip()
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(self.down)
+        self.assertEqual(self.down.call_count, 4)
+
+    def test_half_open_lets_one_trial_through(self):
+        self.trip()
+        later = time.monotonic() + 31
+        with mock.patch("users.circuit.time.monotonic", return_value=later):
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            self.breaker.before_call()  # the trial
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.call(self.down)
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state, OPEN)
+        with mock.patch("users.circuit.time.monotonic", return_value=later + 31):
+            self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.snapshot(), {"state": CLOSED, "failures": 0, "open_s": None})
+
+    def test_answered_errors_and_failure_results(self):
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                self.breaker.call(mock.Mock(side_effect=ValueError("bad request")))
+        self.assertEqual(self.breaker.state, CLOSED)
+        breaker = CircuitBreaker("test", failure_exceptions=(), failure_result=lambda status: status >= 500,
+                                 failure_threshold=2)
+        breaker.call(lambda: 503)
+        breaker.call(lambda: 503)
+        self.assertEqual(breaker.state, OPEN)
+
+    async def test_acall_records_coroutine_outcomes(self):
+        async def down():
+            raise ConnectionError("down")
+
+        async def ok():
+            return "ok"
+
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                await self.breaker.acall(down)
+        with self.assertRaises(CircuitOpenError):
+            await self.breaker.aguard(ok)()
+        self.breaker.record_success()
+        self.assertEqual(await self.breaker.aguard(ok)(), "ok")
+
+
+class DependencyBreakerTests(TestCase):
+    def setUp(self):
+        for breaker in (filestore.filestore_breaker, persistence.mongo_breaker):
+            breaker.record_success()
+            self.addCleanup(breaker.record_success)
+
+    def test_filestore_outage_fails_fast(self):
+        session = mock.Mock()
+        session.request.side_effect = requests.exceptions.ConnectionError("down")
+        with mock.patch.object(filestore, "get_filestore_session", return_value=session), mock.patch.object(
+            filestore, "_opened_connections", return_value=0
+        ):
+            for _ in range(filestore.filestore_breaker.failure_threshold + 3):
+                self.assertFalse(filestore.get_filestore_health())
+        self.assertEqual(session.request.call_count, filestore.filestore_breaker.failure_threshold)
+
+    @override_settings(PERSIST_STATS_INTERVAL=0)
+    def test_mongo_outage_fails_fast(self):
+        collection = mock.Mock()
+        collection.aggregate.side_effect = ServerSelectionTimeoutError("mongodb:27017 timed out")
+        with mock.patch.object(persistence, "get_arenaobjects_collection", return_value=collection):
+            for _ in range(persistence.mongo_breaker.failure_threshold + 3):
+                with self.assertRaises(ConnectionFailure):
+                    persistence.read_persist_ns_all()
+            self.assertEqual(collection.aggregate.call_count, persistence.mongo_breaker.failure_threshold)
+            # query errors mean mongodb answered
+            persistence.mongo_breaker.record_success()
+            collection.aggregate.side_effect = OperationFailure("bad pipeline")
+            for _ in range(persistence.mongo_breaker.failure_threshold):
+                with self.assertRaises(OperationFailure):
+                    persistence.read_persist_ns_all()
+        self.assertEqual(persistence.mongo_breaker.state, CLOSED)
+
+    @override_settings(HEALTH_CACHE_TTL=0)
+    @mock.patch("users.health.get_filestore_health", return_value=True)
+    @mock.patch("users.health.get_persist_db")
+    def test_health_reports_circuits(self, mock_get_persist_db, mock_filestore):
+        for _ in range(persistence.mongo_breaker.failure_threshold):
+            persistence.mongo_breaker.record_failure()
+        response = Client().get("/user/health")
+        self.assertEqual(response.status_code, 503)
+        data = response.json()
+        self.assertEqual(data["mongo_status"], "unhealthy")
+        self.assertEqual(data["circuits"]["mongo"]["state"], OPEN)
+        self.assertEqual(data["circuits"]["filestore"], {"state": CLOSED, "failures": 0, "open_s": None})
+        mock_get_persist_db.assert_not_called()
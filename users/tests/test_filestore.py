@@ -0,0 +1,359 @@
+"""Tests for the Filebrowser api helpers in users/filestore.py.
+
+Every helper must go through the one pooled session with its per-call verify
+setting, only idempotent methods may be retried, and connection reuse must be
+counted per call. No network is used: a fake transport adapter answers.
+"""
+
+import contextlib
+import io
+import json
+import threading
+import time
+from unittest import mock
+
+import jwt
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from users import filestore
+
+ENV = {"HOSTNAME": "arena.example.com", "STORE_ADMIN_USERNAME": "admin", "STORE_ADMIN_PASSWORD": "adminpw",
+       "SECRET_KEY": "secret"}
+
+
+def make_jwt(exp_in=7200, **claims):
+    return jwt.encode({"exp": int(time.time()) + exp_in, **claims}, "fb-key", algorithm="HS256")
+
+
+class FakeAdapter(requests.adapters.HTTPAdapter):
+    """Answers each request with (status, body[, headers]) from its routes by method and path, or a callable of the request."""
+
+    def __init__(self, routes):
+        super().__init__()
+        self.routes = routes
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append((request, kwargs))
+        path = request.path_url.removeprefix("/storemng")
+        route = self.routes[(request.method, path)]
+        status, body, *headers = route(request) if callable(route) else route
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(*headers)
+        response._content = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        response.request = request
+        response.url = request.url
+        return response
+
+
+class FilestoreSessionTests(SimpleTestCase):
+    def test_one_session_with_idempotent_retries(self):
+        session = filestore.get_filestore_session()
+        self.assertIs(session, filestore.get_filestore_session())
+        retries = session.get_adapter("https://arena.example.com").max_retries
+        self.assertEqual(retries.total, filestore.FS_API_RETRIES)
+        self.assertEqual((retries.connect, retries.read), (filestore.FS_API_CONNECT_RETRIES, 0))
+        self.assertEqual(set(retries.status_forcelist), {502, 503, 504})
+        for method in ["GET", "PUT", "DELETE"]:
+            self.assertIn(method, retries.allowed_methods)
+        self.assertNotIn("POST", retries.allowed_methods)
+
+    def test_connection_reuse_is_counted_per_call(self):
+        filestore._stats.clear()
+        adapter = FakeAdapter({("GET", "/api/users"): (200, []), ("GET", "/api/users/7"): (200, {})})
+        session = requests.Session()
+        session.mount("https://", adapter)
+        # a connection is opened by the first call only
+        with mock.patch.object(filestore, "get_filestore_session", return_value=session), mock.patch.object(
+            filestore, "_opened_connections", side_effect=[0, 1, 1, 1, 1, 1]
+        ):
+            for path in ["/api/users", "/api/users", "/api/users/7"]:
+                filestore.filestore_request("GET", "arena.example.com", path, True)
+        self.assertEqual(
+            filestore.get_filestore_http_stats(),
+            {"GET /api/users": {"calls": 3, "reused": 2, "new_connections": 1, "retries": 0}},
+        )
+
+    def test_connections_are_counted_by_the_opening_thread(self):
+        pools = filestore.get_filestore_session().get_adapter("https://").poolmanager
+        pool = pools.connection_from_host("arena.example.com", 443, "https")
+        self.assertIsInstance(pool, filestore._CountingHTTPSConnectionPool)
+        before = filestore._opened_connections()
+        other = threading.Thread(target=pool._new_conn)
+        other.start()
+        other.join()
+        self.assertEqual(filestore._opened_connections(), before)
+        pool._new_conn()
+        self.assertEqual(filestore._opened_connections(), before + 1)
+
+
+class FilestoreTestCase(TestCase):
+    def setUp(self):
+        filestore._admin_tokens.clear()
+        filestore.clear_filestore_user_index()
+        filestore.filestore_breaker.record_success()
+        caches[settings.FILESTORE_TOKEN_CACHE_ALIAS].clear()
+        patcher = mock.patch.dict("os.environ", ENV)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(filestore, "get_rest_host", return_value=(False, "arena.example.com"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_routes(self, routes):
+        adapter = FakeAdapter(routes)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        patcher = mock.patch.object(filestore, "get_filestore_session", return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return adapter
+
+    def sent(self, adapter, path=None):
+        return [(r.method, r.path_url) for r, _ in adapter.sent if path is None or r.path_url == f"/storemng{path}"]
+
+
+class FilestoreHelperTests(FilestoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user(username="bob", password="pw")
+
+    def test_login_fallback_uses_pooled_session(self):
+        def admin_login(request):
+            return (200, "admin-jwt") if json.loads(request.body)["username"] == "admin" else (403, "")
+
+        adapter = self.use_routes({
+            ("POST", "/api/login"): admin_login,
+            ("GET", "/api/users"): (200, []),
+            ("GET", "/api/settings"): (200, {"defaults": {}}),
+            ("POST", "/api/users"): (201, ""),
+        })
+        # the user login keeps failing, the created user cannot login either
+        self.assertIsNone(filestore.login_filestore_user(self.bob))
+        self.assertEqual(self.sent(adapter), [
+            ("POST", "/storemng/api/login"),
+            ("POST", "/storemng/api/login"),
+            ("GET", "/storemng/api/users"),
+            ("GET", "/storemng/api/settings"),
+            ("POST", "/storemng/api/users"),
+            ("POST", "/storemng/api/login"),
+        ])
+        for _, kwargs in adapter.sent:
+            self.assertEqual(
+                (kwargs["verify"], kwargs["timeout"]),
+                (False, (filestore.FS_API_CONNECT_TIMEOUT, filestore.FS_API_TIMEOUT)),
+            )
+
+    def test_scope_update(self):
+        self.bob.is_staff = True
+        adapter = self.use_routes({
+            ("POST", "/api/login"): (200, "admin-jwt"),
+            ("GET", "/api/users"): (200, [{"id": 7, "username": "bob", "scope": "./users/bob", "perm": {}}]),
+            ("PUT", "/api/users/7"): (200, ""),
+        })
+        self.assertTrue(filestore.set_filestore_scope(self.bob))
+        request, _ = adapter.sent[-1]
+        self.assertEqual(request.headers["X-Auth"], "admin-jwt")
+        self.assertEqual(json.loads(request.body)["data"]["scope"], ".")
+
+
+class UserIndexTests(FilestoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user(username="bob", password="pw")
+        self.routes = {
+            ("POST", "/api/login"): (200, "admin-jwt"),
+            ("GET", "/api/users"): (200, [
+                {"id": 1, "username": "admin", "scope": ".", "perm": {"admin": True}},
+                {"id": 7, "username": "bob", "scope": "./users/bob", "perm": {"admin": False}},
+            ]),
+            ("PUT", "/api/users/7"): (200, ""),
+            ("DELETE", "/api/users/7"): (200, ""),
+            ("DELETE", "/api/resources/users/bob"): (200, ""),
+        }
+        self.adapter = self.use_routes(self.routes)
+
+    def downloads(self):
+        return self.sent(self.adapter, "/api/users").count(("GET", "/storemng/api/users"))
+
+    def test_lookups_use_index_until_ttl(self):
+        for _ in range(3):
+            self.assertEqual(filestore.get_filestore_user_json(self.bob, "arena.example.com", False)["id"], 7)
+        self.assertEqual(self.downloads(), 1)
+        later = time.monotonic() + filestore.FS_USER_INDEX_TTL + 1
+        with mock.patch.object(filestore.time, "monotonic", return_value=later):
+            filestore.get_filestore_user_json(self.bob, "arena.example.com", False)
+        self.assertEqual(self.downloads(), 2)
+
+    def test_records_are_copies(self):
+        filestore.get_filestore_user_json(self.bob, "arena.example.com", False)["perm"]["admin"] = True
+        self.assertFalse(filestore.get_filestore_user_json(self.bob, "arena.example.com", False)["perm"]["admin"])
+
+    def test_own_changes_update_index_in_place(self):
+        self.bob.is_staff = True
+        self.assertTrue(filestore.set_filestore_scope(self.bob))
+        self.assertEqual(filestore.get_filestore_user_json(self.bob, "arena.example.com", False)["scope"], ".")
+        self.assertEqual(self.downloads(), 1)
+        # deletes look up the account afresh, then drop it
+        self.assertTrue(filestore.delete_filestore_user(self.bob))
+        self.assertEqual(self.downloads(), 2)
+        self.assertIsNone(filestore.get_filestore_user_json(self.bob, "arena.example.com", False))
+        self.assertEqual(self.downloads(), 2)
+
+    def test_created_user_added_without_password(self):
+        amy = User.objects.create_user(username="amy", password="pw")
+        filestore.get_filestore_users("arena.example.com", False)
+        self.routes[("GET", "/api/settings")] = (200, {"defaults": {"perm": {}}})
+        self.routes[("POST", "/api/users")] = (201, "", {"Location": "/settings/users/9"})
+        filestore.add_filestore_auth(amy, "arena.example.com", False)
+        record = filestore.get_filestore_user_json(amy, "arena.example.com", False)
+        self.assertEqual((record["id"], record["scope"]), (9, "./users/amy"))
+        self.assertNotIn("password", record)
+        self.assertEqual(self.downloads(), 1)
+
+    def test_login_rechecks_index_before_adding_account(self):
+        """An account another worker added after our index was downloaded is updated, not added again."""
+        amy = User.objects.create_user(username="amy", password="pw")
+        filestore.get_filestore_users("arena.example.com", False)
+        self.routes[("GET", "/api/users")] = (200, [{"id": 9, "username": "amy", "scope": "./users/amy", "perm": {}}])
+        self.routes[("PUT", "/api/users/9")] = (200, "")
+        amy_logins = []
+
+        def login(request):
+            if json.loads(request.body)["username"] != "amy":
+                return 200, "admin-jwt"
+            amy_logins.append(request)
+            return (403, "") if len(amy_logins) == 1 else (200, make_jwt(user="amy"))
+
+        self.routes[("POST", "/api/login")] = login
+        self.assertTrue(filestore.login_filestore_user(amy))
+        self.assertEqual(self.downloads(), 2)
+        self.assertIn(("PUT", "/storemng/api/users/9"), self.sent(self.adapter))
+        self.assertNotIn(("POST", "/storemng/api/users"), self.sent(self.adapter))
+
+    def test_miss_logs_count_not_usernames(self):
+        amy = User.objects.create_user(username="amy", password="pw")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertIsNone(filestore.get_filestore_user_json(amy, "arena.example.com", False))
+        self.assertIn("of 2 users", out.getvalue())
+        self.assertNotIn("bob", out.getvalue())
+
+
+class UserTokenCacheTests(FilestoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user(username="bob", password="pw")
+        self.routes = {
+            ("POST", "/api/login"): lambda request: (200, make_jwt(user=json.loads(request.body)["username"])),
+            ("GET", "/api/users"): (200, [{"id": 7, "username": "bob", "scope": "./users/bob", "perm": {}}]),
+            ("PUT", "/api/users/7"): (200, ""),
+            ("DELETE", "/api/users/7"): (200, ""),
+            ("DELETE", "/api/resources/users/bob"): (200, ""),
+        }
+        self.adapter = self.use_routes(self.routes)
+
+    def user_logins(self):
+        return sum(
+            1 for request, _ in self.adapter.sent
+            if request.path_url == "/storemng/api/login" and json.loads(request.body)["username"] == "bob"
+        )
+
+    def test_repeat_storelogin_uses_cached_token(self):
+        token = filestore.login_filestore_user(self.bob)
+        for _ in range(3):
+            self.assertEqual(filestore.login_filestore_user(self.bob), token)
+        self.assertEqual(self.user_logins(), 1)
+
+    def test_token_near_exp_is_not_cached(self):
+        self.routes[("POST", "/api/login")] = (200, make_jwt(filestore.FS_TOKEN_REFRESH_MARGIN - 1))
+        filestore.login_filestore_user(self.bob)
+        filestore.login_filestore_user(self.bob)
+        self.assertEqual(self.user_logins(), 2)
+
+    def test_account_changes_evict_token(self):
+        for change in [filestore.set_filestore_scope, filestore.delete_filestore_user]:
+            filestore.login_filestore_user(self.bob)
+            logins = self.user_logins()
+            self.assertTrue(change(self.bob))
+            filestore.login_filestore_user(self.bob)
+            self.assertEqual(self.user_logins(), logins + 1)
+
+    @override_settings(LOCAL_CACHE_TIMEOUT=5)
+    def test_per_process_cache_keeps_token_briefly(self):
+        cache = caches[settings.FILESTORE_TOKEN_CACHE_ALIAS]
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            filestore.login_filestore_user(self.bob)
+        cache_set.assert_called_once_with(mock.ANY, mock.ANY, 5)
+
+    def test_password_version_is_part_of_key(self):
+        filestore.login_filestore_user(self.bob)
+        with mock.patch.object(filestore, "FS_PASSWORD_VERSION", filestore.FS_PASSWORD_VERSION + 1):
+            filestore.login_filestore_user(self.bob)
+        self.assertEqual(self.user_logins(), 2)
+
+
+class AdminTokenTests(FilestoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create_user(username=f"user{i}", is_staff=True) for i in range(5)]
+        self.tokens = []
+
+    def scope_routes(self, exp_in=7200):
+        def admin_login(request):
+            self.tokens.append(make_jwt(exp_in, n=len(self.tokens)))
+            return 200, self.tokens[-1]
+
+        records = [{"id": i, "username": user.username, "scope": ".", "perm": {}} for i, user in enumerate(self.users)]
+        routes = {("POST", "/api/login"): admin_login, ("GET", "/api/users"): (200, records)}
+        routes.update({("PUT", f"/api/users/{i}"): (200, "") for i in range(len(self.users))})
+        return routes
+
+    def test_bulk_scope_changes_login_once(self):
+        adapter = self.use_routes(self.scope_routes())
+        for user in self.users:
+            self.assertTrue(filestore.set_filestore_scope(user))
+        self.assertEqual(len(self.sent(adapter, "/api/login")), 1)
+
+    def test_token_renewed_before_exp(self):
+        adapter = self.use_routes(self.scope_routes(exp_in=filestore.FS_TOKEN_REFRESH_MARGIN + 5))
+        first = filestore.get_admin_token("arena.example.com", False)
+        self.assertEqual(filestore.get_admin_token("arena.example.com", False), first)
+        with mock.patch.object(filestore.time, "time", return_value=time.time() + 10):
+            self.assertNotEqual(filestore.get_admin_token("arena.example.com", False), first)
+        self.assertEqual(len(self.sent(adapter, "/api/login")), 2)
+
+    def test_unauthorized_logs_in_again_once(self):
+        routes = self.scope_routes()
+        # filebrowser refuses the first admin token, e.g. after a restart with a new key
+        routes[("GET", "/api/users")] = lambda request: (401 if request.headers["X-Auth"] == self.tokens[0] else 200, [])
+        adapter = self.use_routes(routes)
+        response = filestore.admin_request("GET", "arena.example.com", "/api/users", False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.sent(adapter, "/api/login")), 2)
+        # a refused fresh token is not retried again
+        routes[("GET", "/api/users")] = (401, "")
+        response = filestore.admin_request("GET", "arena.example.com", "/api/users", False)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(self.sent(adapter, "/api/login")), 3)
+
+    def test_concurrent_callers_share_one_login(self):
+        adapter = self.use_routes(self.scope_routes())
+        threads = [
+            threading.Thread(target=filestore.get_admin_token, args=("arena.example.com", False)) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.sent(adapter, "/api/login")), 1)
+
+    def test_token_exp(self):
+        self.assertAlmostEqual(filestore.get_token_exp(make_jwt(100)), time.time() + 100, delta=2)
+        self.assertIsNone(filestore.get_token_exp("not-a-jwt"))
+        self.assertIsNone(filestore.get_token_exp(jwt.encode({"user": "x"}, "fb-key", algorithm="HS256")))
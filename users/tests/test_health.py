@@ -1,15 +1,28 @@
+import threading
+import time
 from unittest.mock import MagicMock, patch
 
-from django.test import Client, TestCase
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 
+from users.health import HealthMonitor
 
+
+@override_settings(HEALTH_CACHE_TTL=0)
 class HealthCheckTests(TestCase):
     def setUp(self):
         self.client = Client()
 
-    @patch('users.api.get_filestore_health')
-    @patch('users.api.connection')
-    @patch('users.api.get_persist_db')
+    def assertHealth(self, response, status_code, expected):
+        self.assertEqual(response.status_code, status_code)
+        data = response.json()
+        self.assertEqual({key: data[key] for key in expected}, expected)
+        self.assertEqual(set(data["latency_ms"]), {"sqlite", "mongo", "filestore"})
+        self.assertGreaterEqual(data["age_s"], 0)
+        self.assertIsInstance(data["filestore_http"], dict)
+
+    @patch('users.health.get_filestore_health')
+    @patch('users.health.connection')
+    @patch('users.health.get_persist_db')
     def test_health_check_success(self, mock_get_persist_db, mock_connection, mock_filestore):
         # Mock SQLite success
         mock_cursor = MagicMock()
@@ -24,17 +37,16 @@ class HealthCheckTests(TestCase):
 
         response = self.client.get('/user/health')
 
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json(), {
+        self.assertHealth(response, 200, {
             "result": "success",
             "sqlite_status": "healthy",
             "mongo_status": "healthy",
             "filestore_status": "healthy",
         })
 
-    @patch('users.api.get_filestore_health')
-    @patch('users.api.connection')
-    @patch('users.api.get_persist_db')
+    @patch('users.health.get_filestore_health')
+    @patch('users.health.connection')
+    @patch('users.health.get_persist_db')
     def test_health_check_sqlite_failure(self, mock_get_persist_db, mock_connection, mock_filestore):
         # Mock SQLite failure
         mock_connection.cursor.side_effect = Exception("SQLite error")
@@ -48,17 +60,16 @@ class HealthCheckTests(TestCase):
 
         response = self.client.get('/user/health')
 
-        self.assertEqual(response.status_code, 503)
-        self.assertEqual(response.json(), {
+        self.assertHealth(response, 503, {
             "result": "failure",
             "sqlite_status": "unhealthy",
             "mongo_status": "healthy",
             "filestore_status": "healthy",
         })
 
-    @patch('users.api.get_filestore_health')
-    @patch('users.api.connection')
-    @patch('users.api.get_persist_db')
+    @patch('users.health.get_filestore_health')
+    @patch('users.health.connection')
+    @patch('users.health.get_persist_db')
     def test_health_check_mongo_failure(self, mock_get_persist_db, mock_connection, mock_filestore):
         # Mock SQLite success
         mock_cursor = MagicMock()
@@ -72,10 +83,66 @@ class HealthCheckTests(TestCase):
 
         response = self.client.get('/user/health')
 
-        self.assertEqual(response.status_code, 503)
-        self.assertEqual(response.json(), {
+        self.assertHealth(response, 503, {
             "result": "failure",
             "sqlite_status": "healthy",
             "mongo_status": "unhealthy",
             "filestore_status": "healthy",
         })
+
+    @patch('users.health.get_filestore_health')
+    @patch('users.health.connection')
+    @patch('users.health.get_persist_db')
+    def test_health_check_filestore_deadline(self, mock_get_persist_db, mock_connection, mock_filestore):
+        mock_connection.cursor.return_value.__enter__.return_value = MagicMock()
+        mock_get_persist_db.return_value = MagicMock()
+        mock_filestore.return_value = False
+
+        self.client.get('/user/health')
+
+        # the File Store request is bounded by the per-check deadline
+        mock_filestore.assert_called_with(timeout=2.0)
+        mock_get_persist_db.return_value.command.assert_called_with("ping", maxTimeMS=2000)
+
+
+class HealthMonitorTests(SimpleTestCase):
+    def test_checks_run_concurrently(self):
+        def slow(timeout):
+            time.sleep(0.2)
+
+        monitor = HealthMonitor({"a": slow, "b": slow, "c": slow})
+        begin = time.monotonic()
+        statuses, latencies = monitor.run_checks(timeout=2)
+        self.assertLess(time.monotonic() - begin, 0.5)
+        self.assertEqual(statuses, {"a": "healthy", "b": "healthy", "c": "healthy"})
+        self.assertTrue(all(latency >= 200 for latency in latencies.values()))
+
+    def test_check_past_deadline_is_unhealthy_and_not_restarted(self):
+        release = threading.Event()
+        calls = []
+
+        def hung(timeout):
+            calls.append(timeout)
+            release.wait(5)
+
+        monitor = HealthMonitor({"ok": lambda timeout: True, "hung": hung})
+        for _ in range(2):
+            statuses, latencies = monitor.run_checks(timeout=0.05)
+            self.assertEqual(statuses, {"ok": "healthy", "hung": "unhealthy"})
+            self.assertIsNone(latencies["hung"])
+        self.assertEqual(len(calls), 1)
+        release.set()
+
+    @override_settings(HEALTH_CACHE_TTL=60, HEALTH_CHECK_TIMEOUT=1)
+    def test_cached_result_is_served_with_its_age(self):
+        check = MagicMock(return_value=True)
+        monitor = HealthMonitor({"a": check})
+        with patch.object(monitor, "_ensure_refresher"):
+            checked_at, statuses, _ = monitor.get()
+            for _ in range(10):
+                self.assertEqual(monitor.get()[0], checked_at)
+            self.assertEqual(check.call_count, 1)
+            # a refresher that stopped refreshing is covered by checking inline
+            with patch("users.health.time.monotonic", return_value=checked_at + 500):
+                monitor.get()
+            self.assertEqual(check.call_count, 2)
@@ -0,0 +1,131 @@
+"""Tests for users/id_tokens.py and get_user_from_id_token in users/utils.py.
+
+Google's certs must be fetched once per Cache-Control max-age through a reused
+session, a verified token must not be verified again before its exp, and the
+verified Google account must resolve to its User in one query. No network is
+used: the session and google-auth verifier are mocked.
+"""
+
+import os
+import time
+from unittest import mock
+
+import requests
+from allauth.socialaccount.models import SocialAccount
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase
+
+from users import id_tokens
+from users.utils import get_user_from_id_token
+
+CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+CLIENT_IDS = {
+    "GAUTH_CLIENTID": "web-client",
+    "GAUTH_INSTALLED_CLIENTID": "installed-client",
+    "GAUTH_DEVICE_CLIENTID": "device-client",
+}
+
+
+def make_response(cache_control, status=200, body=b'{"kid": "cert"}'):
+    response = requests.Response()
+    response.status_code = status
+    response.headers["Cache-Control"] = cache_control
+    response._content = body
+    return response
+
+
+class CacheMaxAgeTests(SimpleTestCase):
+    def test_parses_max_age(self):
+        headers = requests.structures.CaseInsensitiveDict(
+            {"cache-control": "public, max-age=19779, must-revalidate, no-transform"}
+        )
+        self.assertEqual(id_tokens.cache_max_age(headers), 19779)
+
+    def test_uncacheable_responses(self):
+        for value in ["no-store", "no-cache, max-age=60", "public", ""]:
+            with self.subTest(value=value):
+                self.assertEqual(id_tokens.cache_max_age({"Cache-Control": value}), 0)
+
+
+class CachingRequestTests(SimpleTestCase):
+    def setUp(self):
+        self.session = mock.Mock(spec=requests.Session)
+        self.request = id_tokens.CachingRequest(session=self.session)
+
+    def test_certs_fetched_once_within_max_age(self):
+        self.session.request.return_value = make_response("public, max-age=3600")
+        for _ in range(5):
+            self.assertEqual(self.request(CERTS_URL).data, b'{"kid": "cert"}')
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_certs_refetched_after_max_age(self):
+        self.session.request.return_value = make_response("public, max-age=60")
+        self.request(CERTS_URL)
+        with mock.patch.object(id_tokens.time, "monotonic", return_value=time.monotonic() + 61):
+            self.request(CERTS_URL)
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_uncacheable_or_failed_responses_are_not_kept(self):
+        for response in [make_response("no-store"), make_response("max-age=3600", status=500)]:
+            self.session.request.reset_mock()
+            self.session.request.return_value = response
+            self.request(CERTS_URL)
+            self.request(CERTS_URL)
+            self.assertEqual(self.session.request.call_count, 2)
+
+    def test_shared_transport_reuses_one_session(self):
+        self.assertIs(id_tokens.get_cert_request(), id_tokens.get_cert_request())
+        self.assertIsInstance(id_tokens.get_cert_request().session, requests.Session)
+
+
+@mock.patch.dict(os.environ, CLIENT_IDS)
+class VerifyIdTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bob = User.objects.create_user(username="bob", password="pw")
+        SocialAccount.objects.create(user=cls.bob, provider="google", uid="google-sub-1")
+
+    def setUp(self):
+        caches[settings.ID_TOKEN_CACHE_ALIAS].clear()
+        patcher = mock.patch.object(id_tokens.id_token, "verify_oauth2_token")
+        self.verify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def claims(self, exp_in=3600, aud="web-client", sub="google-sub-1"):
+        return {"sub": sub, "aud": aud, "exp": int(time.time()) + exp_in}
+
+    def test_verified_token_is_cached_until_exp(self):
+        self.verify.return_value = self.claims()
+        for _ in range(3):
+            self.assertEqual(get_user_from_id_token("token-a"), self.bob)
+        self.assertEqual(self.verify.call_count, 1)
+        get_user_from_id_token("token-b")
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_expired_token_is_not_cached(self):
+        self.verify.return_value = self.claims(exp_in=-10)
+        id_tokens.verify_id_token("token-a")
+        id_tokens.verify_id_token("token-a")
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_invalid_token_is_not_cached(self):
+        self.verify.side_effect = ValueError("Token expired")
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                get_user_from_id_token("token-a")
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_user_resolved_in_one_query(self):
+        self.verify.return_value = self.claims()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_from_id_token("token-a"), self.bob)
+
+    def test_unknown_account_and_audience(self):
+        self.verify.return_value = self.claims(sub="google-sub-2")
+        with self.assertRaises(SocialAccount.DoesNotExist):
+            get_user_from_id_token("token-a")
+        self.verify.return_value = self.claims(aud="someone-else")
+        with self.assertRaisesMessage(ValueError, "Could not verify audience."):
+            get_user_from_id_token("token-b")
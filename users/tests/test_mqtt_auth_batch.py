@@ -0,0 +1,111 @@
+"""Tests for users/api.py mqtt_auth_batch: several tokens for one identity.
+
+The batch endpoint must verify the caller once and load their grants once,
+then issue one token per scene/device entry, reporting a bad entry in its own
+result instead of failing the whole request.
+"""
+
+import json
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import Client, TestCase, override_settings
+
+from users.api import MQTT_AUTH_BATCH_MAX
+from users.models import Scene
+from users.permissions import load_permission_snapshot
+from users.tests.mqtt_keys import PRIVATE_KEY_PATH, decode_token
+
+URL = "/user/v2/mqtt_auth_batch"
+
+
+@override_settings(MQTT_TOKEN_PRIVKEY=PRIVATE_KEY_PATH)
+class MQTTAuthBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bob = User.objects.create_user(username="bob", password="pw")
+        Scene.objects.create(name="carol/shared").editors.add(cls.bob)
+
+    def setUp(self):
+        caches[settings.PERMISSIONS_CACHE_ALIAS].clear()
+        self.client = Client()
+
+    def post(self, body):
+        return self.client.post(URL, data=json.dumps(body), content_type="application/json")
+
+    def test_one_token_per_entry(self):
+        self.client.force_login(self.bob)
+        response = self.post(
+            {
+                "requests": [
+                    {"scene": "bob/lobby", "client": "py1", "camid": True},
+                    {"scene": "carol/shared", "client": "py1"},
+                    {"device": "bob/robot", "client": "py1"},
+                ]
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["username"], "bob")
+        lobby, shared, robot = data["results"]
+        self.assertIn("camid", lobby["ids"])
+        self.assertNotEqual(lobby["ids"]["userid"], shared["ids"]["userid"])
+        self.assertIn(f"realm/s/carol/shared/o/{shared['ids']['userclient']}/#", decode_token(shared["token"])["publ"])
+        self.assertIn("realm/d/bob/robot/#", decode_token(robot["token"])["publ"])
+        self.assertEqual(robot["device"], "bob/robot")
+        for result in data["results"]:
+            self.assertIsNone(result["error"])
+
+    def test_per_entry_errors_do_not_fail_the_batch(self):
+        response = self.post(
+            {
+                "username": "anonymous-joe",
+                "requests": [
+                    {"scene": "carol/too/deep", "client": "py1"},
+                    {"scene": "carol/open", "client": "bad client"},
+                    {"scene": "carol/open", "device": "carol/robot", "client": "py1"},
+                    {"device": "carol/robot", "client": "py1"},
+                    {"scene": "carol/open", "client": "py1"},
+                ]
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(results[0]["error"], "Authentication required for this scene.")
+        self.assertEqual(results[1]["error"], "Invalid parameter: 'client'")
+        self.assertIn("not both", results[2]["error"])
+        self.assertIn("permission for device", results[3]["error"])
+        self.assertIsNone(results[4]["error"])
+        self.assertEqual(decode_token(results[4]["token"])["sub"], "anonymous-joe")
+
+    def test_identity_and_grants_resolved_once(self):
+        entries = [{"scene": f"bob/scene{i}", "client": "py1"} for i in range(10)]
+        with mock.patch("users.api.get_user_from_id_token", return_value=self.bob) as verify, mock.patch(
+            "users.api.load_permission_snapshot", wraps=load_permission_snapshot
+        ) as load:
+            response = self.post({"id_token": "token", "requests": entries})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 10)
+        verify.assert_called_once_with("token")
+        load.assert_called_once()
+
+    def test_bad_identity_fails_the_batch(self):
+        with mock.patch("users.api.get_user_from_id_token", side_effect=ValueError("Could not verify audience.")):
+            response = self.post({"id_token": "token", "requests": [{"scene": "bob/lobby", "client": "py1"}]})
+        self.assertEqual(response.status_code, 403)
+        response = self.post({"username": "joe", "requests": [{"scene": "bob/lobby", "client": "py1"}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_size_is_bounded(self):
+        self.client.force_login(self.bob)
+        self.assertEqual(self.post({"requests": []}).status_code, 400)
+        entries = [{"scene": "bob/lobby", "client": "py1"}] * (MQTT_AUTH_BATCH_MAX + 1)
+        self.assertEqual(self.post({"requests": entries}).status_code, 400)
+
+    def test_v1_requires_upgrade(self):
+        response = self.client.post(
+            "/user/mqtt_auth_batch", data=json.dumps({"requests": []}), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 426)
@@ -8,9 +8,10 @@ semantics are load-bearing for what a client is allowed to publish/subscribe.
 No database, no settings: plain unittest.TestCase.
 """
 
+import itertools
 import unittest
 
-from users.mqtt_match import MQTTMatcher, topic_matches_sub
+from users.mqtt_match import MQTTMatcher, compile_filter, topic_matches_sub
 
 # (subscription filter, concrete topic, should match)
 MATCH_CASES = [
@@ -85,6 +86,41 @@ class TopicMatchesSubTests(unittest.TestCase):
         self.assertFalse(topic_matches_sub("realm/s/ns/scene", "realm/s/#"))
 
 
+def trie_matches_sub(sub, topic):
+    """Reference answer from a one-filter MQTTMatcher trie."""
+    matcher = MQTTMatcher()
+    matcher[sub] = True
+    return next(matcher.iter_match(topic), None) is not None
+
+
+class CompiledFilterTests(unittest.TestCase):
+    def test_match_table_agrees_with_trie(self):
+        for sub, topic, _ in MATCH_CASES:
+            with self.subTest(sub=sub, topic=topic):
+                self.assertIs(compile_filter(sub).match(topic), trie_matches_sub(sub, topic))
+
+    def test_exhaustive_small_filters_agree_with_trie(self):
+        """Every filter/topic of up to 3 levels over a wildcard-heavy alphabet."""
+        alphabet = ["a", "b", "+", "#", "$x", ""]
+        strings = [
+            "/".join(levels)
+            for n in range(1, 4)
+            for levels in itertools.product(alphabet, repeat=n)
+        ]
+        for sub in strings:
+            matcher = compile_filter(sub)
+            for topic in strings:
+                if matcher.match(topic) is not trie_matches_sub(sub, topic):
+                    self.fail(f"compiled filter {sub!r} disagrees with trie on topic {topic!r}")
+
+    def test_non_trailing_hash_is_literal(self):
+        self.assertTrue(topic_matches_sub("a/#/b", "a/#/b"))
+        self.assertFalse(topic_matches_sub("a/#/b", "a/x/b"))
+
+    def test_compiled_filters_are_cached(self):
+        self.assertIs(compile_filter("realm/s/+/#"), compile_filter("realm/s/+/#"))
+
+
 class MQTTMatcherTests(unittest.TestCase):
     def test_set_and_get_item(self):
         matcher = MQTTMatcher()
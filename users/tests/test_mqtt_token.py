@@ -14,14 +14,21 @@ Namespace permission rows.
 
 import datetime
 import os
+import shutil
+import tempfile
 from unittest import mock
 
 import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
 from django.test import TestCase, override_settings
 
 from users.models import Namespace, Scene
-from users.mqtt import DEF_JWT_DURATION, generate_arena_token
+from users.mqtt import DEF_JWT_DURATION, expand_topics, generate_arena_token
+from users.signing import clear_signing_key
 from users.tests.mqtt_keys import (
     MISSING_KEY_PATH,
     PRIVATE_KEY_PATH,
@@ -63,6 +70,10 @@ class ArenaTokenTestCase(TestCase):
         cls.ns_view = Namespace.objects.create(name="grace")
         cls.ns_view.viewers.add(cls.edith)
 
+    def setUp(self):
+        # scene flags and grants are cached by name/id across test transactions
+        caches[settings.PERMISSIONS_CACHE_ALIAS].clear()
+
     def claims(self, **kwargs):
         token = generate_arena_token(**kwargs)
         self.assertIsNotNone(token, "expected a token, got None")
@@ -754,3 +765,60 @@ class ApiV1TokenTests(ArenaTokenTestCase):
         self.assertIn("realm/s/carol/shared/#", claims["publ"])
         self.assertIn("realm/env/carol/shared/#", claims["publ"])
         self.assertIn("realm/s/carol/shared/#", claims["subs"])
+
+
+class CompactTokenTests(ArenaTokenTestCase):
+    """The opt-in compact profile: same permissions, prefix-grouped claims."""
+
+    def setUp(self):
+        super().setUp()
+        self.key_dir = tempfile.mkdtemp(prefix="arena-account-ec-")
+        self.addCleanup(shutil.rmtree, self.key_dir, True)
+        self.addCleanup(clear_signing_key)
+
+    def write_key(self, key):
+        path = os.path.join(self.key_dir, f"{type(key).__name__}.pem")
+        with open(path, "wb") as fh:
+            fh.write(
+                key.private_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PrivateFormat.PKCS8,
+                    encryption_algorithm=serialization.NoEncryption(),
+                )
+            )
+        return path
+
+    def test_compact_claims_expand_to_the_full_lists(self):
+        kwargs = dict(user=self.staff, username="root", realm=REALM, ns_scene="carol/shared", ids=make_ids("root"))
+        full = self.claims(**kwargs)
+        compact = self.claims(compact=True, **kwargs)
+        self.assertNotIn("publ", compact)
+        self.assertNotIn("subs", compact)
+        self.assertEqual(expand_topics(compact["publ_c"]), full["publ"])
+        self.assertEqual(expand_topics(compact["subs_c"]), full["subs"])
+
+    @override_settings(MQTT_TOKEN_COMPACT=True)
+    def test_setting_enables_compact_claims(self):
+        claims = self.claims(user=self.edith, username="edith", realm=REALM, ids=make_ids("edith"))
+        self.assertIn("publ_c", claims)
+        self.assertEqual(claims["subs_c"][""], ["$NETWORK"])
+
+    def test_signing_algorithm_follows_key_type(self):
+        for key, alg in [
+            (ec.generate_private_key(ec.SECP256R1()), "ES256"),
+            (ed25519.Ed25519PrivateKey.generate(), "EdDSA"),
+        ]:
+            with self.subTest(alg=alg), override_settings(MQTT_TOKEN_PRIVKEY=self.write_key(key)):
+                token = generate_arena_token(
+                    user=self.edith, username="edith", realm=REALM, ids=make_ids("edith"), compact=True
+                )
+                self.assertEqual(token_header(token)["alg"], alg)
+                claims = jwt.decode(token, key.public_key(), algorithms=[alg])
+                self.assertIn("publ_c", claims)
+
+    def test_compact_es256_token_is_smaller(self):
+        kwargs = dict(user=self.edith, username="edith", realm=REALM, ids=make_ids("edith"))
+        rs256 = generate_arena_token(**kwargs)
+        with override_settings(MQTT_TOKEN_PRIVKEY=self.write_key(ec.generate_private_key(ec.SECP256R1()))):
+            es256 = generate_arena_token(compact=True, **kwargs)
+        self.assertLess(len(es256), len(rs256) - 200)
@@ -5,15 +5,26 @@ the topicv2_add_* builders define the exact topic grammar every ARENA client
 depends on. Both are pure list-in/list-out, so no database is needed.
 """
 
+import itertools
+import random
 import unittest
+from types import SimpleNamespace
 
 from users.mqtt import (
+    _build_topic_lists,
+    build_topic_lists,
     clean_topics,
+    compact_topics,
+    expand_topics,
+    fill_topic_template,
     topicv2_add_evhost,
     topicv2_add_rrhost,
     topicv2_add_scene_reader,
     topicv2_add_scene_writer,
 )
+from users.mqtt_match import topic_matches_sub
+from users.permissions import EMPTY_GRANTS, ScenePerms, UserGrants
+from users.versioning import API_V1, API_V2
 
 
 class CleanTopicsTests(unittest.TestCase):
@@ -99,6 +110,110 @@ class CleanTopicsTests(unittest.TestCase):
         clean_topics(topics)
         self.assertEqual(topics, ["realm/s/b", "realm/s/a", "realm/s/a"])
 
+    def test_matches_pairwise_collapse_on_random_topic_sets(self):
+        """The single-trie reducer must keep exactly what the pairwise collapse kept."""
+
+        def pairwise(topics):
+            _topics = []
+            for topic in sorted(set(topics)):
+                if not any(topic_matches_sub(have, topic) for have in _topics):
+                    _topics.append(topic)
+            return _topics
+
+        rng = random.Random(1234)
+        levels = ["realm", "s", "ns", "scene", "o", "uc", "uid", "-", "+", "#", "$NETWORK", ""]
+        for _ in range(300):
+            topics = [
+                "/".join(rng.choice(levels) for _ in range(rng.randint(1, 6)))
+                for _ in range(rng.randint(0, 25))
+            ]
+            with self.subTest(topics=topics):
+                self.assertEqual(clean_topics(topics), pairwise(topics))
+
+
+class CompactTopicsTests(unittest.TestCase):
+    def test_groups_by_realm_type_namespace(self):
+        topics = ["$NETWORK", "realm/d/bob/#", "realm/s/bob/+/+/+/+", "realm/s/bob/x/o/uc/#", "realm/s/carol/y/+/+/+"]
+        self.assertEqual(
+            compact_topics(topics),
+            {
+                "": ["$NETWORK"],
+                "realm/d/bob/": ["#"],
+                "realm/s/bob/": ["+/+/+/+", "x/o/uc/#"],
+                "realm/s/carol/": ["y/+/+/+"],
+            },
+        )
+
+    def test_expand_restores_sorted_topics(self):
+        topics = sorted(["$NETWORK/latency", "a/b", "a/b/c", "realm/g/ns/p/+", "realm/s/+/+/o/uc/#", "realm/s/ns/sc/"])
+        self.assertEqual(expand_topics(compact_topics(topics)), topics)
+
+
+class TopicTemplateTests(unittest.TestCase):
+    """Template-filled topic lists must equal the topic-by-topic build exactly."""
+
+    ANON = SimpleNamespace(is_authenticated=False, is_staff=False)
+    USER = SimpleNamespace(is_authenticated=True, is_staff=False)
+    STAFF = SimpleNamespace(is_authenticated=True, is_staff=True)
+
+    def ids(self, userid="uid", *extra):
+        ids = {"userid": userid, "userclient": f"{userid}_webScene"}
+        for key in extra:
+            ids[key] = {"camid": userid, "handleftid": f"handLeft_{userid}"}.get(key, "-")
+        return ids
+
+    def assertSameTopics(self, user, username, realm, ns_scene, ns_device, ids, perm, grants=EMPTY_GRANTS):
+        namespace, sceneid = ns_scene.split("/") if ns_scene else (None, None)
+        if ns_device:
+            namespace, deviceid = ns_device.split("/")
+        else:
+            deviceid = None
+        args = (user, username, realm, namespace, sceneid, deviceid, ids, perm, grants, API_V2)
+        self.assertEqual(build_topic_lists(*args), _build_topic_lists(*args))
+
+    def test_template_matches_full_build_across_shapes(self):
+        users = [(self.ANON, "anonymous-joe"), (self.USER, "alice"), (self.STAFF, "root")]
+        targets = [("alice/lobby", None), ("public/lobby", None), (None, None), (None, "alice/robot")]
+        ids_choices = [
+            None,
+            self.ids(),
+            self.ids("uid", "camid"),
+            self.ids("uid", "camid", "handleftid", "renderfusionid", "environmentid"),
+        ]
+        perms = [ScenePerms(*flags) for flags in itertools.product([True, False], repeat=5)]
+        for (user, username), (ns_scene, ns_device), ids, perm in itertools.product(
+            users, targets, ids_choices, perms
+        ):
+            if ids is None and not ns_device:
+                continue  # only device tokens are issued without ids
+            with self.subTest(user=username, scene=ns_scene, device=ns_device, ids=ids, perm=perm):
+                self.assertSameTopics(user, username, "realm", ns_scene, ns_device, ids, perm)
+
+    def test_equal_values_share_a_placeholder(self):
+        # the scene owner browsing their own namespace, user id reused as scene name
+        for user in (self.USER, self.STAFF):
+            self.assertSameTopics(user, "alice", "realm", "alice/alice", None, self.ids("alice", "camid"), ScenePerms())
+            self.assertSameTopics(user, "realm", "realm", "realm/realm", None, self.ids("realm"), ScenePerms())
+
+    def test_values_colliding_with_template_levels_fall_back(self):
+        perm = ScenePerms(public_write=True)
+        for value in ["s", "o", "p", "-", "+", "#", "$NETWORK", "", "a+b", "*early", "a/b"]:
+            with self.subTest(value=value):
+                ids = self.ids(value, "camid")
+                args = (self.USER, "alice", "realm", "alice", value, None, ids, perm, EMPTY_GRANTS, API_V2)
+                self.assertIsNone(fill_topic_template(*args))
+                self.assertSameTopics(self.USER, "alice", "realm", None, None, ids, perm)
+                self.assertEqual(build_topic_lists(*args), _build_topic_lists(*args))
+
+    def test_grants_and_v1_are_built_topic_by_topic(self):
+        grants = UserGrants(edit_namespaces=frozenset({"bob"}))
+        args = [self.USER, "alice", "realm", "alice", "lobby", None, self.ids(), ScenePerms(), grants, API_V2]
+        self.assertIsNone(fill_topic_template(*args))
+        self.assertEqual(build_topic_lists(*args), _build_topic_lists(*args))
+        args[8], args[9] = EMPTY_GRANTS, API_V1
+        self.assertIsNone(fill_topic_template(*args))
+        self.assertIsNotNone(fill_topic_template(*args[:9], API_V2))
+
 
 class Topicv2BuilderTests(unittest.TestCase):
     """Pin the exact v2 topic grammar; clients parse these level by level."""
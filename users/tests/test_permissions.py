@@ -0,0 +1,310 @@
+"""Tests for users/permissions.py: the permission snapshot behind every token.
+
+The snapshot replaces one ORM query per grant type and an exists()/get() pair
+on the scene, so these tests pin both what it loads and how many queries it
+takes to load it. Cached grants are invalidated by users/signals.py, so the
+cache tests change grants every supported way and expect a fresh read.
+"""
+
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from users.models import Namespace, Scene
+from users.permissions import (
+    DEFAULT_SCENE_PERMS,
+    EMPTY_GRANTS,
+    ScenePerms,
+    UserGrants,
+    get_user_grants,
+    get_scene_perms,
+    load_permission_snapshot,
+    load_scene_perms,
+    load_user_grants,
+)
+
+
+class PermissionSnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.anon = AnonymousUser()
+        cls.staff = User.objects.create_user(username="root", password="pw", is_staff=True)
+        cls.edith = User.objects.create_user(username="edith", password="pw")
+        cls.bob = User.objects.create_user(username="bob", password="pw")
+
+        cls.scene_edit = Scene.objects.create(name="carol/shared", public_write=True)
+        cls.scene_edit.editors.add(cls.edith)
+        cls.scene_view = Scene.objects.create(name="carol/viewonly", users=False)
+        cls.scene_view.viewers.add(cls.edith)
+        cls.ns_edit = Namespace.objects.create(name="frank")
+        cls.ns_edit.editors.add(cls.edith)
+        cls.ns_view = Namespace.objects.create(name="grace")
+        cls.ns_view.viewers.add(cls.edith)
+        # a row granted both ways lands in both sets
+        cls.ns_both = Namespace.objects.create(name="henry")
+        cls.ns_both.editors.add(cls.edith)
+        cls.ns_both.viewers.add(cls.edith)
+
+    def setUp(self):
+        caches[settings.PERMISSIONS_CACHE_ALIAS].clear()
+
+    def test_user_grants_by_kind(self):
+        with self.assertNumQueries(1):
+            grants = load_user_grants(self.edith)
+        self.assertEqual(
+            grants,
+            UserGrants(
+                edit_namespaces=frozenset({"frank", "henry"}),
+                view_namespaces=frozenset({"grace", "henry"}),
+                edit_scenes=frozenset({"carol/shared"}),
+                view_scenes=frozenset({"carol/viewonly"}),
+            ),
+        )
+        self.assertFalse(grants.is_empty)
+
+    def test_user_without_grants_is_empty(self):
+        with self.assertNumQueries(1):
+            grants = load_user_grants(self.bob)
+        self.assertEqual(grants, EMPTY_GRANTS)
+        self.assertTrue(grants.is_empty)
+
+    def test_anonymous_grants_need_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(load_user_grants(self.anon), EMPTY_GRANTS)
+
+    def test_scene_perms_from_row(self):
+        with self.assertNumQueries(1):
+            perm = load_scene_perms("carol/shared")
+        self.assertEqual(perm, DEFAULT_SCENE_PERMS._replace(public_write=True))
+        self.assertFalse(load_scene_perms("carol/viewonly").users)
+
+    def test_scene_perms_default_without_row(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(load_scene_perms("nobody/nothing"), DEFAULT_SCENE_PERMS)
+        with self.assertNumQueries(0):
+            self.assertEqual(load_scene_perms(None), DEFAULT_SCENE_PERMS)
+
+    def test_snapshot_is_immutable(self):
+        snapshot = load_permission_snapshot(self.edith, "carol/shared")
+        with self.assertRaises(AttributeError):
+            snapshot.scene.public_read = False
+        self.assertIsInstance(snapshot.grants.edit_namespaces, frozenset)
+        self.assertIsInstance(snapshot.scene, ScenePerms)
+
+    def test_snapshot_query_counts(self):
+        cases = [
+            ("anonymous scene", self.anon, "carol/shared", 1),
+            ("staff scene", self.staff, "carol/shared", 1),
+            ("user scene", self.edith, "carol/shared", 2),
+            ("user general", self.edith, None, 1),
+        ]
+        for label, user, ns_scene, queries in cases:
+            caches[settings.PERMISSIONS_CACHE_ALIAS].clear()
+            with self.subTest(case=label), self.assertNumQueries(queries):
+                load_permission_snapshot(user, ns_scene)
+
+    def test_repeat_snapshot_is_served_from_cache(self):
+        load_permission_snapshot(self.edith, "carol/shared")
+        with self.assertNumQueries(0):
+            snapshot = load_permission_snapshot(self.edith, "carol/shared")
+        self.assertEqual(snapshot.grants, load_user_grants(self.edith))
+        self.assertEqual(snapshot.scene, load_scene_perms("carol/shared"))
+
+    def test_staff_snapshot_skips_grants(self):
+        self.scene_edit.editors.add(self.staff)
+        self.assertEqual(load_permission_snapshot(self.staff, None).grants, EMPTY_GRANTS)
+
+
+class UserGrantsCacheTests(TestCase):
+    """Cached grants must follow every kind of grant change via signals."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.edith = User.objects.create_user(username="edith", password="pw")
+        cls.scene = Scene.objects.create(name="carol/shared")
+        cls.namespace = Namespace.objects.create(name="frank")
+
+    def setUp(self):
+        caches[settings.PERMISSIONS_CACHE_ALIAS].clear()
+
+    def assertCachedGrants(self, expected):
+        """Grants match expected, and a second read is served without a query."""
+        self.assertEqual(get_user_grants(self.edith), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_grants(self.edith), expected)
+
+    def test_repeat_reads_hit_the_cache(self):
+        with self.assertNumQueries(1):
+            get_user_grants(self.edith)
+        with self.assertNumQueries(0):
+            get_user_grants(self.edith)
+
+    def test_forward_add_and_remove_invalidate(self):
+        self.assertCachedGrants(EMPTY_GRANTS)
+        self.scene.editors.add(self.edith)
+        self.assertCachedGrants(UserGrants(edit_scenes=frozenset({"carol/shared"})))
+        self.scene.editors.remove(self.edith)
+        self.assertCachedGrants(EMPTY_GRANTS)
+
+    def test_clear_invalidates_previous_holders(self):
+        self.namespace.viewers.add(self.edith)
+        self.assertCachedGrants(UserGrants(view_namespaces=frozenset({"frank"})))
+        self.namespace.viewers.clear()
+        self.assertCachedGrants(EMPTY_GRANTS)
+
+    def test_set_invalidates(self):
+        self.namespace.editors.set([self.edith])
+        self.assertCachedGrants(UserGrants(edit_namespaces=frozenset({"frank"})))
+        self.namespace.editors.set([])
+        self.assertCachedGrants(EMPTY_GRANTS)
+
+    def test_reverse_add_invalidates(self):
+        self.assertCachedGrants(EMPTY_GRANTS)
+        self.edith.scene_viewers.add(self.scene)
+        self.assertCachedGrants(UserGrants(view_scenes=frozenset({"carol/shared"})))
+
+    def test_rename_invalidates(self):
+        self.namespace.editors.add(self.edith)
+        self.assertCachedGrants(UserGrants(edit_namespaces=frozenset({"frank"})))
+        self.namespace.name = "francis"
+        self.namespace.save()
+        self.assertCachedGrants(UserGrants(edit_namespaces=frozenset({"francis"})))
+
+    def test_delete_invalidates(self):
+        self.scene.editors.add(self.edith)
+        self.assertCachedGrants(UserGrants(edit_scenes=frozenset({"carol/shared"})))
+        Scene.objects.filter(name="carol/shared").delete()
+        self.assertCachedGrants(EMPTY_GRANTS)
+
+    def test_unrelated_users_keep_their_entry(self):
+        other = User.objects.create_user(username="olga", password="pw")
+        get_user_grants(other)
+        self.scene.editors.add(self.edith)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_grants(other), EMPTY_GRANTS)
+
+    def test_new_user_never_reads_a_previous_users_grants(self):
+        """A created user starts a new cache version, whatever its id held before."""
+        gone = User.objects.create_user(username="gone", password="pw")
+        self.scene.editors.add(gone)
+        self.assertEqual(get_user_grants(gone).edit_scenes, frozenset({"carol/shared"}))
+        user_id = gone.pk
+        gone.delete()
+        # recreate a row with the same primary key, as a restore would
+        fresh = User.objects.create_user(id=user_id, username="fresh", password="pw")
+        self.assertEqual(get_user_grants(fresh), EMPTY_GRANTS)
+
+
+class OtherProcessCacheTests(TestCase):
+    """A change made through one process must not be served from another's cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.edith = User.objects.create_user(username="edith", password="pw")
+        cls.scene = Scene.objects.create(name="carol/shared")
+        cls.scene.editors.add(cls.edith)
+
+    def shared_cache(self):
+        """Settings with a file-based cache, which every process on the host shares."""
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        backend = "django.core.cache.backends.filebased.FileBasedCache"
+        return override_settings(CACHES={"default": {"BACKEND": backend, "LOCATION": location}})
+
+    def other_process(self):
+        """A fresh instance of the permissions cache, as another worker process holds."""
+        cache = caches.create_connection(settings.PERMISSIONS_CACHE_ALIAS)
+        return mock.patch("users.permissions._grants_cache", return_value=cache)
+
+    def test_revoke_seen_through_shared_cache(self):
+        with self.shared_cache():
+            with self.other_process():
+                self.assertEqual(get_user_grants(self.edith).edit_scenes, frozenset({"carol/shared"}))
+            self.scene.editors.remove(self.edith)
+            with self.other_process():
+                self.assertEqual(get_user_grants(self.edith), EMPTY_GRANTS)
+
+    @override_settings(LOCAL_CACHE_TIMEOUT=5)
+    def test_per_process_cache_keeps_grants_briefly(self):
+        cache = caches[settings.PERMISSIONS_CACHE_ALIAS]
+        cache.clear()
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            get_user_grants(self.edith)
+        cache_set.assert_called_once_with(mock.ANY, mock.ANY, 5)
+
+    def test_scene_flags_change_seen_through_shared_cache(self):
+        with self.shared_cache():
+            with self.other_process():
+                self.assertTrue(get_scene_perms("carol/shared").public_read)
+            self.scene.public_read = False
+            self.scene.save()
+            with self.other_process():
+                self.assertFalse(get_scene_perms("carol/shared").public_read)
+
+    @override_settings(LOCAL_CACHE_TIMEOUT=5)
+    def test_per_process_cache_keeps_scene_flags_briefly(self):
+        cache = caches[settings.PERMISSIONS_CACHE_ALIAS]
+        cache.clear()
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            get_scene_perms("carol/shared")
+        cache_set.assert_called_once_with(mock.ANY, mock.ANY, 5)
+
+
+class ScenePermsCacheTests(TestCase):
+    """Cached scene flags, shared by every anonymous viewer of a scene."""
+
+    def setUp(self):
+        caches[settings.PERMISSIONS_CACHE_ALIAS].clear()
+
+    def assertCachedPerms(self, ns_scene, expected):
+        self.assertEqual(get_scene_perms(ns_scene), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_scene_perms(ns_scene), expected)
+
+    def test_many_viewers_cost_one_query(self):
+        Scene.objects.create(name="event/keynote", public_write=True)
+        with self.assertNumQueries(1):
+            for _ in range(500):
+                get_scene_perms("event/keynote")
+
+    def test_missing_scene_is_cached_as_defaults(self):
+        self.assertCachedPerms("nobody/nothing", DEFAULT_SCENE_PERMS)
+
+    def test_create_replaces_cached_defaults(self):
+        self.assertCachedPerms("carol/later", DEFAULT_SCENE_PERMS)
+        Scene.objects.create(name="carol/later", anonymous_users=False)
+        self.assertCachedPerms("carol/later", DEFAULT_SCENE_PERMS._replace(anonymous_users=False))
+
+    def test_save_invalidates(self):
+        scene = Scene.objects.create(name="carol/flags")
+        self.assertCachedPerms("carol/flags", DEFAULT_SCENE_PERMS)
+        scene.video_conference = False
+        scene.save()
+        self.assertCachedPerms("carol/flags", DEFAULT_SCENE_PERMS._replace(video=False))
+
+    def test_rename_invalidates_old_and_new_name(self):
+        scene = Scene.objects.create(name="carol/old", public_read=False)
+        self.assertCachedPerms("carol/old", DEFAULT_SCENE_PERMS._replace(public_read=False))
+        self.assertCachedPerms("carol/new", DEFAULT_SCENE_PERMS)
+        scene.name = "carol/new"
+        scene.save()
+        self.assertCachedPerms("carol/old", DEFAULT_SCENE_PERMS)
+        self.assertCachedPerms("carol/new", DEFAULT_SCENE_PERMS._replace(public_read=False))
+
+    def test_delete_invalidates(self):
+        Scene.objects.create(name="carol/gone", users=False)
+        self.assertCachedPerms("carol/gone", DEFAULT_SCENE_PERMS._replace(users=False))
+        Scene.objects.filter(name="carol/gone").delete()
+        self.assertCachedPerms("carol/gone", DEFAULT_SCENE_PERMS)
+
+    def test_invalid_names_are_not_cached(self):
+        for ns_scene in ["noslash", "too/many/parts", "bad name/x"]:
+            with self.subTest(ns_scene=ns_scene):
+                get_scene_perms(ns_scene)
+                with self.assertNumQueries(1):
+                    self.assertEqual(get_scene_perms(ns_scene), DEFAULT_SCENE_PERMS)
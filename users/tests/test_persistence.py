@@ -0,0 +1,479 @@
+"""Tests for the persist queries in users/persistence.py.
+
+Scene and namespace summaries must come from the materialized scene stats once
+built, fall back to aggregating arenaobjects before that, and builds must
+$merge all scenes or only recently updated ones. With PERSIST_WATCH they come
+from the change stream watcher while it runs. Scene objects are listed lazily,
+a page at a time. Mongo is mocked.
+"""
+
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from bson import ObjectId, Timestamp
+from django.contrib.auth.models import User
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from pymongo.errors import AutoReconnect, DuplicateKeyError, OperationFailure
+
+from users import persist_db, persist_watch, persistence, persistence_async
+
+UPDATED = datetime(2026, 1, 2, tzinfo=timezone.utc)
+
+
+@override_settings(PERSIST_STATS_INTERVAL=60, PERSIST_STATS_FULL_INTERVAL=3600)
+class SceneStatsTests(SimpleTestCase):
+    def setUp(self):
+        persistence.mongo_breaker.record_success()
+        self.db = defaultdict(mock.MagicMock)
+        patcher = mock.patch("users.persist_db.get_persist_db", return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(persistence, "_build_in_background")
+        self.build_in_background = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.objects = self.db["arenaobjects"]
+        self.stats = self.db[persistence.SCENE_STATS_COLLECTION]
+        self.meta = self.db[persistence.STATS_META_COLLECTION]
+        self.scenes = self.db[persist_watch.WATCH_COLLECTION]
+
+    def built(self, built_ago=10, full_ago=10):
+        now = time.time()
+        self.meta.find_one.return_value = {"built_at": now - built_ago, "full_built_at": now - full_ago}
+
+    def test_reads_aggregate_until_first_build(self):
+        self.meta.find_one.return_value = None
+        self.objects.aggregate.return_value = [{"name": "bob/lobby", "last_updated": UPDATED, "count": 3}]
+        self.assertEqual(persistence.read_persist_scenes_all(), {"bob/lobby": {"last_updated": UPDATED, "count": 3}})
+        self.build_in_background.assert_called_once_with(full=True)
+        self.stats.find.assert_not_called()
+
+    def test_reads_served_from_stats(self):
+        self.built()
+        docs = [{"namespace": "bob", "sceneId": "lobby", "last_updated": UPDATED, "count": 3}]
+        self.stats.find.return_value = docs
+        self.assertEqual(
+            persistence.read_persist_scenes_by_namespace(["bob"]), {"bob/lobby": {"last_updated": UPDATED, "count": 3}}
+        )
+        self.assertEqual(self.stats.find.call_args[0][0], {"namespace": {"$in": ["bob"]}})
+        self.stats.aggregate.return_value = [{"_id": "bob", "last_updated": UPDATED, "count": 5}]
+        self.assertEqual(persistence.read_persist_ns_all(), {"bob": {"last_updated": UPDATED, "count": 5}})
+        self.objects.aggregate.assert_not_called()
+        self.build_in_background.assert_not_called()
+
+    def test_due_builds_start_in_background(self):
+        self.built(built_ago=61, full_ago=120)
+        self.stats.find.return_value = []
+        persistence.read_persist_scenes_all()
+        self.build_in_background.assert_called_with(full=False)
+        self.built(built_ago=61, full_ago=3601)
+        persistence.read_persist_scenes_all()
+        self.build_in_background.assert_called_with(full=True)
+
+    @override_settings(PERSIST_STATS_INTERVAL=0)
+    def test_stats_disabled(self):
+        self.objects.aggregate.return_value = []
+        persistence.read_persist_scenes_all()
+        self.meta.find_one.assert_not_called()
+        self.objects.aggregate.assert_called_once()
+
+    def test_full_build_merges_all_scenes_and_drops_stale(self):
+        self.meta.find_one_and_update.return_value = {"_id": persistence.STATS_META_ID, "lease_until": 0}
+        self.stats.count_documents.return_value = 2
+        self.assertEqual(persistence.build_persist_scene_stats(), 2)
+        pipeline = self.objects.aggregate.call_args[0][0]
+        self.assertEqual(pipeline[0], persistence.SCENE_GROUP)
+        self.assertEqual(pipeline[-1]["$merge"]["into"], persistence.SCENE_STATS_COLLECTION)
+        run = pipeline[1]["$set"]["run"]["$literal"]
+        self.stats.delete_many.assert_called_once_with({"run": {"$ne": run}})
+        update = self.meta.update_one.call_args[0][1]["$set"]
+        self.assertEqual(update["lease_until"], 0)
+        self.assertIn("full_built_at", update)
+
+    def test_incremental_build_merges_updated_scenes_only(self):
+        built_at = time.time() - 60
+        self.meta.find_one_and_update.return_value = {"built_at": built_at, "full_built_at": built_at}
+        touched = [{"_id": {"namespace": "bob", "sceneId": "lobby"}}]
+        self.objects.aggregate.side_effect = [touched, []]
+        self.assertEqual(persistence.build_persist_scene_stats(), 1)
+        find_touched, merge = [call[0][0] for call in self.objects.aggregate.call_args_list]
+        since = find_touched[0]["$match"]["updatedAt"]["$gte"]
+        self.assertAlmostEqual(since.timestamp(), built_at - persistence.STATS_OVERLAP, places=3)
+        self.assertEqual(merge[0], {"$match": {"$or": [{"namespace": "bob", "sceneId": "lobby"}]}})
+        self.stats.delete_many.assert_not_called()
+        self.assertNotIn("full_built_at", self.meta.update_one.call_args[0][1]["$set"])
+
+    def test_leased_build_is_skipped(self):
+        self.meta.find_one_and_update.return_value = None
+        self.assertIsNone(persistence.build_persist_scene_stats())
+        self.objects.aggregate.assert_not_called()
+
+    def test_deletes_update_stats(self):
+        self.objects.delete_many.return_value.deleted_count = 4
+        self.assertTrue(persistence.delete_persist_scene_objects("bob", "lobby"))
+        self.stats.delete_many.assert_called_once_with({"namespace": "bob", "sceneId": "lobby"})
+
+
+class FakeStream:
+    """A change stream returning changes, then closing as if invalidated."""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.resume_token = {"_data": "0"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def alive(self):
+        return bool(self.changes)
+
+    def try_next(self):
+        change = self.changes.pop(0)
+        self.resume_token = {"_data": str(len(self.changes))}
+        return change
+
+
+def insert(namespace, scene, updated=UPDATED):
+    return {"operationType": "insert", "fullDocument": {"namespace": namespace, "sceneId": scene, "updatedAt": updated}}
+
+
+@override_settings(PERSIST_WATCH=True, PERSIST_STATS_INTERVAL=0)
+class SceneWatcherTests(SimpleTestCase):
+    def setUp(self):
+        persistence.mongo_breaker.record_success()
+        self.db = defaultdict(mock.MagicMock)
+        patcher = mock.patch("users.persist_db.get_persist_db", return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.objects = self.db["arenaobjects"]
+        self.meta = self.db[persistence.STATS_META_COLLECTION]
+        self.scenes = self.db[persist_watch.WATCH_COLLECTION]
+        self.meta.find_one.return_value = None
+        self.session = self.objects.database.client.start_session.return_value.__enter__.return_value
+        self.session.operation_time = Timestamp(1767225600, 4)
+        self.watcher = persist_watch.SceneWatcher()
+
+    def watch(self, changes):
+        self.objects.watch.return_value = FakeStream(changes)
+        return self.watcher._watch()
+
+    def test_seeds_then_applies_changes(self):
+        self.objects.aggregate.return_value = [{"name": "bob/lobby", "last_updated": UPDATED, "count": 2}]
+        later = datetime(2026, 1, 3, tzinfo=timezone.utc)
+        self.watch([
+            insert("bob", "lobby", later),
+            insert("ann", "club"),
+            {"operationType": "delete", "fullDocumentBeforeChange": {"namespace": "bob", "sceneId": "lobby"}},
+            {"operationType": "delete", "fullDocumentBeforeChange": {"namespace": "ann", "sceneId": "club"}},
+        ])
+        self.assertEqual(self.watcher._scenes, {"bob/lobby": {"last_updated": later, "count": 2}})
+        self.assertFalse(self.watcher._reseed)
+        self.objects.aggregate.assert_called_once()
+        self.assertIsNone(self.objects.watch.call_args[1]["resume_after"])
+
+    def test_stream_starts_after_seed_snapshot(self):
+        """The seed reads a snapshot before the stream opens, changes from just after it are applied once."""
+        self.objects.aggregate.return_value = [{"name": "bob/lobby", "last_updated": UPDATED, "count": 2}]
+        self.watch([])
+        self.objects.database.client.start_session.assert_called_once_with(snapshot=True)
+        self.assertIs(self.objects.aggregate.call_args[1]["session"], self.session)
+        self.assertEqual(self.objects.watch.call_args[1]["start_at_operation_time"], Timestamp(1767225600, 5))
+
+    def test_delete_without_pre_image_reseeds(self):
+        self.objects.aggregate.return_value = []
+        self.watcher._apply({"operationType": "delete", "documentKey": {"_id": 1}})
+        self.assertTrue(self.watcher._reseed)
+
+    @mock.patch.object(persist_watch, "WATCH_RESEED_INTERVAL", 0)
+    def test_reseed_reopens_stream_from_new_snapshot(self):
+        self.objects.aggregate.return_value = [{"name": "bob/lobby", "last_updated": UPDATED, "count": 2}]
+        self.assertTrue(self.watch([{"operationType": "delete", "documentKey": {"_id": 1}}, insert("bob", "lobby")]))
+        # the old summaries are served until the new seed replaces them
+        self.assertIsNone(self.watcher._token)
+        self.assertTrue(self.watcher._ready)
+        self.objects.aggregate.return_value = [{"name": "bob/lobby", "last_updated": UPDATED, "count": 1}]
+        self.assertFalse(self.watch([insert("bob", "lobby")]))
+        self.assertEqual(self.objects.aggregate.call_count, 2)
+        self.assertEqual(self.watcher._scenes, {"bob/lobby": {"last_updated": UPDATED, "count": 2}})
+
+    def test_resumes_from_checkpoint(self):
+        token = {"_data": "checkpoint"}
+        checkpoint = ObjectId()
+        self.meta.find_one.return_value = {"token": token, "checkpoint": checkpoint}
+        self.scenes.find.return_value = [{"name": "bob/lobby", "count": 2, "last_updated": UPDATED}]
+        self.watch([insert("bob", "lobby")])
+        self.assertEqual(self.scenes.find.call_args[0][0], {"checkpoint": checkpoint})
+        self.assertEqual(self.objects.watch.call_args[1]["resume_after"], token)
+        self.objects.aggregate.assert_not_called()
+        self.assertEqual(self.watcher._scenes, {"bob/lobby": {"last_updated": UPDATED, "count": 3}})
+
+    def test_checkpoint_replaced_while_loading_is_not_used(self):
+        self.meta.find_one.side_effect = [
+            {"token": {"_data": "old"}, "checkpoint": ObjectId()},
+            {"checkpoint": ObjectId()},
+        ]
+        self.scenes.find.return_value = []
+        self.objects.aggregate.return_value = [{"name": "bob/lobby", "last_updated": UPDATED, "count": 2}]
+        self.watch([])
+        self.objects.aggregate.assert_called_once()
+        self.assertIsNone(self.objects.watch.call_args[1]["resume_after"])
+
+    @mock.patch.object(persist_watch, "WATCH_CHECKPOINT_BATCH", 2)
+    def test_checkpoint_saves_one_document_per_scene(self):
+        self.watcher._scenes = {f"bob/room{i}": {"last_updated": UPDATED, "count": i + 1} for i in range(3)}
+        self.watcher._token = {"_data": "1"}
+        self.watcher._save_checkpoint()
+        inserted = [doc for call in self.scenes.insert_many.call_args_list for doc in call[0][0]]
+        self.assertEqual(self.scenes.insert_many.call_count, 2)
+        checkpoint = inserted[0]["checkpoint"]
+        self.assertEqual(inserted, [
+            {"checkpoint": checkpoint, "name": f"bob/room{i}", "count": i + 1, "last_updated": UPDATED}
+            for i in range(3)
+        ])
+        query, update = self.meta.update_one.call_args[0]
+        self.assertEqual(query["_id"], persist_watch.WATCH_META_ID)
+        self.assertEqual((update["$set"]["token"], update["$set"]["checkpoint"]), ({"_data": "1"}, checkpoint))
+        self.scenes.delete_many.assert_called_once_with({"checkpoint": {"$lt": checkpoint}})
+
+    def test_newer_checkpoint_of_another_worker_wins(self):
+        self.watcher._scenes = {"bob/lobby": {"last_updated": UPDATED, "count": 2}}
+        self.meta.update_one.side_effect = DuplicateKeyError("newer checkpoint")
+        self.watcher._save_checkpoint()
+        checkpoint = self.scenes.insert_many.call_args[0][0][0]["checkpoint"]
+        self.scenes.delete_many.assert_called_once_with({"checkpoint": checkpoint})
+
+    def test_standalone_mongod_falls_back_to_aggregation(self):
+        self.objects.watch.side_effect = OperationFailure(
+            "The $changeStream stage is only supported on replica sets", code=40573
+        )
+        self.watcher._run()
+        self.assertTrue(self.watcher._unsupported)
+        self.assertIsNone(self.watcher.get())
+        self.objects.aggregate.return_value = [{"name": "bob/lobby", "last_updated": UPDATED, "count": 3}]
+        with mock.patch.object(persist_watch, "scene_watcher", self.watcher):
+            self.assertEqual(persistence.read_persist_scenes_all(), {"bob/lobby": {"last_updated": UPDATED, "count": 3}})
+
+    def test_reads_served_from_watcher(self):
+        scenes = {
+            "bob/lobby": {"last_updated": UPDATED, "count": 2},
+            "bob/hall": {"last_updated": None, "count": 1},
+            "ann/club": {"last_updated": UPDATED, "count": 4},
+        }
+        with mock.patch.object(persist_watch.scene_watcher, "get", return_value=scenes):
+            self.assertEqual(persistence.read_persist_scenes_all(), scenes)
+            self.assertEqual(list(persistence.read_persist_scenes_by_namespace(["bob"])), ["bob/lobby", "bob/hall"])
+            self.assertEqual(persistence.read_persist_ns_all(), {
+                "bob": {"last_updated": UPDATED, "count": 3},
+                "ann": {"last_updated": UPDATED, "count": 4},
+            })
+        self.objects.aggregate.assert_not_called()
+
+
+class FakeCursor(list):
+    def close(self):
+        pass
+
+
+def scene_object(object_id, oid=None):
+    return {"_id": oid or ObjectId(), "object_id": object_id, "attributes": {"parent": ObjectId()}, "updatedAt": UPDATED}
+
+
+class SceneObjectsTests(SimpleTestCase):
+    def setUp(self):
+        persistence.mongo_breaker.record_success()
+        self.objects = mock.MagicMock()
+        patcher = mock.patch.object(persistence, "get_arenaobjects_collection", return_value=self.objects)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_summary_aggregates_updated_at_only(self):
+        self.objects.aggregate.return_value = [{"_id": None, "last_updated": UPDATED, "count": 7}]
+        self.assertEqual(persistence.read_persist_scene_summary("bob", "lobby"), {"last_updated": UPDATED, "count": 7})
+        match, project, group = self.objects.aggregate.call_args[0][0]
+        self.assertEqual(match, {"$match": {"namespace": "bob", "sceneId": "lobby"}})
+        self.assertEqual(project, {"$project": {"_id": 0, "updatedAt": 1}})
+        self.objects.find.assert_not_called()
+        self.objects.aggregate.return_value = []
+        self.assertEqual(persistence.read_persist_scene_summary("bob", "empty"), {"last_updated": None, "count": 0})
+
+    def test_objects_converted_lazily(self):
+        after = ObjectId()
+        doc = scene_object("box")
+        self.objects.find.return_value = FakeCursor([doc])
+        objects = persistence.iter_persist_scene_objects("bob", "lobby", after=str(after), limit=10)
+        self.objects.find.assert_not_called()
+        obj = next(objects)
+        self.assertEqual(obj["_id"], str(doc["_id"]))
+        self.assertEqual(obj["attributes"]["parent"], str(doc["attributes"]["parent"]))
+        self.assertEqual(obj["updatedAt"], UPDATED.isoformat())
+        query = self.objects.find.call_args[0][0]
+        self.assertEqual(query["_id"], {"$gt": after})
+        self.assertEqual(self.objects.find.call_args[1]["limit"], 10)
+
+    def test_connection_failure_counts_against_breaker(self):
+        self.objects.find.return_value.__iter__.side_effect = AutoReconnect("down")
+        with self.assertRaises(AutoReconnect):
+            list(persistence.iter_persist_scene_objects("bob", "lobby"))
+        self.assertEqual(persistence.mongo_breaker.snapshot()["failures"], 1)
+
+
+class SceneObjectsApiTests(TestCase):
+    URL = "/user/v2/scene_objects/bob/lobby"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bob = User.objects.create_user(username="bob", password="pw")
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.bob)
+        self.docs = [scene_object(f"box{i}") for i in range(3)]
+        self.objects = mock.MagicMock()
+        self.objects.find.side_effect = lambda query, limit, **kwargs: FakeCursor(self.docs[:limit])
+        patcher = mock.patch.object(persistence, "get_arenaobjects_collection", return_value=self.objects)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        persistence.mongo_breaker.record_success()
+        self.addCleanup(persistence.mongo_breaker.record_success)
+
+    def get(self, **params):
+        response = self.client.get(self.URL, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_full_page_links_next(self):
+        page = self.get(limit=2)
+        self.assertEqual([obj["object_id"] for obj in page["objects"]], ["box0", "box1"])
+        self.assertEqual(page["next"], str(self.docs[1]["_id"]))
+        self.assertIsNone(self.get(limit=5)["next"])
+
+    def test_empty_scene(self):
+        self.docs = []
+        self.assertEqual(self.get(), {"objects": [], "next": None})
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(self.URL, {"after": "nope"}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL, {"limit": 0}).status_code, 400)
+        self.assertEqual(self.client.get("/user/v2/scene_objects/carol/lobby").status_code, 403)
+
+    def test_unavailable_database(self):
+        cursor = mock.MagicMock()
+        cursor.__iter__.side_effect = AutoReconnect("mongodb down")
+        self.objects.find.side_effect = None
+        self.objects.find.return_value = cursor
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("error", response.json())
+        cursor.close.assert_called_once()
+
+
+class FakeAsyncCursor(FakeCursor):
+    async def to_list(self):
+        return list(self)
+
+    def __aiter__(self):
+        self.docs = iter(self)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        pass
+
+
+@override_settings(PERSIST_WATCH=False, PERSIST_STATS_INTERVAL=60)
+class AsyncPersistenceTests(SimpleTestCase):
+    def setUp(self):
+        persistence.mongo_breaker.record_success()
+        self.collections = defaultdict(mock.MagicMock)
+        for name in ("arenaobjects", "stats", "meta"):
+            self.collections[name].aggregate = mock.AsyncMock(return_value=FakeAsyncCursor())
+            self.collections[name].find_one = mock.AsyncMock(return_value=None)
+            self.collections[name].delete_many = mock.AsyncMock()
+        self.objects = self.collections["arenaobjects"]
+        for getter, name in (
+            ("get_arenaobjects_collection", "arenaobjects"),
+            ("get_scene_stats_collection", "stats"),
+            ("get_stats_meta_collection", "meta"),
+        ):
+            patcher = mock.patch.object(persistence_async, getter, return_value=self.collections[name])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(persistence, "_build_in_background")
+        self.build_in_background = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_reads_aggregate_until_first_build(self):
+        self.objects.aggregate.return_value = FakeAsyncCursor([{"name": "bob/lobby", "last_updated": UPDATED, "count": 3}])
+        self.assertEqual(
+            await persistence_async.read_persist_scenes_by_namespace(["bob"]),
+            {"bob/lobby": {"last_updated": UPDATED, "count": 3}},
+        )
+        self.assertEqual(self.objects.aggregate.call_args[0][0][0], {"$match": {"namespace": {"$in": ["bob"]}}})
+        self.build_in_background.assert_called_once_with(full=True)
+
+    async def test_reads_served_from_stats(self):
+        now = time.time()
+        self.collections["meta"].find_one.return_value = {"built_at": now, "full_built_at": now}
+        self.collections["stats"].find.return_value = FakeAsyncCursor(
+            [{"namespace": "bob", "sceneId": "lobby", "last_updated": UPDATED, "count": 3}]
+        )
+        self.assertEqual(
+            await persistence_async.read_persist_scenes_all(), {"bob/lobby": {"last_updated": UPDATED, "count": 3}}
+        )
+        self.objects.aggregate.assert_not_called()
+
+    async def test_summary_objects_and_deletes(self):
+        self.objects.aggregate.return_value = FakeAsyncCursor([{"_id": None, "last_updated": UPDATED, "count": 7}])
+        self.assertEqual(
+            await persistence_async.read_persist_scene_summary("bob", "lobby"), {"last_updated": UPDATED, "count": 7}
+        )
+        doc = scene_object("box")
+        self.objects.find.return_value = FakeAsyncCursor([doc])
+        objects = [obj async for obj in persistence_async.iter_persist_scene_objects("bob", "lobby")]
+        self.assertEqual(objects[0]["_id"], str(doc["_id"]))
+        self.objects.delete_many.return_value.deleted_count = 1
+        self.assertTrue(await persistence_async.delete_persist_scene_objects("bob", "lobby"))
+        self.collections["stats"].delete_many.assert_awaited_once_with({"namespace": "bob", "sceneId": "lobby"})
+
+    async def test_connection_failure_counts_against_breaker(self):
+        self.objects.aggregate.side_effect = AutoReconnect("down")
+        with self.assertRaises(AutoReconnect):
+            await persistence_async.read_persist_scene_summary("bob", "lobby")
+        self.assertEqual(persistence.mongo_breaker.snapshot()["failures"], 1)
+
+
+
+class AsyncClientTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(persist_db, async_client=None, async_loop=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_client_per_loop_closed_with_its_loop(self):
+        """Under WSGI every async view runs on a new loop, none may leave its client open."""
+        async def view():
+            persist_db.get_async_persist_db()
+            persist_db.get_async_persist_db()
+
+        clients = []
+        with mock.patch.object(persist_db, "AsyncMongoClient", side_effect=lambda *args, **kwargs: mock.AsyncMock()):
+            for _ in range(2):
+                async_to_sync(view)()
+                clients.append(persist_db.async_client)
+        self.assertIsNot(clients[0], clients[1])
+        for client in clients:
+            client.close.assert_awaited_once()
+        self.assertFalse(persist_db._async_closers)
@@ -0,0 +1,89 @@
+"""Tests for the reconcile_filestore management command.
+
+The Filebrowser user list must be read once and diffed against the Django
+users; missing accounts are created, wrong scopes fixed and orphans removed.
+A dry run changes nothing and a rerun after success finds nothing to do.
+"""
+
+import io
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+
+from users import filestore
+from users.management.commands import reconcile_filestore
+from users.management.commands.reconcile_filestore import CREATE, REMOVE, SCOPE, plan_reconcile
+from users.tests.test_filestore import FilestoreTestCase, make_jwt
+
+
+class ReconcileFilestoreTests(FilestoreTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(reconcile_filestore, "get_rest_host", return_value=(False, "arena.example.com"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bob = User.objects.create_user(username="bob")
+        self.amy = User.objects.create_user(username="amy")
+        self.root = User.objects.create_user(username="root", is_staff=True)
+        User.objects.create_user(username="carol", is_active=False)
+        self.accounts = {
+            "admin": {"id": 1, "username": "admin", "scope": ".", "perm": {"admin": True}},
+            "bob": {"id": 2, "username": "bob", "scope": "./users/bob", "perm": {"admin": False}},
+            "root": {"id": 3, "username": "root", "scope": "./users/root", "perm": {"admin": False}},
+            "ghost": {"id": 4, "username": "ghost", "scope": "./users/ghost", "perm": {"admin": False}},
+        }
+        self.routes = {
+            ("POST", "/api/login"): lambda request: (200, make_jwt()),
+            ("GET", "/api/users"): lambda request: (200, list(self.accounts.values())),
+            ("GET", "/api/settings"): (200, {"defaults": {"perm": {}}}),
+            ("POST", "/api/users"): self.create_account,
+            ("PUT", "/api/users/3"): self.update_account,
+            ("DELETE", "/api/resources/users/ghost"): (200, ""),
+            ("DELETE", "/api/users/4"): lambda request: (200, self.accounts.pop("ghost")),
+        }
+        self.adapter = self.use_routes(self.routes)
+
+    def create_account(self, request):
+        data = json.loads(request.body)["data"]
+        self.accounts[data["username"]] = {"id": 5, **data}
+        return 201, "", {"Location": "/settings/users/5"}
+
+    def update_account(self, request):
+        self.accounts["root"].update(json.loads(request.body)["data"])
+        return 200, ""
+
+    def writes(self):
+        return [sent for sent in self.sent(self.adapter) if sent[0] != "GET" and sent[1] != "/storemng/api/login"]
+
+    def test_plan(self):
+        plan = plan_reconcile(list(User.objects.all()), self.accounts, "admin")
+        self.assertEqual(
+            sorted((action, user.username) for action, user, _ in plan),
+            [(CREATE, "amy"), (REMOVE, "ghost"), (SCOPE, "root")],
+        )
+        plan = plan_reconcile(list(User.objects.all()), self.accounts, "admin", keep_orphans=True)
+        self.assertNotIn(REMOVE, [action for action, _, _ in plan])
+
+    def test_dry_run_changes_nothing(self):
+        out = io.StringIO()
+        call_command("reconcile_filestore", "--dry-run", stdout=out)
+        self.assertIn("1 to create, 1 to fix, 1 to remove", out.getvalue())
+        self.assertEqual(self.writes(), [])
+
+    def test_reconcile_then_nothing_left(self):
+        call_command("reconcile_filestore", "--concurrency", "2", stdout=io.StringIO())
+        self.assertEqual(set(self.accounts), {"admin", "bob", "root", "amy"})
+        self.assertEqual(self.accounts["root"]["scope"], ".")
+        self.assertEqual(self.sent(self.adapter).count(("GET", "/storemng/api/users")), 1)
+        # a rerun, e.g. to resume, reads the list afresh and finds nothing to do
+        filestore.clear_filestore_user_index()
+        out = io.StringIO()
+        call_command("reconcile_filestore", stdout=out)
+        self.assertIn("0 to create, 0 to fix, 0 to remove", out.getvalue())
+
+    def test_failed_actions_are_reported(self):
+        self.routes[("PUT", "/api/users/3")] = (500, "")
+        with self.assertRaisesMessage(CommandError, "1 of 3 actions failed"):
+            call_command("reconcile_filestore", stdout=io.StringIO(), stderr=io.StringIO())
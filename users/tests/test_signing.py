@@ -0,0 +1,105 @@
+"""Tests for users/signing.py: the cached MQTT token signing key.
+
+The key must be parsed once per process and only reloaded when the keyfile is
+replaced, so rotation still works without paying a PEM parse per token.
+No database is needed: plain SimpleTestCase with settings overrides.
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, ed448, ed25519, rsa
+from django.test import SimpleTestCase, override_settings
+
+from users import signing
+from users.tests.mqtt_keys import MISSING_KEY_PATH, PRIVATE_KEY_PATH
+
+
+def write_rsa_key(path):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(path, "wb") as fh:
+        fh.write(
+            key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption(),
+            )
+        )
+    return key
+
+
+class SigningKeyTests(SimpleTestCase):
+    def setUp(self):
+        signing.clear_signing_key()
+        self.addCleanup(signing.clear_signing_key)
+
+    @override_settings(MQTT_TOKEN_PRIVKEY=PRIVATE_KEY_PATH)
+    def test_returns_parsed_rsa_key(self):
+        self.assertIsInstance(signing.get_signing_key(), rsa.RSAPrivateKey)
+
+    @override_settings(MQTT_TOKEN_PRIVKEY=PRIVATE_KEY_PATH)
+    def test_key_is_parsed_once(self):
+        with mock.patch.object(
+            signing.serialization, "load_pem_private_key", wraps=serialization.load_pem_private_key
+        ) as load:
+            first = signing.get_signing_key()
+            for _ in range(5):
+                self.assertIs(signing.get_signing_key(), first)
+        self.assertEqual(load.call_count, 1)
+
+    @override_settings(MQTT_TOKEN_PRIVKEY=MISSING_KEY_PATH)
+    def test_missing_keyfile_returns_none(self):
+        self.assertIsNone(signing.get_signing_key())
+
+    @override_settings(MQTT_TOKEN_PRIVKEY=None)
+    def test_unset_keyfile_returns_none(self):
+        self.assertIsNone(signing.get_signing_key())
+
+    def test_replaced_keyfile_is_reloaded(self):
+        key_dir = tempfile.mkdtemp(prefix="arena-account-rotate-")
+        self.addCleanup(shutil.rmtree, key_dir, True)
+        path = os.path.join(key_dir, "key.pem")
+        old = write_rsa_key(path)
+        with override_settings(MQTT_TOKEN_PRIVKEY=path):
+            loaded = signing.get_signing_key()
+            self.assertEqual(loaded.private_numbers(), old.private_numbers())
+
+            # rotate by atomic rename, as a deployment would
+            staged = os.path.join(key_dir, "key.pem.new")
+            new = write_rsa_key(staged)
+            os.replace(staged, path)
+            reloaded = signing.get_signing_key()
+            self.assertEqual(reloaded.private_numbers(), new.private_numbers())
+
+    def test_changed_setting_loads_other_keyfile(self):
+        key_dir = tempfile.mkdtemp(prefix="arena-account-other-")
+        self.addCleanup(shutil.rmtree, key_dir, True)
+        path = os.path.join(key_dir, "other.pem")
+        other = write_rsa_key(path)
+        with override_settings(MQTT_TOKEN_PRIVKEY=PRIVATE_KEY_PATH):
+            first = signing.get_signing_key()
+        with override_settings(MQTT_TOKEN_PRIVKEY=path):
+            second = signing.get_signing_key()
+        self.assertIsNot(first, second)
+        self.assertEqual(second.private_numbers(), other.private_numbers())
+
+
+class SigningAlgorithmTests(SimpleTestCase):
+    def test_algorithm_follows_key_type(self):
+        for key, alg in [
+            (rsa.generate_private_key(public_exponent=65537, key_size=2048), "RS256"),
+            (ec.generate_private_key(ec.SECP256R1()), "ES256"),
+            (ec.generate_private_key(ec.SECP384R1()), "ES384"),
+            (ec.generate_private_key(ec.SECP521R1()), "ES512"),
+            (ed25519.Ed25519PrivateKey.generate(), "EdDSA"),
+            (ed448.Ed448PrivateKey.generate(), "EdDSA"),
+        ]:
+            with self.subTest(alg=alg):
+                self.assertEqual(signing.get_signing_algorithm(key), alg)
+
+    def test_unsupported_keys(self):
+        self.assertIsNone(signing.get_signing_algorithm(ec.generate_private_key(ec.SECP256K1())))
+        self.assertIsNone(signing.get_signing_algorithm(dsa.generate_private_key(key_size=1024)))
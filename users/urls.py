@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, re_path
 
 from . import views
@@ -13,9 +14,13 @@ urlpatterns = [
         views.SocialSignupView.as_view(),
         name="socialaccount_signup",
     ),
-    path("profile", views.user_profile, name="user_profile"),
-    path("profile/namespaces/", views.profile_namespaces, name="profile_namespaces"),
-    path("profile/scenes/", views.profile_scenes, name="profile_scenes"),
+    path("profile", views.auser_profile if settings.ASYNC_API else views.user_profile, name="user_profile"),
+    path(
+        "profile/namespaces/",
+        views.aprofile_namespaces if settings.ASYNC_API else views.profile_namespaces,
+        name="profile_namespaces",
+    ),
+    path("profile/scenes/", views.aprofile_scenes if settings.ASYNC_API else views.profile_scenes, name="profile_scenes"),
     path("profile/devices/", views.profile_devices, name="profile_devices"),
     path("login_callback", views.login_callback, name="login_callback"),
     re_path(r"^profile/namespaces/(?P<pk>[^\/]+)$", views.namespace_perm_detail),
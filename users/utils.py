@@ -1,18 +1,23 @@
+import asyncio
 import datetime
 import os
 import socket
 
 from allauth.socialaccount.models import SocialAccount
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
 from django.utils import timezone
-from google.auth.transport import requests as grequests
-from google.oauth2 import id_token
+from users.id_tokens import verify_id_token
 from users.models import Namespace, NamespaceDefault, Scene, SceneDefault
+from users.permissions import get_user_grants
 from users.persistence import (
     read_persist_ns_all,
     read_persist_scenes_all,
     read_persist_scenes_by_namespace,
 )
+from users.persistence_async import read_persist_ns_all as aread_persist_ns_all
+from users.persistence_async import read_persist_scenes_all as aread_persist_scenes_all
+from users.persistence_async import read_persist_scenes_by_namespace as aread_persist_scenes_by_namespace
 
 
 def get_rest_host():
@@ -93,10 +98,9 @@ def serialize_scene(scene):
     }
 
 
-def get_my_edit_namespaces(user, version):
+def _edit_namespace_rows(user):
     """
-    Internal method to update namespace permissions table:
-    Requests and returns list of user's editable namespaces from namespace permissions table.
+    Internal method returning the serialized namespaces 'user' can edit from the namespace permissions table.
     """
     # load list of namespaces this user can edit
     my_namespaces = Namespace.objects.none()
@@ -117,17 +121,21 @@ def get_my_edit_namespaces(user, version):
         existing_names = {d.get("name") for d in ns_out}
         if user.username not in existing_names:
             ns_out.append(vars(NamespaceDefault(name=user.username)))
-            existing_names.add(user.username)
+    return ns_out
+
+
+def _merge_edit_namespaces(user, ns_out, p_nss):
+    """
+    Internal method adding persisted namespaces and their counts to the editable namespaces 'ns_out'.
+    """
+    if user.is_authenticated and user.is_staff:  # admin/staff
         # for staff, add any non-user namespaces in persist db
-        p_nss = read_persist_ns_all()
-        if user.is_staff:  # admin/staff
-            for p_ns in p_nss:
-                if p_ns not in existing_names:
-                    if not User.objects.filter(username=p_ns).exists():
-                        ns_out.append(vars(NamespaceDefault(name=p_ns)))
-                        existing_names.add(p_ns)
-    else:
-        p_nss = read_persist_ns_all()
+        existing_names = {d.get("name") for d in ns_out}
+        for p_ns in p_nss:
+            if p_ns not in existing_names:
+                if not User.objects.filter(username=p_ns).exists():
+                    ns_out.append(vars(NamespaceDefault(name=p_ns)))
+                    existing_names.add(p_ns)
 
     # count persisted
     all_names = [ns["name"] for ns in ns_out]
@@ -139,10 +147,26 @@ def get_my_edit_namespaces(user, version):
     return apply_updated_at(ns_out, p_nss)
 
 
-def get_my_view_namespaces(user):
+def get_my_edit_namespaces(user, version):
     """
     Internal method to update namespace permissions table:
-    Requests and returns list of user's viewable namespaces from namespace permissions table.
+    Requests and returns list of user's editable namespaces from namespace permissions table.
+    """
+    ns_out = _edit_namespace_rows(user)
+    return _merge_edit_namespaces(user, ns_out, read_persist_ns_all())
+
+
+async def aget_my_edit_namespaces(user, version):
+    """
+    Internal method, async get_my_edit_namespaces(): the persist query overlaps the permissions queries.
+    """
+    ns_out, p_nss = await asyncio.gather(sync_to_async(_edit_namespace_rows)(user), aread_persist_ns_all())
+    return await sync_to_async(_merge_edit_namespaces)(user, ns_out, p_nss)
+
+
+def _view_namespace_rows(user):
+    """
+    Internal method returning the serialized namespaces 'user' can view from the namespace permissions table.
     """
     # load list of namespaces this user can view
     viewer_namespaces = Namespace.objects.none()
@@ -152,55 +176,70 @@ def get_my_view_namespaces(user):
 
     ns_out = [serialize_namespace(ns) for ns in viewer_namespaces]
 
-    ns_out = [ns for ns in ns_out if ns.get("name")]
-    return apply_updated_at(ns_out, read_persist_ns_all())
+    return [ns for ns in ns_out if ns.get("name")]
 
 
-def get_my_edit_scenes(user, version):
+def get_my_view_namespaces(user):
     """
-    Internal method to request edit scenes from persist and permissions:
-    1. Requests list of any scenes with objects saved from /persist/!allscenes.
-    2. Requests and returns list of user's editable scenes from scene permissions table.
+    Internal method to update namespace permissions table:
+    Requests and returns list of user's viewable namespaces from namespace permissions table.
+    """
+    return apply_updated_at(_view_namespace_rows(user), read_persist_ns_all())
+
+
+async def aget_my_view_namespaces(user):
+    """
+    Internal method, async get_my_view_namespaces(): the persist query overlaps the permissions queries.
+    """
+    ns_out, p_nss = await asyncio.gather(sync_to_async(_view_namespace_rows)(user), aread_persist_ns_all())
+    return apply_updated_at(ns_out, p_nss)
+
+
+def _edit_scene_namespaces(user):
+    """
+    Internal method returning the namespaces whose scenes 'user' can edit, None for all (staff).
+    """
+    if not user.is_authenticated:
+        return []
+    if user.is_staff:  # admin/staff
+        return None
+    return [user.username] + sorted(get_user_grants(user).edit_namespaces)
+
+
+def _edit_scene_rows(user, namespaces):
+    """
+    Internal method returning the serialized scenes 'user' can edit from the scene permissions table.
     """
     # load list of scenes this user can edit
     my_scenes = Scene.objects.none()
     editor_scenes = Scene.objects.none()
-    editor_namespaces = Namespace.objects.none()
-    p_scenes = {}
     if user.is_authenticated:
-        if user.is_staff:  # admin/staff
+        if namespaces is None:  # admin/staff
             my_scenes = Scene.objects.all()
-        else:  # standard user
+        else:  # standard user, own namespace first
             my_scenes = Scene.objects.filter(name__startswith=f"{user.username}/")
             editor_scenes = Scene.objects.filter(editors=user)
-            editor_namespaces = Namespace.objects.filter(editors=user)
-            for editor_namespace in editor_namespaces:
+            for editor_namespace in namespaces[1:]:
                 editor_ns_scenes = Scene.objects.filter(name__startswith=f"{editor_namespace}/")
                 editor_scenes = editor_scenes | editor_ns_scenes
     # merge 'my' scenes and extras scenes granted
     merged_scenes = (my_scenes | editor_scenes).distinct()
 
-    sc_out = [serialize_scene(sc) for sc in merged_scenes]
-
-    if user.is_authenticated:
-        # update scene list from object persistence db
-        if user.is_staff:  # admin/staff
-            p_scenes = read_persist_scenes_all()
-        else:  # standard user
-            # batch query for all namespaces
-            req_namespaces = [user.username]
-            for editor_namespace in editor_namespaces:
-                req_namespaces.append(editor_namespace.name)
-            p_scenes = read_persist_scenes_by_namespace(req_namespaces)
+    return [serialize_scene(sc) for sc in merged_scenes]
 
 
+def _merge_scenes(user, sc_out, p_scenes, mark_persisted=False):
+    """
+    Internal method adding persisted scenes and their counts to the scenes 'sc_out'.
+    """
+    if user.is_authenticated:
         existing_names = {d.get("name") for d in sc_out}
         for p_scene in p_scenes:
             # always add queried persisted scenes
             if p_scene not in existing_names:
                 sc_out.append(vars(SceneDefault(name=p_scene)))
                 existing_names.add(p_scene)
-        if user.is_staff:  # admin/staff
+        if mark_persisted and user.is_staff:  # admin/staff
             # count persisted
             p_scenes_set = set(p_scenes)
             for sc in sc_out:
@@ -210,44 +249,88 @@ def get_my_edit_scenes(user, version):
     return apply_updated_at(sc_out, p_scenes)
 
 
-def get_my_view_scenes(user, version):
+def get_my_edit_scenes(user, version):
     """
-    Internal method to request view scenes from persist and permissions:
-    1. Requests and returns list of user's viewable scenes from scene permissions table.
+    Internal method to request edit scenes from persist and permissions:
+    1. Requests list of any scenes with objects saved from /persist/!allscenes.
+    2. Requests and returns list of user's editable scenes from scene permissions table.
+    """
+    namespaces = _edit_scene_namespaces(user)
+    sc_out = _edit_scene_rows(user, namespaces)
+    # update scene list from object persistence db
+    p_scenes = {}
+    if namespaces is None:  # admin/staff
+        p_scenes = read_persist_scenes_all()
+    elif namespaces:  # standard user, batch query for all namespaces
+        p_scenes = read_persist_scenes_by_namespace(namespaces)
+    return _merge_scenes(user, sc_out, p_scenes, mark_persisted=True)
+
+
+async def aget_my_edit_scenes(user, version):
+    """
+    Internal method, async get_my_edit_scenes(): the persist query overlaps the scene permissions queries.
+    """
+    namespaces = await sync_to_async(_edit_scene_namespaces)(user)
+    rows = sync_to_async(_edit_scene_rows)(user, namespaces)
+    if namespaces is None:  # admin/staff
+        sc_out, p_scenes = await asyncio.gather(rows, aread_persist_scenes_all())
+    elif namespaces:  # standard user
+        sc_out, p_scenes = await asyncio.gather(rows, aread_persist_scenes_by_namespace(namespaces))
+    else:
+        sc_out, p_scenes = await rows, {}
+    return _merge_scenes(user, sc_out, p_scenes, mark_persisted=True)
+
+
+def _view_scene_namespaces(user):
+    """
+    Internal method returning the namespaces whose scenes 'user' can view, none for staff who edit them all.
+    """
+    if not user.is_authenticated or user.is_staff:
+        return []
+    return sorted(get_user_grants(user).view_namespaces)
+
+
+def _view_scene_rows(user, namespaces):
+    """
+    Internal method returning the serialized scenes 'user' can view from the scene permissions table.
     """
     # load list of scenes this user can view
     viewer_scenes = Scene.objects.none()
-    viewer_namespaces = Namespace.objects.none()
-    p_scenes = {}
     if user.is_authenticated:
         if not user.is_staff:  # admin/staff
             viewer_scenes = Scene.objects.filter(viewers=user)
-            viewer_namespaces = Namespace.objects.filter(viewers=user)
-            for viewer_namespace in viewer_namespaces:
+            for viewer_namespace in namespaces:
                 viewer_ns_scenes = Scene.objects.filter(name__startswith=f"{viewer_namespace}/")
                 viewer_scenes = viewer_scenes | viewer_ns_scenes
     # merge 'my' scenes and extras scenes granted
     merged_scenes = (viewer_scenes).distinct()
 
-    sc_out = [serialize_scene(sc) for sc in merged_scenes]
+    return [serialize_scene(sc) for sc in merged_scenes]
 
-    if user.is_authenticated:
-        # update scene list from object persistence db
-        if not user.is_staff:  # admin/staff
-            req_namespaces = []
-            for viewer_namespace in viewer_namespaces:
-                req_namespaces.append(viewer_namespace.name)
-            p_scenes = read_persist_scenes_by_namespace(req_namespaces)
 
-        existing_names = {d.get("name") for d in sc_out}
-        for p_scene in p_scenes:
-            # always add queried persisted scenes
-            if p_scene not in existing_names:
-                sc_out.append(vars(SceneDefault(name=p_scene)))
-                existing_names.add(p_scene)
+def get_my_view_scenes(user, version):
+    """
+    Internal method to request view scenes from persist and permissions:
+    1. Requests and returns list of user's viewable scenes from scene permissions table.
+    """
+    namespaces = _view_scene_namespaces(user)
+    sc_out = _view_scene_rows(user, namespaces)
+    # update scene list from object persistence db
+    p_scenes = read_persist_scenes_by_namespace(namespaces) if namespaces else {}
+    return _merge_scenes(user, sc_out, p_scenes)
 
-    sc_out = [sc for sc in sc_out if sc.get("name")]
-    return apply_updated_at(sc_out, p_scenes)
+
+async def aget_my_view_scenes(user, version):
+    """
+    Internal method, async get_my_view_scenes(): the persist query overlaps the scene permissions queries.
+    """
+    namespaces = await sync_to_async(_view_scene_namespaces)(user)
+    rows = sync_to_async(_view_scene_rows)(user, namespaces)
+    if namespaces:
+        sc_out, p_scenes = await asyncio.gather(rows, aread_persist_scenes_by_namespace(namespaces))
+    else:
+        sc_out, p_scenes = await rows, {}
+    return _merge_scenes(user, sc_out, p_scenes)
 
 
 def namespace_edit_permission(user, namespace):
@@ -324,9 +407,9 @@ def device_edit_permission(user, device):
     return False
 
 
-def get_user_from_id_token(gid_token):
+def get_google_uid_from_id_token(gid_token):
     """
-    Internal method to validate id_tokens from remote authentication.
+    Internal method to validate id_tokens from remote authentication, returns the Google Account ID.
     """
     if not gid_token:
         raise ValueError("Missing token.")
@@ -348,13 +431,30 @@ def get_user_from_id_token(gid_token):
         raise ValueError(
             "Missing environment variables: " + ", ".join(missing)
         )
-    idinfo = id_token.verify_oauth2_token(gid_token, grequests.Request())
+    idinfo = verify_id_token(gid_token)
     if idinfo["aud"] not in gclient_ids:
         raise ValueError("Could not verify audience.")
     # ID token is valid. Get the user's Google Account ID from the decoded token.
-    userid = idinfo["sub"]
-    g_user = SocialAccount.objects.get(uid=userid)
-    if not g_user:
-        raise ValueError("Database error.")
+    return idinfo["sub"]
 
-    return User.objects.get(username=g_user.user)
+
+def get_user_from_id_token(gid_token):
+    """
+    Internal method to validate id_tokens from remote authentication.
+    """
+    userid = get_google_uid_from_id_token(gid_token)
+    try:
+        return User.objects.get(socialaccount__uid=userid)
+    except User.DoesNotExist as err:
+        raise SocialAccount.DoesNotExist("SocialAccount matching query does not exist.") from err
+
+
+async def aget_user_from_id_token(gid_token):
+    """
+    Internal method, async get_user_from_id_token(): token checks run off the event loop.
+    """
+    userid = await sync_to_async(get_google_uid_from_id_token, thread_sensitive=False)(gid_token)
+    try:
+        return await User.objects.aget(socialaccount__uid=userid)
+    except User.DoesNotExist as err:
+        raise SocialAccount.DoesNotExist("SocialAccount matching query does not exist.") from err
@@ -1,10 +1,11 @@
+import asyncio
 import datetime
 import logging
 from http import HTTPStatus
-from operator import itemgetter
 from urllib.parse import urlparse
 
 from allauth.socialaccount.views import SignupView as SocialSignupViewDefault
+from asgiref.sync import sync_to_async
 from dal import autocomplete
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
@@ -39,9 +40,11 @@ from .mqtt import PUBLIC_NAMESPACE, generate_arena_token
 from .persistence import (
     delete_persist_namespace_objects,
     delete_persist_scene_objects,
-    read_persist_scene_objects,
+    read_persist_scene_summary,
 )
 from .utils import (
+    aget_my_edit_namespaces,
+    aget_my_edit_scenes,
     device_edit_permission,
     get_my_devices,
     get_my_edit_namespaces,
@@ -275,12 +278,10 @@ def scene_perm_detail(request, pk):
         form = SceneForm(instance=scene)
 
     namespace, sceneId = pk.split("/")
-    objects = read_persist_scene_objects(namespace, sceneId)
+    objects = read_persist_scene_summary(namespace, sceneId)
     objects_updated = None
-    if len(objects) > 0:
-        updated_ts = sorted(objects, reverse=True, key=itemgetter("updatedAt"))[0]["updatedAt"]
-        updated_dt = datetime.datetime.fromisoformat(updated_ts.replace("Z", "+00:00"))
-        objects_updated = f"{updated_dt.strftime('%B %d, %Y, %H:%M:%S')} UTC"
+    if objects["last_updated"]:
+        objects_updated = f"{objects['last_updated'].strftime('%B %d, %Y, %H:%M:%S')} UTC"
 
     return render(
         request=request,
@@ -290,7 +291,7 @@ def scene_perm_detail(request, pk):
             "owners": owners,
             "namespace_editors": namespace_editors,
             "namespace_viewers": namespace_viewers,
-            "objects_length": len(objects),
+            "objects_length": objects["count"],
             "objects_updated": objects_updated,
             "form": form,
         },
@@ -438,7 +439,26 @@ def user_profile(request):
     all_namespaces = get_my_edit_namespaces(request.user, version)
     all_scenes = get_my_edit_scenes(request.user, version)
     all_devices = get_my_devices(request.user)
+    return render_user_profile(request, all_namespaces, all_scenes, all_devices)
 
+
+async def auser_profile(request):
+    """
+    Async user_profile() for ASGI (settings.ASYNC_API): the dashboard's persist queries overlap its permission queries.
+    """
+    version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
+    if version == API_V1 or request.method == 'POST':
+        return await sync_to_async(user_profile)(request)
+    user = await request.auser()
+    all_namespaces, all_scenes, all_devices = await asyncio.gather(
+        aget_my_edit_namespaces(user, version),
+        aget_my_edit_scenes(user, version),
+        sync_to_async(lambda: list(get_my_devices(user)))(),
+    )
+    return await sync_to_async(render_user_profile)(request, all_namespaces, all_scenes, all_devices)
+
+
+def render_user_profile(request, all_namespaces, all_scenes, all_devices):
     # Dashboard slices -> "Recent 10" or just standard 10
     recent_namespaces = all_namespaces[:10]
     recent_scenes = all_scenes[:10]
@@ -500,8 +520,19 @@ class SocialSignupView(SocialSignupViewDefault):
 
 def profile_scenes(request):
     version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
-    all_scenes = get_my_edit_scenes(request.user, version)
+    return render_profile_scenes(request, get_my_edit_scenes(request.user, version))
+
 
+async def aprofile_scenes(request):
+    """
+    Async profile_scenes() for ASGI (settings.ASYNC_API): the persist query overlaps the permission queries.
+    """
+    version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
+    all_scenes = await aget_my_edit_scenes(await request.auser(), version)
+    return await sync_to_async(render_profile_scenes)(request, all_scenes)
+
+
+def render_profile_scenes(request, all_scenes):
     q = request.GET.get('q', '')
     if q:
         all_scenes = [sc for sc in all_scenes if q.lower() in sc.get('name', '').lower()]
@@ -563,8 +594,19 @@ def profile_devices(request):
 
 def profile_namespaces(request):
     version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
-    all_namespaces = get_my_edit_namespaces(request.user, version)
+    return render_profile_namespaces(request, get_my_edit_namespaces(request.user, version))
+
+
+async def aprofile_namespaces(request):
+    """
+    Async profile_namespaces() for ASGI (settings.ASYNC_API): the persist query overlaps the permission queries.
+    """
+    version = getattr(request, "version", SUPPORTED_API_VERSIONS[0])
+    all_namespaces = await aget_my_edit_namespaces(await request.auser(), version)
+    return await sync_to_async(render_profile_namespaces)(request, all_namespaces)
+
 
+def render_profile_namespaces(request, all_namespaces):
     q = request.GET.get('q', '')
     if q:
         all_namespaces = [ns for ns in all_namespaces if q.lower() in ns.get('name', '').lower()]